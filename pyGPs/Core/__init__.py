@@ -5,7 +5,10 @@ from . import mean
 from . import lik
 from . import gp
 from . import opt
+from . import inducing
+from . import parallel
+from . import serve
 
 
 
-__all__ = ['inf', 'cov', 'mean', 'lik','gp','opt']
+__all__ = ['inf', 'cov', 'mean', 'lik','gp','opt','inducing','parallel','serve']
@@ -44,6 +44,7 @@ from builtins import object
 #   ProductOfKernel   - products of covariance functions
 #   SumOfKernel       - sums of covariance functions
 #   FITCOfKernel      - Covariance function to be used together with the FITC approximation
+#   PITCOfKernel      - Covariance function to be used together with the PITC approximation
 #
 #
 # This is a object-oriented python implementation of gpml functionality
@@ -57,6 +58,7 @@ from builtins import object
 import numpy as np
 import math
 import scipy.spatial.distance as spdist
+from . import inducing
 
 class Kernel(object):
     """
@@ -64,6 +66,10 @@ class Kernel(object):
     there is no computation in this class, it just defines rules about a kernel class should have
     each covariance function will inherit it and implement its own behaviour
     """
+    # (index, power) of the hyperparameter scaling the whole kernel matrix,
+    # i.e. K = exp(power*hyp[index]) * K_unit; None if there is no such parameter
+    scaleHyp = None
+
     def __init__(self):
         self.hyp = []
         self.para = []
@@ -111,6 +117,41 @@ class Kernel(object):
 
 
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        '''
+        Compute derivatives wrt. the first input argument, i.e. the matrix
+        with entries d k(x_i,z_j) / d x_i[dim] (n by m).
+        Implemented for the stationary kernels RBF, RBFard, Matern, RQ, RQard,
+        Periodic, the dot-product kernels Const, Linear, LINard, Poly, for Noise
+        and for their sums, products and scalings.
+
+        :param x: inputs in shape (n,D) whose derivative is computed
+        :param z: inputs in shape (m,D), x if not given
+        :param int dim: index of the input dimension
+
+        :return: the corresponding derivative matrix
+        '''
+        raise Exception("Input derivatives are not implemented for "+type(self).__name__)
+
+
+
+    def getRandomFeatures(self,D,num):
+        '''
+        Random Fourier features of a stationary kernel (Rahimi & Recht, 2007),
+        k(x,z) ~ phi(x)'*phi(z) with phi(x) = amp * cos(W*x + b) and phases b
+        drawn uniformly from [0,2*pi) by the caller. The frequencies W are
+        drawn from the spectral density of the kernel.
+        Implemented for RBF, RBFard, Matern, RQ and their sums and scalings.
+
+        :param int D: input dimension
+        :param int num: number of features (per summand for sums)
+
+        :return: frequencies W (num by D) and amplitudes amp (num,)
+        '''
+        raise Exception("Random features are not implemented for "+type(self).__name__)
+
+
+
     def checkInputGetCovMatrix(self,x,z,mode):
         '''
         Check validity of inputs for the method getCovMatrix()
@@ -191,14 +232,31 @@ class Kernel(object):
 
 
 
-    def fitc(self,inducingInput):
+    def fitc(self,inducingInput,optimizeInducing=False):
         '''
         Covariance function to be used together with the FITC approximation.
         Setting FITC gp model will implicitly call this method.
 
+        :param inducingInput: inducing points in shape (nu,D)
+        :param bool optimizeInducing: treat the inducing points as hyperparameters
         :return: an instance of FITCOfKernel
         '''
-        return FITCOfKernel(self,inducingInput)
+        return FITCOfKernel(self,inducingInput,optimizeInducing)
+
+
+
+    def pitc(self,inducingInput,blocks=None,numBlocks=None,optimizeInducing=False,seed=0):
+        '''
+        Covariance function to be used together with the PITC approximation.
+
+        :param inducingInput: inducing points in shape (nu,D)
+        :param blocks: list of index arrays partitioning the training inputs
+        :param int numBlocks: number of k-means blocks if blocks is not given
+        :param bool optimizeInducing: treat the inducing points as hyperparameters
+        :param seed: seed of the k-means partition (None: drawn from np.random)
+        :return: an instance of PITCOfKernel
+        '''
+        return PITCOfKernel(self,inducingInput,blocks,numBlocks,optimizeInducing,seed)
 
 
 
@@ -259,6 +317,11 @@ class ProductOfKernel(Kernel):
             raise Exception("Error: der out of range for covProduct")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        A = self.cov1.getInputDerMatrix(x,z,dim) * self.cov2.getCovMatrix(x,z,'cross') \
+          + self.cov1.getCovMatrix(x,z,'cross') * self.cov2.getInputDerMatrix(x,z,dim)
+        return A
+
 
 
 class SumOfKernel(Kernel):
@@ -293,10 +356,21 @@ class SumOfKernel(Kernel):
             raise Exception("Error: der out of range for covSum")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        A = self.cov1.getInputDerMatrix(x,z,dim) + self.cov2.getInputDerMatrix(x,z,dim)
+        return A
+
+    def getRandomFeatures(self,D,num):
+        W1, amp1 = self.cov1.getRandomFeatures(D,num)
+        W2, amp2 = self.cov2.getRandomFeatures(D,num)
+        return np.vstack((W1,W2)), np.hstack((amp1,amp2))
+
 
 
 class ScaleOfKernel(Kernel):
     '''Scale of a kernel function.'''
+    scaleHyp = (0, 1.)
+
     def __init__(self,cov,scalar):
         self.cov = cov
         if cov.hyp:
@@ -321,11 +395,21 @@ class ScaleOfKernel(Kernel):
         self.checkInputGetDerMatrix(x,z,mode,der)
         sf2 = np.exp(self.hyp[0])                     # scale parameter
         if der == 0:                                  # compute derivative w.r.t. sf2
-            A = 2. * sf2 * self.cov.getCovMatrix(x,z,mode)
+            A = sf2 * self.cov.getCovMatrix(x,z,mode)
         else:
             A = sf2 * self.cov.getDerMatrix(x,z,mode,der-1)
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        sf2 = np.exp(self.hyp[0])                     # scale parameter
+        A = sf2 * self.cov.getInputDerMatrix(x,z,dim)
+        return A
+
+    def getRandomFeatures(self,D,num):
+        sf2 = np.exp(self.hyp[0])                     # scale parameter
+        W, amp = self.cov.getRandomFeatures(D,num)
+        return W, np.sqrt(sf2)*amp
+
 
 
 class FITCOfKernel(Kernel):
@@ -335,15 +419,32 @@ class FITCOfKernel(Kernel):
     interface of a proper covariance function.
     Instead of outputing the full covariance, it returns cross-covariances between
     the inputs x, z and the inducing inputs xu as needed by infFITC
+
+    If optimizeInducing is True, the inducing inputs are appended to the
+    hyperparameters (hyp = cov.hyp + xu flattened row by row), so that they are
+    learned together with the kernel hyperparameters. The inducing inputs are then
+    updated in place. Derivatives wrt. the inducing inputs need getInputDerMatrix()
+    of the kernel (RBF, RBFard, Matern, RQ and their sums, products and scalings).
     '''
-    def __init__(self,cov,inducingInput):
+    optimizeInducing = False    # class default, also for kernels pickled before the option existed
+
+    def __init__(self,cov,inducingInput,optimizeInducing=False):
+        if optimizeInducing:
+            inducingInput = np.array(inducingInput, dtype=float)    # private copy, updated in place
         self.inducingInput = inducingInput
+        self.optimizeInducing = optimizeInducing
         self.covfunc = cov
         self._hyp = cov.hyp
 
     def _getHyp(self):
+        if self.optimizeInducing:
+            return self.covfunc.hyp + self.inducingInput.flatten().tolist()
         return self._hyp
     def _setHyp(self, hyp):
+        if self.optimizeInducing:
+            nk = len(self.covfunc.hyp)
+            self.inducingInput[:] = np.reshape(hyp[nk:], self.inducingInput.shape)
+            hyp = list(hyp[:nk])
         self._hyp = hyp
         self.covfunc.hyp = hyp
     hyp = property(_getHyp,_setHyp)
@@ -376,6 +477,22 @@ class FITCOfKernel(Kernel):
                 assert(xu.shape[1] == x.shape[1])
             except AssertionError:
                 raise Exception('Dimensionality of inducing inputs must match training inputs')
+        nk = len(self.covfunc.hyp)
+        if der >= nk:                     # derivative wrt. coordinate dim of inducing point p
+            p, dim = divmod(der-nk, xu.shape[1])
+            if mode == 'self_test':
+                return np.zeros((z.shape[0],1))
+            elif mode == 'train':
+                dKuu = np.zeros((xu.shape[0],xu.shape[0]))
+                dKuu[p,:] = self.covfunc.getInputDerMatrix(x=xu[p:p+1,:],z=xu,dim=dim)
+                dKuu[:,p] = dKuu[p,:]
+                dKu = np.zeros((xu.shape[0],x.shape[0]))
+                dKu[p,:] = self.covfunc.getInputDerMatrix(x=xu[p:p+1,:],z=x,dim=dim)
+                return np.zeros((x.shape[0],1)), dKuu, dKu
+            elif mode == 'cross':
+                K = np.zeros((xu.shape[0],z.shape[0]))
+                K[p,:] = self.covfunc.getInputDerMatrix(x=xu[p:p+1,:],z=z,dim=dim)
+                return K
         if mode == 'self_test':           # self covariances for the test cases
             K = self.covfunc.getDerMatrix(z=z,mode='self_test',der=der)
             return K
@@ -388,6 +505,91 @@ class FITCOfKernel(Kernel):
             K = self.covfunc.getDerMatrix(x=xu,z=z,mode='cross',der=der)
             return K
 
+    def getInducingDer(self,x,Auu,Au):
+        '''
+        Derivatives of sum(Auu*Kuu) + sum(Au*Ku) wrt. the inducing inputs,
+        where Kuu and Ku are returned by getCovMatrix(x=x,mode='train').
+        Effort is O(nu*(n+nu)) per input dimension.
+
+        :param x: training inputs in shape (n,D)
+        :param Auu: adjoint of Kuu (nu by nu)
+        :param Au: adjoint of Ku (nu by n)
+
+        :return: list of derivatives in the order of the inducing inputs in hyp
+        '''
+        xu = self.inducingInput
+        S = Auu + Auu.T                   # Kuu is symmetric
+        G = np.zeros(xu.shape)
+        for dim in range(xu.shape[1]):
+            G[:,dim] = (S*self.covfunc.getInputDerMatrix(x=xu,z=xu,dim=dim)).sum(axis=1) \
+                     + (Au*self.covfunc.getInputDerMatrix(x=xu,z=x,dim=dim)).sum(axis=1)
+        return list(G.flatten())
+
+class PITCOfKernel(FITCOfKernel):
+    '''
+    Covariance function to be used together with the PITC approximation.
+    Like FITCOfKernel, but the training mode returns the list of covariance
+    matrices of the blocks of a partition of the training inputs instead of
+    the diagonal, i.e. K, Kuu, Ku = getCovMatrix(x=x,mode='train') where
+    K[b] is the covariance matrix of x[blocks[b],:].
+    The partition is given by blocks or, if not given, derived by k-means
+    with numBlocks blocks (by default blocks of about nu inputs), see
+    inducing.partition. The k-means partition is kept as long as x is unchanged;
+    it is computed with a fixed seed (0 by default) so that nlZ is reproducible.
+    '''
+    def __init__(self,cov,inducingInput,blocks=None,numBlocks=None,optimizeInducing=False,seed=0):
+        super(PITCOfKernel, self).__init__(cov,inducingInput,optimizeInducing)
+        self.blocks = blocks
+        self.numBlocks = numBlocks
+        self.seed = seed                   # seed of the k-means partition
+        self._blockKey = None              # training inputs the k-means partition was computed for
+        self._blocks = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()       # the k-means partition is not pickled
+        state['_blockKey'] = None
+        state['_blocks'] = None
+        return state
+
+    def getBlocks(self,x):
+        '''
+        Partition of the training inputs x into blocks.
+
+        :return: list of index arrays
+        '''
+        if not self.blocks is None:
+            return self.blocks
+        key = self._blockKey
+        if key is None or key.shape != x.shape or not np.array_equal(key, x):
+            n = x.shape[0]
+            numBlocks = self.numBlocks
+            if numBlocks is None:
+                numBlocks = int(np.ceil(old_div(float(n), self.inducingInput.shape[0])))
+            self._blocks = inducing.partition(x, numBlocks, self.seed)
+            self._blockKey = np.array(x)
+        return self._blocks
+
+    def getCovMatrix(self,x=None,z=None,mode=None):
+        if mode == 'train':
+            self.checkInputGetCovMatrix(x,z,mode)
+            Kdiag, Kuu, Ku = super(PITCOfKernel, self).getCovMatrix(x=x,mode='train')
+            K = [self.covfunc.getCovMatrix(x=x[idx,:],mode='train') for idx in self.getBlocks(x)]
+            return K, Kuu, Ku
+        return super(PITCOfKernel, self).getCovMatrix(x=x,z=z,mode=mode)
+
+    def getDerMatrix(self,x=None,z=None,mode=None,der=None):
+        if mode == 'train':
+            self.checkInputGetDerMatrix(x,z,mode,der)
+            Kdiag, Kuu, Ku = super(PITCOfKernel, self).getDerMatrix(x=x,mode='train',der=der)
+            if der >= len(self.covfunc.hyp):   # blocks do not depend on the inducing inputs
+                K = [np.zeros((len(idx),len(idx))) for idx in self.getBlocks(x)]
+            else:
+                K = [self.covfunc.getDerMatrix(x=x[idx,:],mode='train',der=der) for idx in self.getBlocks(x)]
+            return K, Kuu, Ku
+        return super(PITCOfKernel, self).getDerMatrix(x=x,z=z,mode=mode,der=der)
+
+
+
 class Gabor(Kernel):
     '''
     Gabor covariance function with length scale ell and period p. The
@@ -628,6 +830,8 @@ class Poly(Kernel):
     :param log_sigma: signal deviation.
     :param d: degree of polynomial (not treated as hyperparameter, i.e. will not be trained).
     '''
+    scaleHyp = (1, 2.)
+
     def __init__(self, log_c=0., d=2, log_sigma=0. ):
         self.hyp = [log_c, log_sigma]
         self.para = [d]
@@ -678,6 +882,18 @@ class Poly(Kernel):
             raise Exception("Wrong derivative entry in Poly")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        c   = np.exp(self.hyp[0])             # inhomogeneous offset
+        sf2 = np.exp(2.*self.hyp[1])          # signal variance
+        ord = self.para[0]                    # order of polynomial
+        if np.abs(ord-np.round(ord)) < 1e-8:  # remove numerical error from format of parameter
+            ord = int(round(ord))
+        ord = int(ord)
+        A = ord * sf2 * (c + np.dot(x,z.T))**(ord-1) * z[:,dim:dim+1].T
+        return A
+
 
 
 class PiecePoly(Kernel):
@@ -689,6 +905,8 @@ class PiecePoly(Kernel):
     :param log_sigma: signal deviation.
     :param v: degree v will be rounded to 0,1,2,or 3. (not treated as hyperparameter, i.e. will not be trained).
     '''
+    scaleHyp = (1, 2.)
+
     def __init__(self, log_ell=0., v=2, log_sigma=0. ):
         self.hyp = [log_ell, log_sigma]
         self.para = [v]
@@ -790,6 +1008,8 @@ class RBF(Kernel):
     :param log_ell: characteristic length scale.
     :param log_sigma: signal deviation.
     '''
+    scaleHyp = (1, 2.)
+
     def __init__(self, log_ell=0., log_sigma=0.):
         self.hyp = [log_ell, log_sigma]
 
@@ -827,6 +1047,21 @@ class RBF(Kernel):
             raise Exception("Calling for a derivative in RBF that does not exist")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        ell = np.exp(self.hyp[0])         # characteristic length scale
+        sf2 = np.exp(2.*self.hyp[1])      # signal variance
+        A = sf2 * np.exp(-0.5*spdist.cdist(old_div(x,ell),old_div(z,ell),'sqeuclidean'))
+        A = -A * (x[:,dim:dim+1] - z[:,dim:dim+1].T) / ell**2
+        return A
+
+    def getRandomFeatures(self,D,num):
+        ell = np.exp(self.hyp[0])         # characteristic length scale
+        sf2 = np.exp(2.*self.hyp[1])      # signal variance
+        W = old_div(np.random.randn(num,D), ell)      # Gaussian spectral density
+        return W, np.sqrt(2.*sf2/num)*np.ones(num)
+
 
 
 class RBFunit(Kernel):
@@ -878,6 +1113,8 @@ class RBFard(Kernel):
     :param log_ell_list: characteristic length scale for each dimension.
     :param log_sigma: signal deviation.
     '''
+    scaleHyp = (-1, 2.)
+
     def __init__(self, D=None, log_ell_list=None, log_sigma=0.):
         if log_ell_list is None:
             self.hyp = [0. for i in range(D)] + [log_sigma]
@@ -937,6 +1174,22 @@ class RBFard(Kernel):
             raise Exception("Wrong derivative index in RDFard")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        n, D = x.shape
+        ell = old_div(1.,np.exp(self.hyp[0:D]))    # inverse characteristic length scales
+        sf2 = np.exp(2.*self.hyp[D])      # signal variance
+        A = sf2*np.exp(-0.5*spdist.cdist(x*ell,z*ell,'sqeuclidean'))
+        A = -A * (x[:,dim:dim+1] - z[:,dim:dim+1].T) * ell[dim]**2
+        return A
+
+    def getRandomFeatures(self,D,num):
+        ell = old_div(1.,np.exp(self.hyp[0:D]))    # inverse characteristic length scales
+        sf2 = np.exp(2.*self.hyp[D])      # signal variance
+        W = np.random.randn(num,D) * ell
+        return W, np.sqrt(2.*sf2/num)*np.ones(num)
+
 
 class Const(Kernel):
     '''
@@ -944,6 +1197,8 @@ class Const(Kernel):
 
     :param log_sigma: signal deviation.
     '''
+    scaleHyp = (0, 1.)
+
     def __init__(self, log_sigma=0.):
         self.hyp = [log_sigma]
 
@@ -981,6 +1236,12 @@ class Const(Kernel):
             raise Exception("Wrong derivative entry in covConst")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        A = np.zeros((x.shape[0],z.shape[0]))
+        return A
+
 
 
 class Linear(Kernel):
@@ -989,6 +1250,8 @@ class Linear(Kernel):
 
     :param log_sigma: signal deviation.
     '''
+    scaleHyp = (0, 1.)
+
     def __init__(self, log_sigma=0.):
         self.hyp = [ log_sigma ]
 
@@ -1023,6 +1286,13 @@ class Linear(Kernel):
             raise Exception("Wrong derivative index in covLinear")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        sf2 = np.exp(self.hyp[0])         # s2
+        A = sf2 * np.tile(z[:,dim], (x.shape[0],1))
+        return A
+
 
 
 class LINard(Kernel):
@@ -1073,6 +1343,13 @@ class LINard(Kernel):
             raise Exception("Wrong derivative index in covLINard")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        ell = np.exp(self.hyp)            # ARD parameters
+        A = np.tile(old_div(z[:,dim],ell[dim]), (x.shape[0],1))
+        return A
+
 
 
 class Matern(Kernel):
@@ -1087,6 +1364,8 @@ class Matern(Kernel):
     :param log_ell: characteristic length scale.
     :param log_sigma: signal deviation.
     '''
+    scaleHyp = (1, 2.)
+
     def __init__(self, log_ell=0., d=3, log_sigma=0. ):
         self.hyp = [ log_ell, log_sigma ]
         self.para = [d]
@@ -1111,7 +1390,7 @@ class Matern(Kernel):
         elif d == 5:
             return (old_div(1.,3.))*(t + t*t)
         elif d == 7:
-            return (old_div(1.,15.))*(t + 3.*t*t + t*t*t)
+            return (old_div(1.,15.))*(3.*t + 3.*t*t + t*t*t)
         else:
             raise Exception("Wrong value for d in Matern")
 
@@ -1170,7 +1449,6 @@ class Matern(Kernel):
             x = np.sqrt(d)*x/ell
             z = np.sqrt(d)*z/ell
             A = np.sqrt(spdist.cdist(x, z, 'sqeuclidean'))
-        A = sf2 * self.mfunc(d,A)
         if der == 0:                    # compute derivative matrix wrt 1st parameter
             A = sf2 * self.dmfunc(d,A)
         elif der == 1:                  # compute derivative matrix wrt 2nd parameter
@@ -1181,6 +1459,37 @@ class Matern(Kernel):
             raise Exception("Wrong derivative value in Matern")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        ell = np.exp(self.hyp[0])        # characteristic length scale
+        sf2 = np.exp(2.* self.hyp[1])    # signal variance
+        d   = self.para[0]               # 2 times nu
+        if np.abs(d-np.round(d)) < 1e-8: # remove numerical error from format of parameter
+            d = int(round(d))
+        d = int(d)
+        if not d in [1,3,5,7]:
+            d = 3
+        t = np.sqrt(spdist.cdist(np.sqrt(d)*x/ell, np.sqrt(d)*z/ell, 'sqeuclidean'))
+        tt = np.where(t > 0, t, 1.)
+        q = old_div(self.dfunc(d,tt), tt)  # dfunc(d,t)/t, limit at t=0 (zero for d=1)
+        q = np.where(t > 0, q, {1:0., 3:1., 5:old_div(1.,3.), 7:old_div(1.,5.)}[d])
+        A = -sf2 * np.exp(-t) * q * d * (x[:,dim:dim+1] - z[:,dim:dim+1].T) / ell**2
+        return A
+
+    def getRandomFeatures(self,D,num):
+        ell = np.exp(self.hyp[0])        # characteristic length scale
+        sf2 = np.exp(2.* self.hyp[1])    # signal variance
+        d   = self.para[0]               # 2 times nu
+        if np.abs(d-np.round(d)) < 1e-8: # remove numerical error from format of parameter
+            d = int(round(d))
+        d = int(d)
+        if not d in [1,3,5,7]:
+            d = 3
+        u = np.random.chisquare(d, size=(num,1))      # Student-t spectral density with d degrees of freedom
+        W = np.random.randn(num,D) / ell * np.sqrt(old_div(d,u))
+        return W, np.sqrt(2.*sf2/num)*np.ones(num)
+
 
 
 class Periodic(Kernel):
@@ -1192,6 +1501,8 @@ class Periodic(Kernel):
     :param log_ell: characteristic length scale.
     :param log_sigma: signal deviation.
     '''
+    scaleHyp = (2, 2.)
+
     def __init__(self, log_ell=0., log_p=0., log_sigma=0. ):
         self.hyp = [ log_ell, log_p, log_sigma]
 
@@ -1249,6 +1560,17 @@ class Periodic(Kernel):
             raise Exception("Wrong derivative index in covPeriodic")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        ell = np.exp(self.hyp[0])        # characteristic length scale
+        p   = np.exp(self.hyp[1])        # period
+        sf2 = np.exp(2.*self.hyp[2])     # signal variance
+        R   = x[:,dim:dim+1] - z[:,dim:dim+1].T
+        S   = old_div(np.sin(np.pi*np.abs(R)/p),ell)
+        A   = -sf2 * np.exp(-2.*S*S) * 2.*np.pi/(p*ell**2) * np.sin(2.*np.pi*R/p)
+        return A
+
 
 
 class Noise(Kernel):
@@ -1259,6 +1581,8 @@ class Noise(Kernel):
 
     :param log_sigma: signal deviation.
     '''
+    scaleHyp = (0, 2.)
+
     def __init__(self, log_sigma=0.):
         self.hyp = [log_sigma]
 
@@ -1299,6 +1623,12 @@ class Noise(Kernel):
             raise Exception("Wrong derivative index in covNoise")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        A = np.zeros((x.shape[0],z.shape[0]))   # zero almost everywhere
+        return A
+
 
 
 class RQ(Kernel):
@@ -1310,6 +1640,8 @@ class RQ(Kernel):
     :param log_sigma: signal deviation.
     :param log_alpha: shape parameter for the RQ covariance.
     '''
+    scaleHyp = (1, 2.)
+
     def __init__(self, log_ell=0., log_sigma=0., log_alpha=0.):
         self.hyp = [ log_ell, log_sigma, log_alpha ]
 
@@ -1351,6 +1683,24 @@ class RQ(Kernel):
             raise Exception("Wrong derivative index in covRQ")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        ell   = np.exp(self.hyp[0])       # characteristic length scale
+        sf2   = np.exp(2.*self.hyp[1])    # signal variance
+        alpha = np.exp(self.hyp[2])
+        D2 = spdist.cdist(old_div(x,ell), old_div(z,ell), 'sqeuclidean')
+        A = -sf2 * ( 1.0 + 0.5*D2/alpha )**(-alpha-1) * (x[:,dim:dim+1] - z[:,dim:dim+1].T) / ell**2
+        return A
+
+    def getRandomFeatures(self,D,num):
+        ell   = np.exp(self.hyp[0])       # characteristic length scale
+        sf2   = np.exp(2.*self.hyp[1])    # signal variance
+        alpha = np.exp(self.hyp[2])
+        tau = np.random.gamma(alpha, old_div(1.,alpha), size=(num,1))   # RQ is a Gamma scale mixture of RBFs
+        W = np.random.randn(num,D) / ell * np.sqrt(tau)
+        return W, np.sqrt(2.*sf2/num)*np.ones(num)
+
 
 
 class RQard(Kernel):
@@ -1364,6 +1714,8 @@ class RQard(Kernel):
     :param log_sigma: signal deviation.
     :param log_alpha: shape parameter for the RQ covariance.
     '''
+    scaleHyp = (-2, 2.)
+
     def __init__(self, D=None, log_ell_list=None, log_sigma=0., log_alpha=0.):
         if log_ell_list is None:
             self.hyp = [0. for i in range(D)] + [ log_sigma, log_alpha ]
@@ -1424,6 +1776,17 @@ class RQard(Kernel):
             raise Exception("Wrong derivative index in covRQard")
         return A
 
+    def getInputDerMatrix(self,x=None,z=None,dim=None):
+        if z is None:
+            z = x
+        n, D = x.shape
+        ell = old_div(1.,np.exp(self.hyp[0:D]))    # inverse characteristic length scales
+        sf2 = np.exp(2.*self.hyp[D])      # signal variance
+        alpha = np.exp(self.hyp[D+1])
+        D2 = spdist.cdist(x*ell, z*ell, 'sqeuclidean')
+        A = -sf2 * ( 1.0 + 0.5*D2/alpha )**(-alpha-1) * (x[:,dim:dim+1] - z[:,dim:dim+1].T) * ell[dim]**2
+        return A
+
 
 
 class Pre(Kernel):
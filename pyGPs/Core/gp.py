@@ -46,10 +46,15 @@ from past.utils import old_div
 # Copyright (c) by Marion Neumann and Shan Huang, 30/09/2013
 
 import itertools
+import pickle
+import struct
+import time
 import numpy as np
+import scipy.spatial as spspatial
 import matplotlib.pyplot as plt
-from . import inf, mean, lik, cov, opt
+from . import inf, mean, lik, cov, opt, inducing, parallel
 from .tools import unique, jitchol, solve_chol
+from scipy.linalg import solve_triangular
 from copy import deepcopy
 import pyGPs
 from pyGPs.Core.cov import FITCOfKernel
@@ -58,6 +63,41 @@ SHADEDCOLOR = [0.7539, 0.89453125, 0.62890625, 1.0]
 MEANCOLOR = [ 0.2109375, 0.63385, 0.1796875, 1.0]
 DATACOLOR = [0.12109375, 0.46875, 1., 1.0]
 
+def _cholSolve(L, b):
+    '''Solve (L*L')*x = b for stacked lower triangular Cholesky factors L.'''
+    return np.linalg.solve(np.transpose(L, (0,2,1)), np.linalg.solve(L, b))
+
+
+
+class predStruct(object):
+    '''
+    Results of GP.predict_result.
+
+    | res.ym:  predictive output means
+    | res.ys2: predictive output variances
+    | res.fm:  predictive latent means
+    | res.fs2: predictive latent variances
+    | res.lp:  log predictive probabilities (None without test targets)
+
+    Outputs that were not requested are None.
+    Unpacks like the return value of predict: ym, ys2, fm, fs2, lp = res
+    '''
+    def __init__(self):
+        self.ym  = None
+        self.ys2 = None
+        self.fm  = None
+        self.fs2 = None
+        self.lp  = None
+
+    def __iter__(self):
+        return iter((self.ym, self.ys2, self.fm, self.fs2, self.lp))
+
+    def __repr__(self):
+        value = "predStruct: to get predictions use ym, ys2, fm, fs2, lp"
+        return value
+
+
+
 class GP(object):
     '''
     Base class for GP model.
@@ -83,6 +123,35 @@ class GP(object):
         self.fm = None            # column vector (of length ns) of predictive latent means
         self.fs2 = None           # column vector (of length ns) of predictive latent variances
         self.lp = None            # column vector (of length ns) of log predictive probabilities
+        self._localTreeCache = None   # KD-tree over the training inputs (see predict_local)
+
+
+
+    # defaults of the attributes added to the models since earlier versions (see __setstate__)
+    _stateDefaults = {'_predictOp': None, '_localTreeCache': None}
+
+    def __setstate__(self, state):
+        '''
+        Unpickling. Models pickled by earlier versions keep the posterior in
+        their __dict__ (it is a property now) and lack newer attributes,
+        which get their defaults.
+        '''
+        state = dict(state)
+        if 'posterior' in state:
+            state['_posterior'] = state.pop('posterior')
+            state['_predictOp'] = None
+        for key, value in self._stateDefaults.items():
+            state.setdefault(key, value)
+        self.__dict__.update(state)
+
+    def _getPosterior(self):
+        return self._posterior
+
+    def _setPosterior(self, post):
+        self._posterior = post
+        self._predictOp = None    # prediction operator of the previous posterior is stale
+        parallel.release(self)    # and so is its copy in shared memory (see predict(n_jobs))
+    posterior = property(_getPosterior,_setPosterior)
 
 
 
@@ -220,7 +289,7 @@ class GP(object):
 
 
 
-    def setOptimizer(self, method, num_restarts=None, min_threshold=None, meanRange=None, covRange=None, likRange=None):
+    def setOptimizer(self, method, num_restarts=None, min_threshold=None, meanRange=None, covRange=None, likRange=None, n_jobs=1, seed=None, design='random', halving=None):
         '''
         This method is used to sepecify optimization configuration. By default, gp uses a single run "minimize".
 
@@ -229,6 +298,9 @@ class GP(object):
                        "CG"         -> conjugent gradient\n
                        "BFGS"       -> quasi-Newton method of Broyden, Fletcher, Goldfarb, and Shanno (BFGS)\n
                        "SCG"        -> scaled conjugent gradient (faster than CG)\n
+                       "Coordinate" -> coordinate-wise minimize, alternating cheap and full steps (GPR with "ExactEig" inference)\n
+                       "LBFGSB"     -> limited-memory BFGS with bounds on the hyperparameters (see opt.LBFGSB)\n
+                       "TrustConstr"-> trust-region method with bounds on the hyperparameters (see opt.TrustConstr)\n
         :param num_restarts: Set if you want to run mulitiple times of optimization with different initial guess.
                              It specifys the maximum number of runs/restarts/trials.
         :param min_threshold: Set if you want to run mulitiple times of optimization with different initial guess.
@@ -240,6 +312,17 @@ class GP(object):
                           (-5,5) for each hyperparameter by default.
         :param covRange: The range of initial guess for kernel hyperparameters. Usage see meanRange
         :param likRange: The range of initial guess for likelihood hyperparameters. Usage see meanRange
+        :param n_jobs: Number of worker processes running the restarts in parallel (-1 for all cores).
+                       Each worker optimizes its own copy of the model.
+        :param seed: Seed of the random initial guesses. Restart r draws its initial guess from its own
+                     random stream seeded with (seed, r), so that the result for a given seed
+                     does not depend on n_jobs. By default the seed is drawn from numpy.random.
+        :param design: Design of the initial guesses within the ranges: "random" (uniform draws),
+                       "sobol" (scrambled Sobol' sequence) or "lhs" (Latin hypercube, needs num_restarts).
+        :param halving: Set to a reduction factor eta (e.g. 3) to prune the num_restarts initial guesses by
+                        successive halving: all guesses are screened by their objective value, and only the best
+                        1/eta are optimized for a few iterations, the best 1/eta of those for eta times more, etc.,
+                        until the best one is optimized for the full number of iterations.
         '''
         pass
 
@@ -343,7 +426,7 @@ class GP(object):
 
 
 
-    def predict(self, xs, ys=None):
+    def predict(self, xs, ys=None, outputs=None, memory=None, n_jobs=1):
         '''
         Prediction of test points (given by xs) based on training data of the current model.
         This method will output the following value:\n
@@ -353,89 +436,30 @@ class GP(object):
         predictive latent variances(fs2),\n
         log predictive probabilities(lp).\n
         Theses values can also be achieved from model's property. (e.g. model.ym)
+        The test points are processed in batches whose size follows from the
+        memory budget and the size of the posterior. For test sets that do not
+        fit in memory see predict_iter.
 
         :param xs: test input in shape of nn by D
         :param ys: test target(optional) in shape of nn by 1 if given
+        :param outputs: names of the outputs to compute, a subset of
+                        ('ym','ys2','fm','fs2','lp'); all by default (without lp if ys is not
+                        given, lp needs test targets). The others are None.
+        :param int memory: memory budget in bytes for one batch (default GP.predictMemory)
+        :param int n_jobs: number of worker processes (-1 for all cores). The posterior is
+                           shared with the workers through shared memory once per posterior;
+                           the workers stay alive across calls.
 
         :return: ym, ys2, fm, fs2, lp
         '''
-        # check the shape of inputs
-        # transform to correct shape if neccessary
-        if xs.ndim == 1:
-            xs = np.reshape(xs, (xs.shape[0],1))
-        self.xs = xs
-        if not ys is None:
-            if ys.ndim == 1:
-                ys = np.reshape(ys, (ys.shape[0],1))
-            self.ys = ys
-
-        meanfunc = self.meanfunc
-        covfunc  = self.covfunc
-        likfunc  = self.likfunc
-        inffunc  = self.inffunc
-        x = self.x
-        y = self.y
-
+        xs, ys = self._predictInput(xs, ys)
         if self.posterior is None:
             self.getPosterior()
-        alpha = self.posterior.alpha
-        L     = self.posterior.L
-        sW    = self.posterior.sW
-
-        nz = list(range(len(alpha[:,0])))         # non-sparse representation
-        if L == []:                         # in case L is not provided, we compute it
-            K = covfunc.getCovMatrix(x=x[nz,:], mode='train')
-            #L = np.linalg.cholesky( (np.eye(nz) + np.dot(sW,sW.T)*K).T )
-            L = jitchol( (np.eye(len(nz)) + np.dot(sW,sW.T)*K).T )
-        Ltril     = np.all( np.tril(L,-1) == 0 ) # is L an upper triangular matrix?
-        ns        = xs.shape[0]                  # number of data points
-        nperbatch = 1000                         # number of data points per mini batch
-        nact      = 0                            # number of already processed test data points
-        ymu = np.zeros((ns,1))
-        ys2 = np.zeros((ns,1))
-        fmu = np.zeros((ns,1))
-        fs2 = np.zeros((ns,1))
-        lp  = np.zeros((ns,1))
-        while nact<=ns-1:                              # process minibatches of test cases to save memory
-            id  = list(range(nact,min(nact+nperbatch,ns)))   # data points to process
-            kss = covfunc.getCovMatrix(z=xs[id,:], mode='self_test')    # self-variances
-            if isinstance(covfunc, FITCOfKernel): 
-                Ks = covfunc.getCovMatrix(x=x, z=xs[id,:], mode='cross')   # cross-covariances
-                Ks = Ks[nz,:]
-            else:
-                Ks  = covfunc.getCovMatrix(x=x[nz,:], z=xs[id,:], mode='cross')   # cross-covariances
-            ms  = meanfunc.getMean(xs[id,:])
-            N   = (alpha.shape)[1]                     # number of alphas (usually 1; more in case of sampling)
-            Fmu = np.tile(ms,(1,N)) + np.dot(Ks.T,alpha[nz])          # conditional mean fs|f
-            fmu[id] = np.reshape(old_div(Fmu.sum(axis=1),N),(len(id),1))       # predictive means
-            if Ltril: # L is triangular => use Cholesky parameters (alpha,sW,L)
-                V       = np.linalg.solve(L.T,np.tile(sW,(1,len(id)))*Ks)
-                fs2[id] = kss - np.array([(V*V).sum(axis=0)]).T             # predictive variances
-            else:     # L is not triangular => use alternative parametrization
-                fs2[id] = kss + np.array([(Ks*np.dot(L,Ks)).sum(axis=0)]).T # predictive variances
-            fs2[id] = np.maximum(fs2[id],0)            # remove numerical noise i.e. negative variances
-            Fs2 = np.tile(fs2[id],(1,N))               # we have multiple values in case of sampling
-            if ys is None:
-                Lp, Ymu, Ys2 = likfunc.evaluate(None,Fmu[:],Fs2[:],None,None,3)
-            else:
-                Lp, Ymu, Ys2 = likfunc.evaluate(np.tile(ys[id],(1,N)), Fmu[:], Fs2[:],None,None,3)
-            lp[id]  = np.reshape( old_div(np.reshape(Lp,(np.prod(Lp.shape),N)).sum(axis=1),N) , (len(id),1) )   # log probability; sample averaging
-            ymu[id] = np.reshape( old_div(np.reshape(Ymu,(np.prod(Ymu.shape),N)).sum(axis=1),N) ,(len(id),1) )  # predictive mean ys|y and ...
-            ys2[id] = np.reshape( old_div(np.reshape(Ys2,(np.prod(Ys2.shape),N)).sum(axis=1),N) , (len(id),1) ) # .. variance
-            nact = id[-1]+1                  # set counter to index of next data point
-        self.ym = ymu
-        self.ys2 = ys2
-        self.lp = lp
-        self.fm = fmu
-        self.fs2 = fs2
-        if ys is None:
-            return ymu, ys2, fmu, fs2, None
-        else:
-            return ymu, ys2, fmu, fs2, lp
+        return self._predictStore(xs, ys, self.predict_result(xs, ys, outputs, memory, n_jobs))
 
 
 
-    def predict_with_posterior(self, post, xs, ys=None):
+    def predict_with_posterior(self, post, xs, ys=None, outputs=None, memory=None, n_jobs=1):
         '''
         Prediction of test points (given by xs) based on training data 
         of the current model with posterior already provided.
@@ -451,77 +475,716 @@ class GP(object):
         :param post: struct representation of posterior
         :param xs: test input
         :param ys: test target(optional)
+        :param outputs: names of the outputs to compute (see predict)
+        :param int memory: memory budget in bytes for one batch (see predict)
+        :param int n_jobs: number of worker processes (see predict)
 
         :return: ym, ys2, fm, fs2, lp
         '''
-        # check the shape of inputs
-        # transform to correct shape if neccessary
-        if xs.ndim == 1:
-            xs = np.reshape(xs, (xs.shape[0],1))
-        self.xs = xs
+        xs, ys = self._predictInput(xs, ys)
+        self.posterior = deepcopy(post)
+        return self._predictStore(xs, ys, self.predict_result(xs, ys, outputs, memory, n_jobs))
+
+
+
+    def predict_result(self, xs, ys=None, outputs=None, memory=None, n_jobs=1, post=None):
+        '''
+        Prediction of test points (given by xs) as predict, without side effects:
+        the results are returned as a predStruct (res.ym, res.ys2, res.fm, res.fs2,
+        res.lp) and nothing of the model is changed, in particular the posterior
+        is not computed if it is missing.
+
+        predict_result is safe for concurrent callers, i.e. several threads may
+        predict with one model at the same time (numpy and scipy release the GIL
+        in the linear algebra). The model itself (data, hyperparameters,
+        posterior) must not be changed while predictions are running; a
+        replacement of model.posterior only affects the calls started after it.
+
+        :param xs: test input in shape of nn by D
+        :param ys: test target(optional) in shape of nn by 1 if given
+        :param outputs: names of the outputs to compute (see predict)
+        :param int memory: memory budget in bytes for one batch (see predict)
+        :param int n_jobs: number of worker processes (see predict)
+        :param post: posterior to predict with (default model.posterior)
+
+        :return: predStruct
+        '''
+        if post is None:
+            post = self.posterior          # read once: every batch uses the same posterior
+        if post is None:
+            raise Exception('No posterior available. Call getPosterior() or optimize() first.')
+        xs, ys = self._predictInput(xs, ys)
+        outputs = self._predictOutputs(outputs, ys)
+        setup = self._predictSetup(post, self._needVariance(outputs))
+        res = predStruct()
+        res.ym, res.ys2, res.fm, res.fs2, res.lp = self._predictBatches(setup, xs, ys, outputs, memory, n_jobs)
+        return res
+
+
+
+    def predict_iter(self, xs_iterable, ys_iterable=None, outputs=None, memory=None, n_jobs=1):
+        '''
+        Prediction for test sets that do not fit in memory. Yields the tuple
+        (ym, ys2, fm, fs2, lp) of predict for every chunk of test inputs taken
+        from xs_iterable (and the matching chunk of test targets from ys_iterable).
+        Chunks larger than the memory budget are split into batches as in predict.
+        Nothing is stored in the model.
+
+        :param xs_iterable: iterable of test inputs in shape of nn_i by D
+        :param ys_iterable: iterable of test targets in shape of nn_i by 1 (optional)
+        :param outputs: names of the outputs to compute (see predict)
+        :param int memory: memory budget in bytes for one batch (see predict)
+        :param int n_jobs: number of worker processes (see predict)
+        '''
+        if self.posterior is None:
+            self.getPosterior()
+        outputs = self._predictOutputs(outputs, ys_iterable)
+        setup = self._predictSetup(self.posterior, self._needVariance(outputs))  # prepared once for all chunks
+        ys_iter = None if ys_iterable is None else iter(ys_iterable)
+        for xs in xs_iterable:
+            ys = None if ys_iter is None else next(ys_iter)
+            xs, ys = self._predictInput(xs, ys)
+            res = self._predictBatches(setup, xs, ys, outputs, memory, n_jobs)
+            yield tuple(res)
+
+
+
+    def predict_mean(self, xs, latent=False, memory=None, n_jobs=1):
+        '''
+        Predictive means of test points (given by xs) only. Neither the
+        self-variances nor the solves against L are computed, i.e. the effort
+        is O(n) per test point (O(M) for FITC with M inducing points).
+        The output mean equals the latent mean for the Gauss and Laplace
+        likelihoods; for other likelihoods (e.g. classification) it depends on
+        the latent variance, which is then computed unless latent is True.
+        Nothing is stored in the model.
+
+        :param xs: test input in shape of nn by D
+        :param bool latent: return the latent mean fm instead of the output mean ym
+        :param int memory: memory budget in bytes for one batch (see predict)
+        :param int n_jobs: number of worker processes (see predict)
+
+        :return: ym (or fm) in shape of nn by 1
+        '''
+        xs, ys = self._predictInput(xs, None)
+        if self.posterior is None:
+            self.getPosterior()
+        if latent or isinstance(self.likfunc, (lik.Gauss, lik.Laplace)):
+            setup = self._predictSetup(self.posterior, variance=False)
+            return self._predictBatches(setup, xs, None, ('fm',), memory, n_jobs)[2]
+        setup = self._predictSetup(self.posterior)
+        return self._predictBatches(setup, xs, None, ('ym',), memory, n_jobs)[0]
+
+
+
+    def predict_cov(self, xs):
+        '''
+        Joint predictive distribution of the latent function values at the test
+        points xs (for classification models the latent function). The cached
+        factorisation of the posterior is used, i.e. the covariance needs one
+        triangular solve with all ns right hand sides.
+
+        :param xs: test input in shape of nn by D
+
+        :return: fm (nn by 1), fcov (nn by nn)
+        '''
+        xs, ys = self._predictInput(xs, None)
+        if self.posterior is None:
+            self.getPosterior()
+        alpha, L, sW, Ltril = self._predictSetup(self.posterior)
+        Ks  = self.covfunc.getCovMatrix(x=self.x, z=xs, mode='cross')
+        Kss = self._priorCovfunc().getCovMatrix(x=xs, mode='train')
+        fm  = self.meanfunc.getMean(xs) + np.dot(Ks.T, self._meanAlpha(alpha))
+        if Ltril:
+            V = solve_triangular(L, Ks if sW is None else sW*Ks, lower=True, check_finite=False)
+            C = Kss - np.dot(V.T, V)
+        else:
+            C = Kss + np.dot(Ks.T, np.dot(L, Ks))
+        return fm, 0.5*(C + C.T)
+
+
+
+    def sample_posterior(self, xs, num_samples=1, method='exact', num_features=1000, memory=None):
+        '''
+        Draw joint samples of the latent function values at the test points xs.
+
+        method='exact' draws from the joint predictive distribution of predict_cov,
+        which is O(nn^3).
+
+        method='pathwise' uses Matheron's rule (Wilson et al., 2020): a prior
+        sample path, approximated with num_features random Fourier features of
+        the kernel (see cov.Kernel.getRandomFeatures), is corrected by the data
+        through the cached factorisation of the posterior. The effort is linear
+        in nn; the test points are processed in batches (see predict).
+        For FITC models the correction is done through the inducing points.
+
+        :param xs: test input in shape of nn by D
+        :param int num_samples: number of samples
+        :param str method: 'exact' or 'pathwise'
+        :param int num_features: number of random features for 'pathwise'
+        :param int memory: memory budget in bytes for one batch (see predict)
+
+        :return: samples in shape of nn by num_samples
+        '''
+        xs, ys = self._predictInput(xs, None)
+        if self.posterior is None:
+            self.getPosterior()
+        if method == 'exact':
+            fm, C = self.predict_cov(xs)
+            return fm + np.dot(jitchol(C), np.random.randn(xs.shape[0], num_samples))
+        if method != 'pathwise':
+            raise Exception('Possible sampling methods are "exact" and "pathwise".')
+        setup = self._predictSetup(self.posterior)
+        alpha, L, sW, Ltril = setup
+        kern = self._priorCovfunc()
+        if isinstance(self.covfunc, FITCOfKernel):
+            z = self.covfunc.inducingInput
+        else:
+            z = self.x
+        W, amp = kern.getRandomFeatures(xs.shape[1], num_features)
+        b = np.random.uniform(0., 2.*np.pi, W.shape[0])
+        w = np.random.randn(W.shape[0], num_samples)             # weights of the prior sample paths
+        fz = np.dot(amp*np.cos(np.dot(z, W.T) + b), w)          # prior samples at x (or inducing points)
+        if Ltril:   # v = inv(K+inv(W))*(fz+e), e ~ N(0,inv(W)), with K+inv(W) = L*L' if sW is folded into L
+            e = np.random.randn(z.shape[0], num_samples)
+            if sW is None:
+                r = fz + old_div(e, self.posterior.sW)
+                v = solve_triangular(L, solve_triangular(L, r, lower=True, check_finite=False), lower=True, trans='T', check_finite=False)
+            else:
+                r = sW*fz + e
+                v = sW*solve_triangular(L, solve_triangular(L, r, lower=True, check_finite=False), lower=True, trans='T', check_finite=False)
+        else:       # posterior of f(z) is N(Kzz*alpha, Kzz + Kzz*L*Kzz): v = inv(Kzz)*(fz - (f(z)-Kzz*alpha))
+            Kzz = kern.getCovMatrix(x=z, mode='train')
+            Su  = Kzz + np.dot(Kzz, np.dot(L, Kzz))
+            xi  = np.dot(jitchol(0.5*(Su + Su.T)), np.random.randn(z.shape[0], num_samples))
+            Lz  = jitchol(Kzz)
+            v   = solve_triangular(Lz, solve_triangular(Lz, fz - xi, lower=True, check_finite=False), lower=True, trans='T', check_finite=False)
+        c  = self._meanAlpha(alpha) - v
+        ns = xs.shape[0]
+        nb = self._predictBatchSize(setup, memory, ('fm',))
+        fs = np.zeros((ns, num_samples))
+        for a in range(0, ns, nb):
+            xb = xs[a:a+nb]
+            Ks = self.covfunc.getCovMatrix(x=self.x, z=xb, mode='cross')
+            fs[a:a+nb] = self.meanfunc.getMean(xb) + np.dot(amp*np.cos(np.dot(xb, W.T) + b), w) + np.dot(Ks.T, c)
+        return fs
+
+
+
+    def predict_grad(self, xs, memory=None):
+        '''
+        Gradients of the predictive latent mean and variance with respect to the
+        test inputs, e.g. for Bayesian optimisation or sensitivity analysis.
+        The cached factorisation of the posterior is used and all test points
+        are handled in batches (see predict), i.e. the gradients at a test point
+        cost about D+1 predictions instead of the 2D+1 of central finite
+        differences. For the Gauss likelihood the gradients of ym and ys2 are
+        the same as those of fm and fs2.
+        The covariance and mean functions need input derivatives
+        (cov.Kernel.getInputDerMatrix, mean.Mean.getInputDerMatrix).
+
+        :param xs: test input in shape of nn by D
+        :param int memory: memory budget in bytes for one batch (see predict)
+
+        :return: fm, fs2 (nn by 1), dfm, dfs2 (nn by D) with dfm[i,d] = d fm[i] / d xs[i,d]
+        '''
+        xs, ys = self._predictInput(xs, None)
+        if self.posterior is None:
+            self.getPosterior()
+        setup = self._predictSetup(self.posterior)
+        alpha, L, sW, Ltril = setup
+        alpha = self._meanAlpha(alpha)
+        kern  = self._priorCovfunc()
+        if isinstance(self.covfunc, FITCOfKernel):
+            z = self.covfunc.inducingInput
+        else:
+            z = self.x
+        ns, D = xs.shape
+        nb  = self._predictBatchSize(setup, memory, self._predictNames)
+        fm  = np.zeros((ns,1)); fs2  = np.zeros((ns,1))
+        dfm = np.zeros((ns,D)); dfs2 = np.zeros((ns,D))
+        for a in range(0, ns, nb):
+            b   = min(a+nb, ns)
+            xb  = xs[a:b]
+            Ks  = self.covfunc.getCovMatrix(x=self.x, z=xb, mode='cross')
+            kss = self.covfunc.getCovMatrix(z=xb, mode='self_test')
+            fm[a:b] = self.meanfunc.getMean(xb) + np.dot(Ks.T, alpha)
+            if Ltril:
+                V = solve_triangular(L, Ks if sW is None else sW*Ks, lower=True, check_finite=False)
+                fs2[a:b] = kss - np.array([(V*V).sum(axis=0)]).T
+            else:
+                LK = np.dot(L, Ks)
+                fs2[a:b] = kss + np.array([(Ks*LK).sum(axis=0)]).T
+            for d in range(D):
+                dK   = kern.getInputDerMatrix(x=xb, z=z, dim=d).T     # d Ks / d xs[:,d]
+                dkss = self._selfInputDer(kern, xb, d)
+                dfm[a:b,d] = self.meanfunc.getInputDerMatrix(xb, d)[:,0] + np.dot(dK.T, alpha)[:,0]
+                if Ltril:
+                    dV = solve_triangular(L, dK if sW is None else sW*dK, lower=True, check_finite=False)
+                    dfs2[a:b,d] = dkss - 2.*(V*dV).sum(axis=0)
+                else:
+                    dfs2[a:b,d] = dkss + 2.*(dK*LK).sum(axis=0)
+        return fm, np.maximum(fs2,0), dfm, dfs2
+
+    def _selfInputDer(self, kern, xs, dim):
+        '''d k(x,x) / d x[dim] for all test points, i.e. twice the diagonal of the input derivatives.'''
+        ns  = xs.shape[0]
+        res = np.zeros(ns)
+        for a in range(0, ns, 64):                  # diagonal blocks
+            xb = xs[a:a+64]
+            res[a:a+64] = 2.*np.diag(kern.getInputDerMatrix(x=xb, z=xb, dim=dim))
+        return res
+
+
+
+    def predict_local(self, xs, k=50, ys=None, outputs=None, memory=None, n_jobs=1):
+        '''
+        Local GP prediction for very large training sets: every test point is
+        predicted by an exact GP on its k nearest training inputs with the
+        hyperparameters of the model, i.e. the effort per test point is O(k^3)
+        independent of n and no global posterior is needed.
+        The nearest neighbours are found with a KD-tree over the training inputs
+        that is built once per training set. Test points are processed in
+        batches of nearby points: the kernel is evaluated once on the union of
+        their neighbourhoods and the k by k systems of the batch are factorised
+        together (stacked numpy Cholesky).
+        For the Gaussian likelihood the local posteriors are exact; for other
+        likelihoods (e.g. classification) they are Laplace approximations
+        (Newton iterations on all local problems of a batch at once).
+        Nothing is stored in the model except the KD-tree. See also local_report.
+
+        :param xs: test input in shape of nn by D
+        :param int k: number of nearest neighbours
+        :param ys: test target(optional) in shape of nn by 1 if given
+        :param outputs: names of the outputs to compute (see predict)
+        :param int memory: memory budget in bytes for one batch (default GP.predictMemory)
+        :param int n_jobs: number of worker processes (-1 for all cores), see predict
+
+        :return: predStruct
+        '''
+        if self.x is None:
+            raise Exception('No training data available. Call setData() first.')
+        if isinstance(self.covfunc, FITCOfKernel):
+            raise Exception('Local prediction is not available for FITC models.')
+        xs, ys = self._predictInput(xs, ys)
+        outputs = self._predictOutputs(outputs, ys)
+        k = min(k, self.x.shape[0])
+        tree, rank = self._localTree()
+        dist, idx = tree.query(xs, k)
+        idx = np.reshape(idx, (xs.shape[0], k))
+        order = np.argsort(rank[idx[:,0]], kind='mergesort')  # neighbouring test points in one batch
+        xs, idx = xs[order], idx[order]
         if not ys is None:
-            if ys.ndim == 1:
-                ys = np.reshape(ys, (ys.shape[0],1))
-            self.ys = ys
+            ys = ys[order]
+        ns = xs.shape[0]
+        nb = self._localBatchSize(k, memory)
+        if n_jobs != 1:
+            part = parallel.localBatches(self, xs, ys, idx, outputs, nb, n_jobs)
+        else:
+            part = [np.zeros((ns,1)) if name in outputs else None for name in self._predictNames]
+            for a in range(0, ns, nb):
+                b = min(a+nb, ns)
+                res = self._localBatch(xs[a:b], None if ys is None else ys[a:b], idx[a:b], outputs)
+                for r, p in zip(part, res):
+                    if not r is None:
+                        r[a:b] = p
+        res = predStruct()
+        back = np.argsort(order)                           # original order of the test points
+        res.ym, res.ys2, res.fm, res.fs2, res.lp = [None if r is None else r[back] for r in part]
+        return res
 
-        meanfunc = self.meanfunc
-        covfunc  = self.covfunc
-        likfunc  = self.likfunc
-        inffunc  = self.inffunc
-        x = self.x
-        y = self.y
 
-        self.posterior = deepcopy(post)
+
+    def local_report(self, xs, ys=None, ks=(8, 16, 32, 64, 128), memory=None, n_jobs=1):
+        '''
+        Accuracy versus k of predict_local. For every number of neighbours in ks
+        the time of predict_local is measured; if test targets are given the
+        mean squared error of ym and the mean negative log predictive
+        probability are reported, and if the model has a posterior the largest
+        deviations of fm and fs2 from the global prediction (predict_result).
+
+        :param xs: test input in shape of nn by D
+        :param ys: test target(optional) in shape of nn by 1
+        :param ks: numbers of nearest neighbours
+        :param int memory: memory budget in bytes for one batch (see predict_local)
+        :param int n_jobs: number of worker processes (see predict_local)
+
+        :return: list of dictionaries with keys k, time, mse, nlp, dfm, dfs2 (None if not available)
+        '''
+        xs, ys = self._predictInput(xs, ys)
+        ref = None
+        if not self.posterior is None:
+            ref = self.predict_result(xs, outputs=('fm','fs2'), memory=memory)
+        report = []
+        for k in ks:
+            t0  = time.time()
+            res = self.predict_local(xs, k, ys, memory=memory, n_jobs=n_jobs)
+            row = {'k': k, 'time': time.time() - t0, 'mse': None, 'nlp': None, 'dfm': None, 'dfs2': None}
+            if not ys is None:
+                row['mse'] = float(np.mean((res.ym - ys)**2))
+                row['nlp'] = float(-np.mean(res.lp))
+            if not ref is None:
+                row['dfm']  = float(np.max(np.abs(res.fm - ref.fm)))
+                row['dfs2'] = float(np.max(np.abs(res.fs2 - ref.fs2)))
+            report.append(row)
+        return report
+
+
+
+    def _localTree(self):
+        '''KD-tree over the training inputs and the rank of every input in the leaf order of the tree.'''
+        cached = self._localTreeCache                # (x, tree, rank); read and replaced as a whole
+        if not cached is None and cached[0] is self.x:
+            return cached[1], cached[2]
+        tree = spspatial.cKDTree(self.x)
+        rank = np.empty(self.x.shape[0], dtype=int)
+        rank[tree.indices] = np.arange(self.x.shape[0])
+        self._localTreeCache = (self.x, tree, rank)
+        return tree, rank
+
+    def _localBatchSize(self, k, memory):
+        '''
+        Number of test points per batch of predict_local: the kernel matrix of
+        the union of the neighbourhoods (at most nb*(k+1) points) and about six
+        stacked k by k matrices have to fit into the memory budget.
+        '''
+        if memory is None:
+            memory = self.predictMemory
+        nb = min(np.sqrt(memory // 16) // (k+1), memory // (48*k*k))
+        return max(1, int(nb))
+
+    def _localBatch(self, xs, ys, idx, outputs):
+        '''Requested outputs (ym, ys2, fm, fs2, lp) for test points xs with neighbourhoods idx (nb by k).'''
+        nb, k = idx.shape
+        uniq, pos = np.unique(idx, return_inverse=True)    # union of the neighbourhoods
+        pos = np.reshape(pos, (nb, k))
+        nu  = uniq.shape[0]
+        Kall = self.covfunc.getCovMatrix(x=np.vstack((self.x[uniq], xs)), mode='train')
+        K   = Kall[pos[:,:,None], pos[:,None,:]]           # nb by k by k
+        Ks  = Kall[pos, (nu + np.arange(nb))[:,None]][:,:,None]   # nb by k by 1
+        kss = self.covfunc.getCovMatrix(z=xs, mode='self_test')
+        m   = np.reshape(self.meanfunc.getMean(self.x[uniq]), (nu,))[pos][:,:,None]
+        y   = self.y[idx]                                  # nb by k by 1
+        I   = np.eye(k)
+        if isinstance(self.likfunc, lik.Gauss):
+            sn2   = np.exp(2.*self.likfunc.hyp[0])
+            L     = np.linalg.cholesky(K + sn2*I)
+            alpha = _cholSolve(L, y - m)
+            V     = np.linalg.solve(L, Ks)
+        else:                                              # Laplace approximation: Newton iterations
+            laplace = inf.Laplace()
+            alpha = np.zeros((nb, k, 1))
+            f     = m
+            for it in range(20):
+                lp, dlp, d2lp = self.likfunc.evaluate(np.reshape(y, (nb*k,1)), np.reshape(f, (nb*k,1)), None, laplace, None, 3)
+                dlp = np.reshape(dlp, (nb,k,1))
+                W   = np.maximum(-np.reshape(d2lp, (nb,k,1)), 0)
+                sW  = np.sqrt(W)
+                L   = np.linalg.cholesky(I + sW*K*np.transpose(sW, (0,2,1)))
+                b   = W*(f - m) + dlp
+                new = b - sW*_cholSolve(L, sW*np.matmul(K, b))
+                done  = np.max(np.abs(new - alpha)) < 1e-8
+                alpha = new
+                f     = m + np.matmul(K, alpha)
+                if done:
+                    break
+            lp, dlp, d2lp = self.likfunc.evaluate(np.reshape(y, (nb*k,1)), np.reshape(f, (nb*k,1)), None, laplace, None, 3)
+            sW = np.sqrt(np.maximum(-np.reshape(d2lp, (nb,k,1)), 0))
+            L  = np.linalg.cholesky(I + sW*K*np.transpose(sW, (0,2,1)))
+            V  = np.linalg.solve(L, sW*Ks)
+        fmu = self.meanfunc.getMean(xs) + np.reshape(np.matmul(np.transpose(Ks, (0,2,1)), alpha), (nb,1))
+        fs2 = np.maximum(kss - np.reshape((V*V).sum(axis=1), (nb,1)), 0)
+        ymu = ys2 = lp = None
+        if 'ym' in outputs or 'ys2' in outputs or 'lp' in outputs:
+            lp, ymu, ys2 = self.likfunc.evaluate(ys, fmu, fs2, None, None, 3)
+        return [r if name in outputs else None for r, name in zip((ymu, ys2, fmu, fs2, lp), self._predictNames)]
+
+
+
+    def compress(self, m, tol=None, xv=None, seed=0):
+        '''
+        Compress the fitted (exact, Laplace or EP) posterior into a compact
+        model for serving: a GPR_FITC (GPC_FITC for classification) with m
+        inducing points whose posterior (post.alpha, post.L of the FITC
+        prediction path) is the projection of the posterior of this model,
+        i.e. k(xs,x) is replaced by its Nystroem approximation through the
+        inducing points u:
+
+        | alpha_u = inv(Kuu)*Kux*alpha
+        | L_u     = -inv(Kuu)*Kux*inv(K+inv(W))*Kxu*inv(Kuu)
+
+        The inducing points are training inputs chosen greedily, each reducing
+        the remaining prior variance of the training inputs most (see
+        inducing.pivotedCholesky). If tol is given the smallest prefix of the
+        greedy order (among 16, 32, 64, ... and m points) whose worst-case
+        deviation of fm and fs2 on the validation inputs is at most tol is
+        used. Memory of the compact model is O(m^2) instead of O(n^2) and the
+        effort of a prediction O(m) instead of O(n). The compact model keeps no
+        training data (its x are the inducing points); it is meant for
+        prediction, save and serving.
+
+        :param int m: (maximal) number of inducing points
+        :param float tol: tolerated worst-case deviation of fm and fs2
+        :param xv: validation inputs (default: at most 1000 training inputs drawn with seed)
+        :param seed: seed of the default validation inputs (None: drawn from np.random)
+
+        :return: compact model, report (dictionary with keys m, dfm, dfs2: number of
+                 inducing points and worst-case deviations of fm and fs2 on xv)
+        '''
+        if isinstance(self.covfunc, FITCOfKernel):
+            raise Exception('compress needs an exact posterior, not a FITC model.')
+        if self.posterior is None:
+            self.getPosterior()
+        if xv is None:
+            rng = np.random if seed is None else np.random.RandomState(seed)
+            n  = self.x.shape[0]
+            xv = self.x[np.sort(rng.choice(n, min(n,1000), replace=False))]
+        xv, ys = self._predictInput(xv, None)
+        alpha, L, sW, Ltril = self._predictSetup(self.posterior)
+        alpha = self._meanAlpha(alpha)
+        u   = inducing.pivotedCholesky(self.x, max(m,2), self.covfunc)   # greedy order
+        mu  = u.shape[0]
+        Kxu = self.covfunc.getCovMatrix(x=self.x, z=u, mode='cross')
+        if Ltril:
+            V = solve_triangular(L, Kxu if sW is None else sW*Kxu, lower=True, check_finite=False)
+            S = np.dot(V.T, V)                              # Kux*inv(K+inv(W))*Kxu
+        else:
+            S = -np.dot(Kxu.T, np.dot(L, Kxu))
+        b   = np.dot(Kxu.T, alpha)
+        U   = jitchol(self.covfunc.getCovMatrix(x=u, mode='train')).T    # Kuu = U'*U, prefixes are nested
+        ref = self.predict_result(xv, outputs=('fm','fs2'))
+        Kvu = self.covfunc.getCovMatrix(x=u, z=xv, mode='cross').T
+        ms  = self.meanfunc.getMean(xv)
+        kss = self.covfunc.getCovMatrix(z=xv, mode='self_test')
+        sizes = [k for k in (16, 32, 64, 128, 256, 512, 1024, 2048, 4096) if k < mu] + [mu]
+        if tol is None:
+            sizes = [mu]
+        for k in sizes:
+            iKuu = solve_chol(U[:k,:k], np.eye(k))
+            au = np.dot(iKuu, b[:k])
+            Lu = -np.dot(iKuu, np.dot(S[:k,:k], iKuu))
+            fm  = ms + np.dot(Kvu[:,:k], au)
+            fs2 = np.maximum(kss + np.array([(Kvu[:,:k].T*np.dot(Lu, Kvu[:,:k].T)).sum(axis=0)]).T, 0)
+            report = {'m': k, 'dfm': float(np.max(np.abs(fm - ref.fm))), 'dfs2': float(np.max(np.abs(fs2 - ref.fs2)))}
+            if not tol is None and max(report['dfm'], report['dfs2']) <= tol:
+                break
+        k = report['m']
+        if isinstance(self, GPC):
+            small = GPC_FITC()
+        else:
+            small = GPR_FITC()
+        small.setPrior(mean=deepcopy(self.meanfunc), kernel=deepcopy(self._priorCovfunc()), inducing_points=u[:k].copy())
+        small.likfunc = deepcopy(self.likfunc)
+        small.x = small.u
+        small.y = None
+        post = inf.postStruct()
+        post.alpha = au
+        post.L  = Lu
+        post.sW = np.ones((k,1))                        # unused for FITC prediction
+        small.posterior = post
+        return small, report
+
+
+
+    def _priorCovfunc(self):
+        '''Covariance function of the prior (the kernel inside FITC).'''
+        if isinstance(self.covfunc, FITCOfKernel):
+            return self.covfunc.covfunc
+        return self.covfunc
+
+    def _meanAlpha(self, alpha):
+        '''alpha averaged over samples (usually there is one column).'''
+        return np.reshape(alpha.mean(axis=1), (alpha.shape[0],1))
+
+
+
+    # model attributes that are not saved by save()
+    _saveSkip = ('optimizer', 'xs', 'ys', 'ym', 'ys2', 'fm', 'fs2', 'lp', 'dnlZ', 'u', '_posterior', '_predictOp', '_localTreeCache')
+
+    def save(self, path):
+        '''
+        Save the fitted model to path in the format read by pyGPs.load.
+        The file consists of a small header with the format version, the model
+        class, the mean, covariance, likelihood and inference functions (with
+        their hyperparameters, but without caches) and the other settings of
+        the model, followed by the training data and the posterior
+        (alpha, L, sW; the m by m matrices for FITC) as raw arrays aligned to
+        64 bytes, which load can memory-map.
+        The optimizer settings and the last predictions are not saved.
+
+        :param str path: file name
+        '''
+        if self.posterior is None:
+            self.getPosterior()
+        attrs  = {}
+        arrays = {}
+        for key, value in vars(self).items():
+            if key in self._saveSkip:
+                continue
+            if isinstance(value, np.ndarray):
+                arrays[key] = value
+            else:
+                attrs[key] = value
+        post = self.posterior
+        for key in ('alpha', 'L', 'sW'):
+            arrays['posterior.'+key] = np.asarray(getattr(post, key))
+        L = arrays['posterior.L']
+        Ltril = np.size(L) > 0 and bool(np.all(np.tril(L,-1) == 0))
+        _writeModel(path, {'class': type(self).__name__, 'attrs': attrs, 'Ltril': Ltril}, arrays)
+
+
+
+    # names of the outputs of predict, in order
+    _predictNames = ('ym', 'ys2', 'fm', 'fs2', 'lp')
+
+    # memory budget in bytes for the intermediate matrices of one prediction batch
+    predictMemory = 2**27
+
+    def _predictInput(self, xs, ys):
+        '''Transform test inputs and targets to the correct shape if neccessary.'''
+        if xs.ndim == 1:
+            xs = np.reshape(xs, (xs.shape[0],1))
+        if not ys is None and ys.ndim == 1:
+            ys = np.reshape(ys, (ys.shape[0],1))
+        return xs, ys
+
+    def _predictOutputs(self, outputs, ys):
+        '''
+        Names of the outputs to compute: all by default, without lp if there are
+        no test targets ys. Requesting lp without test targets is an error.
+        '''
+        if outputs is None:
+            outputs = self._predictNames if not ys is None else self._predictNames[:4]
+        for name in outputs:
+            if not name in self._predictNames:
+                raise Exception('Possible outputs are "ym", "ys2", "fm", "fs2", "lp".')
+        if 'lp' in outputs and ys is None:
+            raise Exception('The log predictive probabilities (lp) need test targets ys.')
+        return tuple(outputs)
+
+    def _needVariance(self, outputs):
+        '''Is the latent variance needed for the requested outputs?'''
+        return outputs is None or any(name != 'fm' for name in outputs)
+
+    def _predictSetup(self, post, variance=True):
+        '''
+        Posterior quantities shared by all prediction batches.
+        Without variance only alpha is needed (L is neither computed nor inspected).
+        The prediction operator (alpha, L, sW, Ltril) is computed once per posterior
+        of the model and cached together with the posterior it belongs to, so a
+        concurrent replacement of model.posterior never pairs a posterior with
+        the operator of another one. If L is
+        triangular it is stored as the lower triangular factor diag(1/sW)*L', so
+        that the latent variance of a test point needs a single triangular solve
+        (sW is None then; it is kept separately if it has zero entries).
+        For FITC and other non-triangular L, L is the (m by m) matrix of the
+        alternative parametrization.
+        '''
         alpha = post.alpha
+        if not variance:
+            return alpha, None, None, None
+        cached = self._predictOp            # (posterior, operator); read and replaced as a whole
+        if not cached is None and cached[0] is post:
+            return cached[1]
         L     = post.L
         sW    = post.sW
-
-        nz = list(range(len(alpha[:,0])))         # non-sparse representation
-        if L == []:                         # in case L is not provided, we compute it
-            K = covfunc.getCovMatrix(x=x[nz,:], mode='train')
-            #L = np.linalg.cholesky( (np.eye(nz) + np.dot(sW,sW.T)*K).T )
-            L = jitchol( (np.eye(len(nz)) + np.dot(sW,sW.T)*K).T )
-        Ltril     = np.all( np.tril(L,-1) == 0 ) # is L an upper triangular matrix?
-        ns        = xs.shape[0]                  # number of data points
-        nperbatch = 1000                         # number of data points per mini batch
-        nact      = 0                            # number of already processed test data points
-        ymu = np.zeros((ns,1))
-        ys2 = np.zeros((ns,1))
-        fmu = np.zeros((ns,1))
-        fs2 = np.zeros((ns,1))
-        lp  = np.zeros((ns,1))
-        while nact<=ns-1:                              # process minibatches of test cases to save memory
-            id  = list(range(nact,min(nact+nperbatch,ns)))   # data points to process
-            kss = covfunc.getCovMatrix(z=xs[id,:], mode='self_test')    # self-variances
-            Ks  = covfunc.getCovMatrix(x=x[nz,:], z=xs[id,:], mode='cross')   # cross-covariances
-            ms  = meanfunc.getMean(xs[id,:])
-            N   = (alpha.shape)[1]                     # number of alphas (usually 1; more in case of sampling)
-            Fmu = np.tile(ms,(1,N)) + np.dot(Ks.T,alpha[nz])          # conditional mean fs|f
-            fmu[id] = np.reshape(old_div(Fmu.sum(axis=1),N),(len(id),1))       # predictive means
+        if np.size(L) == 0:                 # in case L is not provided, we compute it
+            K = self.covfunc.getCovMatrix(x=self.x, mode='train')
+            L = jitchol( (np.eye(alpha.shape[0]) + np.dot(sW,sW.T)*K).T )
+        Ltril = np.all( np.tril(L,-1) == 0 ) # is L an upper triangular matrix?
+        if Ltril:
+            if np.all(sW > 0):              # fold sW into the factor: L'\(sW*Ks) = (L'/sW)\Ks
+                L  = np.asfortranarray(old_div(L.T, sW))
+                sW = None
+            else:
+                L  = np.asfortranarray(L.T)
+        op = (alpha, L, sW, Ltril)
+        if post is self.posterior:
+            self._predictOp = (post, op)
+        return op
+
+    def _predictBatchSize(self, setup, memory, outputs):
+        '''
+        Number of test points per batch: each test point needs about six
+        columns of length n (cross-covariances, their scaled and solved
+        versions and the temporaries of the kernel) of 8 bytes, or three
+        columns if only the latent mean is computed.
+        '''
+        if memory is None:
+            memory = self.predictMemory
+        n = max(setup[0].shape[0], 1)
+        cols = 3 if tuple(outputs) == ('fm',) else 6
+        return max(1, int(memory // (8*cols*n)))
+
+    def _predictBatches(self, setup, xs, ys, outputs, memory, n_jobs=1):
+        '''
+        Predict the requested outputs for xs in batches of contiguous slices,
+        on a pool of worker processes if n_jobs is not 1 (see parallel).
+        '''
+        if outputs is None:
+            outputs = self._predictNames
+        for name in outputs:
+            if not name in self._predictNames:
+                raise Exception('Possible outputs are "ym", "ys2", "fm", "fs2", "lp".')
+        ns  = xs.shape[0]
+        nb  = self._predictBatchSize(setup, memory, outputs)
+        if n_jobs != 1:
+            return parallel.predictBatches(self, setup, xs, ys, outputs, nb, n_jobs)
+        res = [np.zeros((ns,1)) if name in outputs else None for name in self._predictNames]
+        for a in range(0, ns, nb):                     # process minibatches of test cases to save memory
+            b = min(a+nb, ns)
+            part = self._predictBatch(setup, xs[a:b], None if ys is None else ys[a:b], outputs)
+            for r, p in zip(res, part):
+                if not r is None:
+                    r[a:b] = p
+        return res
+
+    def _predictStore(self, xs, ys, res):
+        '''Keep test data and results of predict_result as model properties.'''
+        self.xs  = xs
+        if not ys is None:
+            self.ys = ys
+        self.ym  = res.ym
+        self.ys2 = res.ys2
+        self.fm  = res.fm
+        self.fs2 = res.fs2
+        self.lp  = res.lp
+        return tuple(res)
+
+    def _predictBatch(self, setup, xs, ys, outputs):
+        '''Requested outputs (ym, ys2, fm, fs2, lp; None if not requested) for one batch xs.'''
+        alpha, L, sW, Ltril = setup
+        covfunc = self.covfunc
+        ns  = xs.shape[0]
+        ymu = ys2 = fmu = fs2 = lp = None
+        needLik = 'ym' in outputs or 'ys2' in outputs or 'lp' in outputs
+        Ks  = covfunc.getCovMatrix(x=self.x, z=xs, mode='cross')   # cross-covariances (to inducing points for FITC)
+        ms  = self.meanfunc.getMean(xs)
+        N   = (alpha.shape)[1]                     # number of alphas (usually 1; more in case of sampling)
+        Fmu = ms + np.dot(Ks.T,alpha)              # conditional mean fs|f
+        if N == 1:
+            fmu = Fmu                              # predictive means
+        else:
+            fmu = np.reshape(old_div(Fmu.sum(axis=1),N),(ns,1))
+        if needLik or 'fs2' in outputs:
+            kss = covfunc.getCovMatrix(z=xs, mode='self_test')     # self-variances
             if Ltril: # L is triangular => use Cholesky parameters (alpha,sW,L)
-                V       = np.linalg.solve(L.T,np.tile(sW,(1,len(id)))*Ks)
-                fs2[id] = kss - np.array([(V*V).sum(axis=0)]).T             # predictive variances
+                V   = solve_triangular(L, Ks if sW is None else sW*Ks, lower=True, check_finite=False)
+                fs2 = kss - np.array([(V*V).sum(axis=0)]).T        # predictive variances
             else:     # L is not triangular => use alternative parametrization
-                fs2[id] = kss + np.array([(Ks*np.dot(L,Ks)).sum(axis=0)]).T # predictive variances
-            fs2[id] = np.maximum(fs2[id],0)            # remove numerical noise i.e. negative variances
-            Fs2 = np.tile(fs2[id],(1,N))               # we have multiple values in case of sampling
+                fs2 = kss + np.array([(Ks*np.dot(L,Ks)).sum(axis=0)]).T # predictive variances
+            fs2 = np.maximum(fs2,0)                # remove numerical noise i.e. negative variances
+        if needLik:
+            Fs2 = np.tile(fs2,(1,N))               # we have multiple values in case of sampling
             if ys is None:
-                [Lp, Ymu, Ys2] = likfunc.evaluate(None,Fmu[:],Fs2[:],None,None,3)
+                Lp, Ymu, Ys2 = self.likfunc.evaluate(None,Fmu,Fs2,None,None,3)
             else:
-                [Lp, Ymu, Ys2] = likfunc.evaluate(np.tile(ys[id],(1,N)), Fmu[:], Fs2[:],None,None,3)
-            lp[id]  = np.reshape( old_div(np.reshape(Lp,(np.prod(Lp.shape),N)).sum(axis=1),N) , (len(id),1) )   # log probability; sample averaging
-            ymu[id] = np.reshape( old_div(np.reshape(Ymu,(np.prod(Ymu.shape),N)).sum(axis=1),N) ,(len(id),1) )  # predictive mean ys|y and ...
-            ys2[id] = np.reshape( old_div(np.reshape(Ys2,(np.prod(Ys2.shape),N)).sum(axis=1),N) , (len(id),1) ) # .. variance
-            nact = id[-1]+1                  # set counter to index of next data point
-        self.ym  = ymu
-        self.ys2 = ys2
-        self.lp  = lp
-        self.fm  = fmu
-        self.fs2 = fs2
-        if ys is None:
-            return ymu, ys2, fmu, fs2, None
-        else:
-            return ymu, ys2, fmu, fs2, lp
+                Lp, Ymu, Ys2 = self.likfunc.evaluate(np.tile(ys,(1,N)),Fmu,Fs2,None,None,3)
+            if 'lp' in outputs:
+                lp  = np.reshape( old_div(np.reshape(Lp,(np.prod(Lp.shape),N)).sum(axis=1),N) , (ns,1) )   # log probability; sample averaging
+            ymu = np.reshape( old_div(np.reshape(Ymu,(np.prod(Ymu.shape),N)).sum(axis=1),N) ,(ns,1) )  # predictive mean ys|y and ...
+            ys2 = np.reshape( old_div(np.reshape(Ys2,(np.prod(Ys2.shape),N)).sum(axis=1),N) , (ns,1) ) # .. variance
+        return ymu, ys2, fmu, fs2, lp
 
 
 
@@ -531,6 +1194,8 @@ class GPR(GP):
     '''
     Model for Gaussian Process Regression
     '''
+    _stateDefaults = dict(GP._stateDefaults, window=None, t=None, nUpdates=0)
+
     def __init__(self):
         super(GPR, self).__init__()
         self.meanfunc = mean.Zero()                        # default prior mean
@@ -538,6 +1203,9 @@ class GPR(GP):
         self.likfunc = lik.Gauss()                         # likihood with default noise variance 0.1
         self.inffunc = inf.Exact()                         # inference method
         self.optimizer = opt.Minimize(self)                # default optimizer
+        self.window = None                                 # sliding window settings (see setWindow)
+        self.t = None                                      # time stamps of the training data (optional)
+        self.nUpdates = 0                                  # number of addData calls since setWindow
 
 
 
@@ -550,7 +1218,96 @@ class GPR(GP):
         self.likfunc = lik.Gauss(log_sigma)
 
 
-    def setOptimizer(self, method, num_restarts=None, min_threshold=None, meanRange=None, covRange=None, likRange=None):
+
+    def setWindow(self, size=None, horizon=None, refresh=None, reoptimize=None, numIterations=40):
+        '''
+        Sliding window mode for data streams. Subsequent calls of addData keep
+        only the last size observations and/or the observations whose time stamp
+        is within horizon of the newest one. Evicting old observations modifies
+        the Cholesky factor in O(W^2) per evicted point instead of refactorising.
+
+        :param int size: maximal number of observations W kept in the model
+        :param float horizon: maximal age of kept observations (addData then needs time stamps t)
+        :param int refresh: refactorise from scratch every refresh updates to bound numerical drift
+        :param int reoptimize: re-optimize hyperparameters (using model.optimizer) every reoptimize updates
+        :param int numIterations: number of iterations for each re-optimization
+        '''
+        if size is None and horizon is None:
+            raise Exception('Specify at least one of size and horizon for the window')
+        self.window = {'size':size, 'horizon':horizon, 'refresh':refresh,
+                       'reoptimize':reoptimize, 'numIterations':numIterations}
+        self.nUpdates = 0
+
+
+
+    def addData(self, x, y, der=False, t=None):
+        '''
+        Add new observations to the model with fixed hyperparameters
+        (including the prior mean, which is not re-adapted to the labels).
+        Instead of refactorising the whole covariance matrix, the Cholesky factor
+        is extended by the new rows in O(n^2*k) for k new points.
+        Updates model.posterior, model.nlZ and, if der is True, model.dnlZ.
+        In sliding window mode (see setWindow) the oldest observations are evicted.
+
+        :param x: new training inputs in shape (k,D)
+        :param y: new training labels in shape (k,1)
+        :param boolean der: flag for whether to compute derivatives (O(n^3))
+        :param t: time stamps of the new observations in shape (k,), non-decreasing over time
+        '''
+        assert x.shape[0] == y.shape[0], "number of inputs and labels does not match"
+        if x.ndim == 1:
+            x = np.reshape(x, (x.shape[0],1))
+        if y.ndim == 1:
+            y = np.reshape(y, (y.shape[0],1))
+        if not isinstance(self.inffunc, inf.Exact):
+            raise Exception('addData is only possible with exact inference')
+        window = self.window
+        if not t is None:
+            t = np.reshape(np.asarray(t, dtype=float), (x.shape[0],))
+        if window is not None and window['horizon'] is not None:
+            if t is None or (self.x is not None and self.t is None):
+                raise Exception('Time stamps t of all observations are needed for a window with horizon')
+        if self.x is None:
+            nold = 0
+            xall = x; yall = y; tall = t
+        else:
+            nold = self.x.shape[0]
+            xall = np.vstack((self.x, x)); yall = np.vstack((self.y, y))
+            tall = None if t is None or self.t is None else np.hstack((self.t, t))
+
+        nremove = 0                                         # number of oldest observations to evict
+        refresh = reoptimize = False
+        if window is not None:
+            if window['size'] is not None:
+                nremove = max(nremove, xall.shape[0] - window['size'])
+            if window['horizon'] is not None:
+                nremove = max(nremove, int(np.argmax(tall >= tall.max() - window['horizon'])))
+            self.nUpdates += 1
+            refresh = bool(window['refresh']) and self.nUpdates % window['refresh'] == 0
+            reoptimize = bool(window['reoptimize']) and self.nUpdates % window['reoptimize'] == 0
+
+        if nold == 0:                                       # first data
+            self.setData(xall[nremove:], yall[nremove:])
+            self.getPosterior(der=der)
+        elif nremove >= nold or refresh:                    # nothing left to extend or periodic refresh
+            self.x = xall[nremove:]; self.y = yall[nremove:]
+            self.inffunc.clearCache()
+            self.getPosterior(der=der)
+        else:
+            if der:
+                post, nlZ, dnlZ = self.inffunc.extend(self.meanfunc, self.covfunc, self.likfunc, self.x, self.y, x, y, 3, nremove)
+                self.dnlZ = deepcopy(dnlZ)
+            else:
+                post, nlZ = self.inffunc.extend(self.meanfunc, self.covfunc, self.likfunc, self.x, self.y, x, y, 2, nremove)
+            self.x = xall[nremove:]; self.y = yall[nremove:]
+            self.nlZ = nlZ
+            self.posterior = deepcopy(post)
+        self.t = None if tall is None else tall[nremove:]
+        if reoptimize:
+            self.optimize(numIterations=window['numIterations'])
+
+
+    def setOptimizer(self, method, num_restarts=None, min_threshold=None, meanRange=None, covRange=None, likRange=None, n_jobs=1, seed=None, design='random', halving=None):
         '''
         Overriding. Usage see base class pyGPs.gp.GP.setOptimizer
         '''
@@ -559,6 +1316,10 @@ class GPR(GP):
             conf = pyGPs.Optimization.conf.random_init_conf(self.meanfunc,self.covfunc,self.likfunc)
             conf.num_restarts = num_restarts
             conf.min_threshold = min_threshold
+            conf.n_jobs = n_jobs
+            conf.seed = seed
+            conf.design = design
+            conf.halving = halving
             if not meanRange is None:
                 conf.meanRange = meanRange
             if not covRange is None:
@@ -575,10 +1336,14 @@ class GPR(GP):
             self.optimizer = opt.BFGS(self,conf)
         elif method == "LBFGSB":
             self.optimizer = opt.LBFGSB(self, conf)
+        elif method == "TrustConstr":
+            self.optimizer = opt.TrustConstr(self, conf)
         elif method == "COBYLA":
             self.optimizer = opt.COBYLA(self, conf)
         elif method == "RTMinimize":
             self.optimizer = opt.RTMinimize(self, conf)
+        elif method == "Coordinate":
+            self.optimizer = opt.Coordinate(self, conf)
         else:
             raise Exception('Optimization method is not set correctly in setOptimizer')
 
@@ -613,14 +1378,16 @@ class GPR(GP):
         '''
         Use another inference techinique other than default exact inference.
 
-        :param str newInf: 'Laplace' or 'EP'
+        :param str newInf: 'Laplace', 'EP' or 'ExactEig'
         '''
         if newInf == "Laplace":
             self.inffunc = inf.Laplace()
         elif newInf == "EP":
             self.inffunc = inf.EP()
+        elif newInf == "ExactEig":
+            self.inffunc = inf.ExactEig()
         else:
-            raise Exception('Possible inf values are "Laplace", "EP".')
+            raise Exception('Possible inf values are "Laplace", "EP", "ExactEig".')
 
 
     def useLikelihood(self,newLik):
@@ -653,7 +1420,7 @@ class GPC(GP):
 
 
 
-    def setOptimizer(self, method, num_restarts=None, min_threshold=None, meanRange=None, covRange=None, likRange=None):
+    def setOptimizer(self, method, num_restarts=None, min_threshold=None, meanRange=None, covRange=None, likRange=None, n_jobs=1, seed=None, design='random', halving=None):
         '''
         Overriding. Usage see base class pyGPs.gp.GP.setOptimizer
         '''
@@ -662,6 +1429,10 @@ class GPC(GP):
             conf = pyGPs.Optimization.conf.random_init_conf(self.meanfunc,self.covfunc,self.likfunc)
             conf.num_restarts = num_restarts
             conf.min_threshold = min_threshold
+            conf.n_jobs = n_jobs
+            conf.seed = seed
+            conf.design = design
+            conf.halving = halving
             if not meanRange is None:
                 conf.meanRange = meanRange
             if not covRange is None:
@@ -676,6 +1447,10 @@ class GPC(GP):
             self.optimizer = opt.CG(self,conf)
         elif method == "BFGS":
             self.optimizer = opt.BFGS(self,conf)
+        elif method == "LBFGSB":
+            self.optimizer = opt.LBFGSB(self,conf)
+        elif method == "TrustConstr":
+            self.optimizer = opt.TrustConstr(self,conf)
 
 
 
@@ -936,15 +1711,28 @@ class GP_FITC(GP):
     '''
     Model for FITC GP base class
     '''
-    def __init__(self):
+    _stateDefaults = dict(GP._stateDefaults, num_inducing=None, inducing_method='kmeans',
+                          optimize_inducing=False, blocks=None, num_blocks=None, seed=None)
+
+    def __init__(self, num_inducing=None, inducing_method='kmeans', optimize_inducing=False, seed=0):
         super(GP_FITC, self).__init__()
         self.u = None                  # inducing points
+        self.num_inducing = num_inducing          # number of default inducing points
+        self.inducing_method = inducing_method    # initialiser of default inducing points (see pyGPs.Core.inducing)
+        self.optimize_inducing = optimize_inducing  # learn inducing points together with kernel hyperparameters
+        self.seed = seed                          # seed of the default inducing points and of the PITC partition
+        self.blocks = None                        # partition of the training set for PITC (see useInference)
+        self.num_blocks = None
 
 
 
     def setData(self, x, y, value_per_axis=5):
         '''
         Set training inputs and traning labels to model and derive deault inducing_points..
+        If num_inducing was not given to the model and a uni-distant grid with
+        value_per_axis values in each dimension has at most n points, this grid is used.
+        Otherwise num_inducing (by default min(n,500)) inducing points are selected
+        by inducing_method, see pyGPs.Core.inducing; random methods use the seed of the model.
 
         :param x: training inputs in shape (n,D)
         :param y: training labels in shape (n,1)
@@ -969,19 +1757,24 @@ class GP_FITC(GP):
             c = np.mean(y)
             self.meanfunc = mean.Const(c)    # adapt default prior mean wrt. training labels
 
-        # get range of x in each dimension
-        # 5 uniformally selected value for each dimension
-        gridAxis=[]
-        for d in range(x.shape[1]):
-            column = x[:,d]
-            mini = np.min(column)
-            maxi = np.max(column)
-            axis = np.linspace(mini,maxi,value_per_axis)
-            gridAxis.append(axis)
-        # default inducing points-> a grid
         if self.u is None:
-            self.u = np.array(list(itertools.product(*gridAxis)))
-            self.covfunc = self.covfunc.fitc(self.u)
+            n, D = x.shape
+            if self.num_inducing is None and value_per_axis**D <= n:
+                # get range of x in each dimension
+                # 5 uniformally selected value for each dimension
+                gridAxis=[]
+                for d in range(D):
+                    column = x[:,d]
+                    mini = np.min(column)
+                    maxi = np.max(column)
+                    axis = np.linspace(mini,maxi,value_per_axis)
+                    gridAxis.append(axis)
+                # default inducing points-> a grid
+                self.u = np.array(list(itertools.product(*gridAxis)))
+            else:
+                m = self.num_inducing if not self.num_inducing is None else min(n, 500)
+                self.u = inducing.select(x, m, self.inducing_method, self.covfunc, self.seed)
+            self._setSparseKernel(self.covfunc)
 
 
 
@@ -996,13 +1789,10 @@ class GP_FITC(GP):
         '''
         if not kernel is None:
             if not inducing_points is None:
-                self.covfunc = kernel.fitc(inducing_points)
                 self.u = inducing_points
-            else:
-                if not self.u is None:
-                    self.covfunc = kernel.fitc(self.u)
-                else:
-                    raise Exception("To use default inducing points, please call setData() first!")
+            elif self.u is None:
+                raise Exception("To use default inducing points, please call setData() first!")
+            self._setSparseKernel(kernel)
             if type(kernel) is cov.Pre:
                 self.usingDefaultMean = False
         if not mean is None:
@@ -1011,20 +1801,44 @@ class GP_FITC(GP):
 
 
 
+    def _setSparseKernel(self, kernel):
+        '''
+        Wrap kernel for the inducing points self.u: cov.PITCOfKernel for PITC
+        inference, cov.FITCOfKernel otherwise.
+        '''
+        if isinstance(self.inffunc, inf.PITC_Exact):
+            self.covfunc = kernel.pitc(self.u, self.blocks, self.num_blocks, self.optimize_inducing, self.seed)
+        else:
+            self.covfunc = kernel.fitc(self.u, self.optimize_inducing)
+        self.u = self.covfunc.inducingInput    # shared with covfunc, follows the optimisation
+
+
+
 
 
 class GPR_FITC(GP_FITC):
     '''
     Model for Gaussian Process Regression FITC
+
+    :param int num_inducing: number of default inducing points (see GP_FITC.setData)
+    :param inducing_method: 'kmeans' (default), 'random', 'variance', 'grid' or a function u = f(x, m, covfunc),
+                            see pyGPs.Core.inducing
+    :param bool optimize_inducing: learn the inducing points together with the kernel hyperparameters
+                                   (see cov.FITCOfKernel)
+    :param seed: seed of the random default inducing points and of the PITC partition
+                 (None: drawn from np.random)
     '''
-    def __init__(self):
-        super(GPR_FITC, self).__init__()
+    _stateDefaults = dict(GP_FITC._stateDefaults, _streamed=False)
+
+    def __init__(self, num_inducing=None, inducing_method='kmeans', optimize_inducing=False, seed=0):
+        super(GPR_FITC, self).__init__(num_inducing, inducing_method, optimize_inducing, seed)
         self.meanfunc = mean.Zero()                        # default prior mean
         self.covfunc = cov.RBF()                           # default prior covariance
         self.likfunc = lik.Gauss()                         # likihood with default noise variance 0.1
         self.inffunc = inf.FITC_Exact()                    # inference method
         self.optimizer = opt.Minimize(self)                # default optimizer
         self.u = None                                      # no default inducing points
+        self._streamed = False                             # model.x, model.y hold the last addData batch only
 
 
 
@@ -1038,7 +1852,101 @@ class GPR_FITC(GP_FITC):
 
 
 
-    def setOptimizer(self, method, num_restarts=None, min_threshold=None, meanRange=None, covRange=None, likRange=None):
+    def setData(self, x, y, value_per_axis=5):
+        '''
+        Overriding. Usage see base class pyGPs.gp.GP_FITC.setData
+        '''
+        super(GPR_FITC, self).setData(x, y, value_per_axis)
+        self._streamed = False
+
+
+
+    def _checkStreamed(self, x, y):
+        if self._streamed and (x is None or y is None):
+            raise Exception('The model was fitted by addData and keeps only the last batch of observations. '
+                            'Call setData() with the full training data first.')
+
+    def getPosterior(self, x=None, y=None, der=True):
+        '''
+        Overriding. Usage see base class pyGPs.gp.GP.getPosterior
+        Not possible without x and y after addData (model.x, model.y hold the last batch only).
+        '''
+        self._checkStreamed(x, y)
+        self._streamed = False
+        return super(GPR_FITC, self).getPosterior(x, y, der)
+
+
+
+    def optimize(self, x=None, y=None, numIterations=40):
+        '''
+        Overriding. Usage see base class pyGPs.gp.GP.optimize
+        Not possible without x and y after addData (model.x, model.y hold the last batch only).
+        '''
+        self._checkStreamed(x, y)
+        self._streamed = False
+        super(GPR_FITC, self).optimize(x, y, numIterations)
+
+
+
+    def addData(self, x, y, forget=1., inducing_points=None):
+        '''
+        Add new observations to the model with fixed hyperparameters in
+        streaming fashion. The FITC posterior depends on the data only through
+        nu by nu statistics, which are accumulated in O(k*nu^2) for k new points
+        (see inf.FITC_Exact.update), so the memory does not grow with the stream.
+        The statistics are those of the last getPosterior() or addData() call.
+        Updates model.posterior and model.nlZ (None once the inducing points or
+        hyperparameters changed between batches).
+
+        Afterwards model.x and model.y hold the new observations only, so
+        getPosterior() and optimize() need the full training data again
+        (setData, or x and y as arguments); predictions use model.posterior.
+
+        :param x: new training inputs in shape (k,D)
+        :param y: new training labels in shape (k,1)
+        :param float forget: forgetting factor in (0,1], the statistics of the
+                             earlier observations are multiplied by it
+        :param inducing_points: new inducing points in shape (nu,D); the posterior of the
+                                earlier observations is carried over to them by the
+                                streaming update of Bui et al. (see inf.FITC_Exact.update)
+        '''
+        assert x.shape[0] == y.shape[0], "number of inputs and labels does not match"
+        if x.ndim == 1:
+            x = np.reshape(x, (x.shape[0],1))
+        if y.ndim == 1:
+            y = np.reshape(y, (y.shape[0],1))
+        if not isinstance(self.inffunc, inf.FITC_Exact):
+            raise Exception('addData is only possible with FITC exact inference')
+        if not inducing_points is None:                     # wrap the kernel for the new inducing points
+            self.u = inducing_points
+            if isinstance(self.covfunc, cov.FITCOfKernel):
+                self._setSparseKernel(self.covfunc.covfunc)
+            else:
+                self._setSparseKernel(self.covfunc)
+        if self.x is None:                                  # first data: default mean and inducing points
+            self.setData(x, y)
+        elif not self.inffunc.hasStatistics():              # model.x, model.y were not fitted yet
+            if self._streamed:
+                raise Exception('The statistics of the earlier observations are missing, the stream cannot be continued. '
+                                'Call setData() with the full training data first.')
+            self.getPosterior(der=False)
+        post, nlZ = self.inffunc.update(self.meanfunc, self.covfunc, self.likfunc, x, y, 2, forget)
+        self.x = x; self.y = y
+        self._streamed = True
+        self.nlZ = nlZ
+        self.posterior = deepcopy(post)
+
+
+
+    def partial_fit(self, x, y, forget=1., inducing_points=None):
+        '''
+        Same as addData.
+        '''
+        self.addData(x, y, forget, inducing_points)
+
+
+
+    def setOptimizer(self, method, num_restarts=None, min_threshold=None, meanRange=None, covRange=None, likRange=None, n_jobs=1, seed=None, design='random', halving=None):
         '''
         Overriding. Usage see base class pyGPs.gp.GP.setOptimizer
         '''
@@ -1047,6 +1955,10 @@ class GPR_FITC(GP_FITC):
             conf = pyGPs.Optimization.conf.random_init_conf(self.meanfunc,self.covfunc,self.likfunc)
             conf.num_restarts = num_restarts
             conf.min_threshold = min_threshold
+            conf.n_jobs = n_jobs
+            conf.seed = seed
+            conf.design = design
+            conf.halving = halving
             if not meanRange is None:
                 conf.meanRange = meanRange
             if not covRange is None:
@@ -1061,6 +1973,10 @@ class GPR_FITC(GP_FITC):
             self.optimizer = opt.CG(self,conf)
         elif method == "BFGS":
             self.optimizer = opt.BFGS(self,conf)
+        elif method == "LBFGSB":
+            self.optimizer = opt.LBFGSB(self,conf)
+        elif method == "TrustConstr":
+            self.optimizer = opt.TrustConstr(self,conf)
 
 
 
@@ -1087,18 +2003,30 @@ class GPR_FITC(GP_FITC):
 
 
 
-    def useInference(self, newInf):
+    def useInference(self, newInf, blocks=None, num_blocks=None):
         '''
         Use another inference techinique other than default exact inference.
+        'PITC' keeps the covariances within the blocks of a partition of the
+        training set (inf.PITC_Exact), given by blocks or derived by k-means
+        with num_blocks blocks (by default blocks of about as many inputs as
+        there are inducing points).
 
-        :param str newInf: 'Laplace' or 'EP'
+        :param str newInf: 'Laplace', 'EP' or 'PITC'
+        :param blocks: list of index arrays partitioning the training inputs (PITC only)
+        :param int num_blocks: number of k-means blocks if blocks is not given (PITC only)
         '''
         if newInf == "Laplace":
             self.inffunc = inf.FITC_Laplace()
         elif newInf == "EP":
             self.inffunc = inf.FITC_EP()
+        elif newInf == "PITC":
+            self.inffunc = inf.PITC_Exact()
+            self.blocks = blocks
+            self.num_blocks = num_blocks
         else:
-            raise Exception('Possible inf values are "Laplace", "EP".')
+            raise Exception('Possible inf values are "Laplace", "EP", "PITC".')
+        if isinstance(self.covfunc, cov.FITCOfKernel):     # rewrap the kernel if inducing points are set
+            self._setSparseKernel(self.covfunc.covfunc)
 
 
 
@@ -1111,6 +2039,8 @@ class GPR_FITC(GP_FITC):
         if newLik == "Laplace":
             self.likfunc = lik.Laplace()
             self.inffunc = inf.FITC_EP()
+            if isinstance(self.covfunc, cov.PITCOfKernel):
+                self._setSparseKernel(self.covfunc.covfunc)
         else:
             raise Exception('Possible lik values are "Laplace".')
 
@@ -1121,9 +2051,17 @@ class GPR_FITC(GP_FITC):
 class GPC_FITC(GP_FITC):
     '''
     Model for Gaussian Process Classification FITC
+
+    :param int num_inducing: number of default inducing points (see GP_FITC.setData)
+    :param inducing_method: 'kmeans' (default), 'random', 'variance', 'grid' or a function u = f(x, m, covfunc),
+                            see pyGPs.Core.inducing
+    :param bool optimize_inducing: learn the inducing points together with the kernel hyperparameters
+                                   (see cov.FITCOfKernel)
+    :param seed: seed of the random default inducing points and of the PITC partition
+                 (None: drawn from np.random)
     '''
-    def __init__(self):
-        super(GPC_FITC, self).__init__()
+    def __init__(self, num_inducing=None, inducing_method='kmeans', optimize_inducing=False, seed=0):
+        super(GPC_FITC, self).__init__(num_inducing, inducing_method, optimize_inducing, seed)
         self.meanfunc = mean.Zero()                        # default prior mean
         self.covfunc = cov.RBF()                           # default prior covariance
         self.likfunc = lik.Erf()                           # erf liklihood
@@ -1133,7 +2071,7 @@ class GPC_FITC(GP_FITC):
 
 
 
-    def setOptimizer(self, method, num_restarts=None, min_threshold=None, meanRange=None, covRange=None, likRange=None):
+    def setOptimizer(self, method, num_restarts=None, min_threshold=None, meanRange=None, covRange=None, likRange=None, n_jobs=1, seed=None, design='random', halving=None):
         '''
         Overriding. Usage see base class pyGPs.gp.GP.setOptimizer
         '''
@@ -1142,6 +2080,10 @@ class GPC_FITC(GP_FITC):
             conf = pyGPs.Optimization.conf.random_init_conf(self.meanfunc,self.covfunc,self.likfunc)
             conf.num_restarts = num_restarts
             conf.min_threshold = min_threshold
+            conf.n_jobs = n_jobs
+            conf.seed = seed
+            conf.design = design
+            conf.halving = halving
             if not meanRange is None:
                 conf.meanRange = meanRange
             if not covRange is None:
@@ -1156,6 +2098,10 @@ class GPC_FITC(GP_FITC):
             self.optimizer = opt.CG(self,conf)
         elif method == "BFGS":
             self.optimizer = opt.BFGS(self,conf)
+        elif method == "LBFGSB":
+            self.optimizer = opt.LBFGSB(self,conf)
+        elif method == "TrustConstr":
+            self.optimizer = opt.TrustConstr(self,conf)
 
 
 
@@ -1212,4 +2158,87 @@ class GPC_FITC(GP_FITC):
 
 
 
+#----------------------------------------------------------------------
+# Saving and loading models (see GP.save)
+#----------------------------------------------------------------------
+# File layout: magic (8 bytes), format version (uint32), header length (uint64),
+# pickled header, raw C-ordered arrays. The header holds the model class, the
+# model attributes and the layout of the arrays (name -> (offset, shape, dtype)).
+# The offsets are relative to the start of the array data, which follows the
+# header at the next multiple of 64 bytes; every array is 64-byte aligned.
+_MAGIC = b'PYGPSMDL'
+_FORMAT_VERSION = 1
+_ALIGN = 64
+
+def _aligned(nbytes):
+    return -(-nbytes // _ALIGN) * _ALIGN
+
+def _writeModel(path, header, arrays):
+    '''Write header and arrays in the format of GP.save.'''
+    layout = {}
+    offset = 0
+    for key in sorted(arrays):
+        arrays[key] = np.ascontiguousarray(arrays[key])
+        layout[key] = (offset, arrays[key].shape, arrays[key].dtype.str)
+        offset += _aligned(arrays[key].nbytes)
+    raw = pickle.dumps(dict(header, version=_FORMAT_VERSION, arrays=layout), protocol=2)
+    start = _aligned(20 + len(raw))
+    with open(path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(struct.pack('<IQ', _FORMAT_VERSION, len(raw)))
+        f.write(raw)
+        for key in sorted(arrays):
+            f.seek(start + layout[key][0])
+            f.write(arrays[key].tobytes())
+
+
+
+def load(path, mmap=True):
+    '''
+    Load a model saved by model.save(path).
+    With mmap=True the training data and the posterior are memory-mapped
+    read-only, so that processes loading the same file share one copy in the
+    page cache and the model can predict without reading the arrays first.
+    Note that the header is unpickled, so only load files from trusted sources.
+
+    :param str path: file name
+    :param bool mmap: memory-map the arrays instead of reading them into memory
 
+    :return: the model (GPR, GPC, GPR_FITC, GPC_FITC, ...)
+    '''
+    with open(path, 'rb') as f:
+        if f.read(8) != _MAGIC:
+            raise Exception('%s is not a pyGPs model file' % path)
+        version, hlen = struct.unpack('<IQ', f.read(12))
+        if version > _FORMAT_VERSION:
+            raise Exception('Model file format %d is newer than supported (%d)' % (version, _FORMAT_VERSION))
+        header = pickle.loads(f.read(hlen))
+    start = _aligned(20 + hlen)
+    if mmap:
+        buf = np.memmap(path, dtype=np.uint8, mode='r')
+    arrays = {}
+    for key, (offset, shape, dtype) in header['arrays'].items():
+        dtype  = np.dtype(dtype)
+        offset = start + offset
+        if mmap and int(np.prod(shape)) > 0:
+            arrays[key] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+        else:
+            count = int(np.prod(shape))
+            arrays[key] = np.fromfile(path, dtype=dtype, count=count, offset=offset).reshape(shape)
+    model = globals()[header['class']]()
+    for key, value in header['attrs'].items():
+        setattr(model, key, value)
+    post = inf.postStruct()
+    for key in list(arrays):
+        if key.startswith('posterior.'):
+            setattr(post, key[len('posterior.'):], arrays.pop(key))
+        else:
+            setattr(model, key, arrays.pop(key))
+    if isinstance(model.covfunc, FITCOfKernel):
+        model.u = model.covfunc.inducingInput
+    model.posterior = post
+    if header['Ltril']:                    # prediction operator without any O(n^2) preparation
+        model._predictOp = (post, (post.alpha, post.L.T, post.sW, True))
+    elif np.size(post.L) > 0:
+        model._predictOp = (post, (post.alpha, post.L, post.sW, False))
+    return model
@@ -0,0 +1,207 @@
+from __future__ import division
+from __future__ import absolute_import
+from builtins import range
+from past.utils import old_div
+#================================================================================
+#    Marion Neumann [marion dot neumann at uni-bonn dot de]
+#    Daniel Marthaler [dan dot marthaler at gmail dot com]
+#    Shan Huang [shan dot huang at iais dot fraunhofer dot de]
+#    Kristian Kersting [kristian dot kersting at cs dot tu-dortmund dot de]
+#
+#    This file is part of pyGPs.
+#    The software package is released under the BSD 2-Clause (FreeBSD) License.
+#
+#    Copyright (c) by
+#    Marion Neumann, Daniel Marthaler, Shan Huang & Kristian Kersting, 18/02/2014
+#================================================================================
+
+# Initialisers of inducing points for the FITC approximation (see gp.GP_FITC).
+# Every initialiser has the signature u = f(x, m, covfunc) and returns at most
+# m inducing points in shape (m,D) for training inputs x in shape (n,D).
+# The random ones (randomSubset, kmeans) also take a seed.
+#
+#   randomSubset      m training inputs drawn without replacement      O(n)
+#   kmeans            k-means++ seeding and mini-batch k-means centres  O(n*m)
+#   pivotedCholesky   greedy variance reduction of the Nystroem          O(n*m^2)
+#                     approximation (needs covfunc)
+#   quantileGrid      grid of per-dimension quantiles with at most m points
+#
+# Further initialisers can be registered in the dictionary methods.
+#
+# partition(x, numBlocks) splits the training inputs into k-means clusters,
+# e.g. for the blocks of the PITC approximation (see cov.PITCOfKernel).
+
+import itertools
+import numpy as np
+
+
+def _sqDist(x, c):
+    '''Squared Euclidean distances between the rows of x and c (n by m).'''
+    d2 = (x*x).sum(axis=1)[:,None] - 2*np.dot(x,c.T) + (c*c).sum(axis=1)[None,:]
+    return np.maximum(d2, 0.)
+
+
+
+def randomSubset(x, m, covfunc=None, seed=None):
+    '''
+    Random subset of m training inputs.
+
+    :param x: training inputs in shape (n,D)
+    :param int m: number of inducing points
+    :param seed: seed of the random draws (None: drawn from np.random)
+    :return: inducing points in shape (m,D)
+    '''
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    n = x.shape[0]
+    idx = rng.choice(n, min(m,n), replace=False)
+    return x[np.sort(idx),:].copy()
+
+
+
+def kmeans(x, m, covfunc=None, numIters=20, batchSize=1000, seed=None):
+    '''
+    Centres of mini-batch k-means, seeded by k-means++.
+    Seeding is O(n*m), every iteration O(batchSize*m).
+
+    :param x: training inputs in shape (n,D)
+    :param int m: number of inducing points
+    :param int numIters: number of mini-batch iterations
+    :param int batchSize: number of inputs per mini-batch (all inputs if n is smaller)
+    :param seed: seed of the random draws (None: drawn from np.random)
+    :return: inducing points in shape (m,D)
+    '''
+    rng = np.random if seed is None else np.random.RandomState(seed)
+    n = x.shape[0]
+    m = min(m, n)
+    idx = [rng.randint(n)]                              # k-means++ seeding
+    d2 = _sqDist(x, x[idx,:])[:,0]
+    for j in range(1, m):
+        tot = d2.sum()
+        i = rng.choice(n, p=old_div(d2,tot)) if tot > 0 else rng.randint(n)
+        idx.append(i)
+        d2 = np.minimum(d2, _sqDist(x, x[i:i+1,:])[:,0])
+    c = x[idx,:].astype(float)
+    counts = np.zeros(m)
+    for it in range(numIters):                           # mini-batch updates
+        if n > batchSize:
+            xb = x[rng.choice(n, batchSize, replace=False),:]
+        else:
+            xb = x
+        assign = np.argmin(_sqDist(xb, c), axis=1)
+        bcount = np.bincount(assign, minlength=m).astype(float)
+        bsum = np.zeros(c.shape)
+        np.add.at(bsum, assign, xb)
+        counts += bcount
+        hit = bcount > 0                                 # per-centre learning rate 1/count
+        c[hit] += old_div(bsum[hit] - bcount[hit,None]*c[hit], counts[hit,None])
+    return c
+
+
+
+def pivotedCholesky(x, m, covfunc, tol=1e-10):
+    '''
+    Greedy variance reduction: the training input with the largest remaining
+    conditional variance is added in each step (pivoted Cholesky decomposition
+    of the kernel matrix, which is never formed). Effort is O(n*m^2) plus
+    m kernel evaluations of size n. Stops early if the remaining variance is
+    below tol times the largest prior variance.
+
+    :param x: training inputs in shape (n,D)
+    :param int m: number of inducing points
+    :param covfunc: covariance function (without FITC)
+    :return: inducing points in shape (<=m,D)
+    '''
+    if covfunc is None:
+        raise Exception('pivotedCholesky needs a covariance function')
+    n = x.shape[0]
+    m = min(m, n)
+    d = np.reshape(covfunc.getCovMatrix(z=x, mode='self_test'), (n,)).astype(float)
+    stop = tol*d.max()
+    L = np.zeros((n,m))
+    idx = []
+    for j in range(m):
+        i = int(np.argmax(d))
+        if d[i] <= stop:
+            break
+        idx.append(i)
+        k = np.reshape(covfunc.getCovMatrix(x=x, z=x[i:i+1,:], mode='cross'), (n,))
+        l = old_div(k - np.dot(L[:,:j], L[i,:j]), np.sqrt(d[i]))
+        L[:,j] = l
+        d = d - l*l
+        d[idx] = 0.
+    return x[idx,:].copy()
+
+
+
+def quantileGrid(x, m, covfunc=None):
+    '''
+    Grid of per-dimension quantiles with at most m points. The number of grid
+    values is increased one dimension at a time (widest spread first) as long
+    as the grid size stays below m; dimensions with one value use the median.
+
+    :param x: training inputs in shape (n,D)
+    :param int m: maximal number of inducing points
+    :return: inducing points in shape (<=m,D)
+    '''
+    D = x.shape[1]
+    spread = x.max(axis=0) - x.min(axis=0)
+    nvals = np.ones(D, dtype=int)
+    order = np.argsort(-spread)
+    grown = True
+    while grown:
+        grown = False
+        for d in order:
+            if np.prod(nvals) // nvals[d] * (nvals[d]+1) <= m:
+                nvals[d] += 1
+                grown = True
+    gridAxis = []
+    for d in range(D):
+        q = old_div(np.arange(nvals[d]) + 0.5, nvals[d])
+        gridAxis.append(np.quantile(x[:,d], q))
+    return np.array(list(itertools.product(*gridAxis)))
+
+
+
+methods = {'random': randomSubset,
+           'kmeans': kmeans,
+           'variance': pivotedCholesky,
+           'grid': quantileGrid}
+
+
+
+def select(x, m, method='kmeans', covfunc=None, seed=None):
+    '''
+    Select m inducing points for training inputs x.
+
+    :param x: training inputs in shape (n,D)
+    :param int m: number of inducing points
+    :param method: 'random', 'kmeans', 'variance', 'grid' or a function u = f(x, m, covfunc)
+    :param covfunc: covariance function (used by 'variance')
+    :param seed: seed of 'random' and 'kmeans' (None: drawn from np.random)
+    :return: inducing points in shape (<=m,D)
+    '''
+    if callable(method):
+        return method(x, m, covfunc)
+    if not method in methods:
+        raise Exception('Possible inducing point methods are "random", "kmeans", "variance", "grid".')
+    func = methods[method]
+    if func in (randomSubset, kmeans):
+        return func(x, m, covfunc, seed=seed)
+    return func(x, m, covfunc)
+
+
+
+def partition(x, numBlocks, seed=None):
+    '''
+    Partition of the training inputs into (at most) numBlocks blocks by
+    assigning every input to the nearest centre of kmeans().
+
+    :param x: training inputs in shape (n,D)
+    :param int numBlocks: number of blocks
+    :param seed: seed of kmeans() (None: drawn from np.random)
+    :return: list of index arrays of the non-empty blocks
+    '''
+    c = kmeans(x, numBlocks, seed=seed)
+    assign = np.argmin(_sqDist(x, c), axis=1)
+    blocks = [np.where(assign == j)[0] for j in range(c.shape[0])]
+    return [b for b in blocks if b.size > 0]
@@ -51,7 +51,10 @@ from builtins import object
 import numpy as np
 from . import lik, cov
 from copy import copy, deepcopy
-from .tools import solve_chol, brentmin, cholupdate, jitchol
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from scipy.linalg import blas, solve_triangular
+from .tools import solve_chol, solve_chol_tri, brentmin, cholupdate, jitchol
 np.seterr(all='ignore')
 
 
@@ -129,10 +132,23 @@ class dnlZStruct(object):
 
 
 
+def _covPara(covfunc):
+    '''Fixed parameters (para) of covfunc and of the kernels it is composed of.'''
+    para = [list(getattr(covfunc, 'para', []))]
+    for value in vars(covfunc).values():
+        if isinstance(value, cov.Kernel):
+            para += _covPara(value)
+    return para
+
+
+
 class Inference(object):
     '''
     Base class for inference. Defined several tool methods in it.
     '''
+    _covKey = None     # (covfunc, x, covfunc.hyp, para) the cached training covariance matrix was computed for
+    _K = None          # cached training covariance matrix
+
     def __init__(self):
         pass
 
@@ -170,6 +186,43 @@ class Inference(object):
         '''
         pass
 
+    def clearCache(self):
+        '''Forget the cached training covariance matrix.'''
+        self._covKey = None; self._K = None
+
+    def __getstate__(self):
+        '''Caches (the private attributes) are not pickled or copied, e.g. by GP.save.'''
+        state = self.__dict__.copy()
+        for key in state:
+            if key.startswith('_'):
+                state[key] = None
+        return state
+
+    def _makeCovKey(self, covfunc, x):
+        '''Key of the training covariance matrix of covfunc at x (see _trainCov).'''
+        return (covfunc, np.array(x), list(covfunc.hyp), _covPara(covfunc))
+
+    def _covKeyValid(self, covfunc, x):
+        '''Is the cached key the one of covfunc (with its hyp and para) at x?'''
+        key = self._covKey
+        return key is not None and key[0] is covfunc and key[2] == list(covfunc.hyp) \
+               and key[1].shape == x.shape and np.array_equal(key[1], x) and key[3] == _covPara(covfunc)
+
+    def _trainCov(self, covfunc, x):
+        '''
+        Training covariance matrix of covfunc at x. The matrix of the last call is
+        reused as long as covfunc, x, covfunc.hyp and the fixed parameters (para)
+        are unchanged, i.e. when only mean or likelihood hyperparameters moved
+        since the last evaluation.
+        K, changed = _trainCov(covfunc, x)
+        '''
+        if self._K is not None and self._covKeyValid(covfunc, x):
+            return self._K, False
+        K = covfunc.getCovMatrix(x=x, mode='train')
+        self._covKey = self._makeCovKey(covfunc, x)
+        self._K = K
+        return K, True
+
     def _epComputeParams(self, K, y, ttau, tnu, likfunc, m, inffunc):
         n     = len(y)                                                # number of training cases
         ssi   = np.sqrt(ttau)                                         # compute Sigma and mu
@@ -187,6 +240,21 @@ class Inference(object):
                 + old_div((old_div(tnu**2,(tau_n+ttau))).sum(),2.)- old_div(np.log(1.+old_div(ttau,tau_n)).sum(),2.)
         return Sigma, mu, nlZ[0], L
 
+    def _epRankOneUpdate(self, Sigma, mu, ii, ds2, dtnu):
+        '''
+        Update Sigma and mu in place after the site parameters of example ii
+        changed by ds2 (ttau) and dtnu (tnu). Sigma must be a Fortran ordered
+        array so that the rank-1 update is done by BLAS dger without temporaries.
+        Since mu = Sigma*tnu before the update, the new mu only needs column ii
+        of the old Sigma: effort is O(n) for mu and O(n^2) for Sigma.
+        '''
+        ds2 = np.ravel(ds2)[0]; dtnu = np.ravel(dtnu)[0]
+        si  = Sigma[:,ii].copy()                      # column ii of Sigma before the update
+        c   = ds2/(1.+ds2*si[ii])
+        mu_i = mu[ii,0]                               # = si'*tnu_old
+        blas.dger(-c, si, si, a=Sigma, overwrite_a=True)   # Sigma = Sigma - c*si*si'
+        mu[:,0] += (dtnu*(1.-c*si[ii]) - c*mu_i) * si       # mu = Sigma_new*tnu_new
+
     def _logdetA(self,K,w,nargout):
         '''
         Compute the log determinant ldA and the inverse iA of a square nxn matrix
@@ -220,17 +288,61 @@ class Inference(object):
         else:
             return ldA
 
-    def _Psi_line(self,s,dalpha,alpha,K,m,likfunc,y,inffunc):
+    def _Psi_line(self,s,dalpha,alpha,Kdalpha,Kalpha,m,likfunc,y,inffunc):
         '''Criterion Psi at alpha + s*dalpha for line search
-        [Psi,alpha,f,dlp,W] = _Psi_line(s,dalpha,alpha,hyp,K,m,lik,y,inf)
+        [Psi,alpha,f,dlp,W] = _Psi_line(s,dalpha,alpha,Kdalpha,Kalpha,m,lik,y,inf)
+
+        f is affine in s, so with Kalpha = K*alpha and Kdalpha = K*dalpha
+        precomputed once per Newton step each evaluation is O(n).
         '''
         alpha = alpha + s*dalpha
-        f = np.dot(K,alpha) + m
+        f = Kalpha + s*Kdalpha + m
         [lp,dlp,d2lp] = likfunc.evaluate(y,f,None,inffunc,None,3)
         W = -d2lp
         Psi = old_div(np.dot(alpha.T,(f-m)),2.) - lp.sum()
         return Psi[0],alpha,f,dlp,W
 
+    def _Psi_lineBatch(self,svals,dalpha,alpha,Kdalpha,Kalpha,m,likfunc,y,inffunc):
+        '''Criterion Psi at alpha + s*dalpha for several step sizes s at once.
+        The likelihood is evaluated on an n by len(svals) matrix of latent values.
+        '''
+        svals = np.atleast_2d(svals)                            # 1 by S
+        A  = alpha + dalpha*svals                               # n by S
+        Fm = Kalpha + Kdalpha*svals                             # f-m for each s
+        lp = likfunc.evaluate(y,Fm+m,None,inffunc,None,1)
+        Psi = old_div((A*Fm).sum(axis=0),2.) - lp.sum(axis=0)
+        return Psi
+
+    def _lineSearch(self,dalpha,alpha,Kdalpha,Kalpha,dlp,m,likfunc,y,inffunc,smax,Nline,thr):
+        '''
+        Line search along the Newton direction dalpha.
+        Uses Brent's method if self.linesearch is 'brent' and Armijo backtracking
+        over batches of step sizes 1, 1/2, 1/4, ... if it is 'backtrack'.
+        [Psi,alpha,f,dlp,W] = _lineSearch(dalpha,alpha,Kdalpha,Kalpha,dlp,m,lik,y,inf,smax,Nline,thr)
+        '''
+        if self.linesearch == 'brent':
+            vargout = brentmin(0,smax,Nline,thr,self._Psi_line,4,dalpha,alpha,Kdalpha,Kalpha,m,likfunc,y,inffunc)
+            return vargout[1],vargout[3],vargout[4],vargout[5],vargout[6]
+        elif self.linesearch == 'backtrack':
+            c1 = 1e-4; nbatch = 4                               # Armijo constant, step sizes per batch
+            Psi0  = self._Psi_lineBatch(np.zeros(1),dalpha,alpha,Kdalpha,Kalpha,m,likfunc,y,inffunc)[0]
+            dPsi0 = np.dot(Kdalpha.T,alpha-dlp)[0,0]            # directional derivative at s=0
+            svals = 0.5**np.arange(Nline)
+            best_s = 0.; best_Psi = Psi0
+            for k in range(0,Nline,nbatch):
+                sk = svals[k:k+nbatch]
+                Psi = self._Psi_lineBatch(sk,dalpha,alpha,Kdalpha,Kalpha,m,likfunc,y,inffunc)
+                ok = np.nonzero(Psi <= Psi0 + c1*sk*dPsi0)[0]
+                if ok.size > 0:                                 # largest step with sufficient decrease
+                    best_s = sk[ok[0]]
+                    break
+                if np.nanmin(Psi) < best_Psi:                   # otherwise remember best step so far
+                    best_Psi = np.nanmin(Psi)
+                    best_s = sk[np.nanargmin(Psi)]
+            return self._Psi_line(best_s,dalpha,alpha,Kdalpha,Kalpha,m,likfunc,y,inffunc)
+        else:
+            raise Exception('Possible linesearch values are "brent", "backtrack".')
+
     def _epfitcZ(self,d,P,R,nn,gg,ttau,tnu,d0,R0,P0,y,likfunc,m,inffunc):
         '''
         Compute the marginal likelihood approximation
@@ -295,6 +407,22 @@ class Inference(object):
         P_i = old_div(P_i,t)                                        # O(nu)
         return d,P_i,R,nn,gg,w,b
 
+    def _fitcCovDer(self,covfunc,x,ad,Auu,Au):
+        '''
+        Derivatives of nlZ wrt. the hyperparameters of a FITCOfKernel given the
+        adjoints of its matrices, i.e. nlZ changes by
+        ad'*ddiagK + sum(Auu*dKuu) + sum(Au*dKu) for a change in (diagK,Kuu,Ku).
+        Effort is O(n*nu) per kernel hyperparameter; derivatives wrt. the inducing
+        inputs are appended if the inducing inputs are optimised.
+        '''
+        dcov = []
+        for ii in range(len(covfunc.covfunc.hyp)):
+            ddiagK,dKuu,dKu = covfunc.getDerMatrix(x=x, mode='train', der=ii)  # eval cov derivatives
+            dcov.append(np.dot(ad.T,ddiagK)[0,0] + (Auu*dKuu).sum() + (Au*dKu).sum())
+        if covfunc.optimizeInducing:
+            dcov += covfunc.getInducingDer(x,Auu,Au)
+        return dcov
+
     def _mvmZ(self,x,RVdd,t):
         '''
         Matrix vector multiplication with Z=inv(K+inv(W))
@@ -309,18 +437,6 @@ class Inference(object):
         Kal = np.dot(V.T,np.dot(V,al)) + d0*al
         return Kal
 
-    def _Psi_lineFITC(self,s,dalpha,alpha,V,d0,m,likfunc,y,inffunc):
-        '''
-        Criterion Psi at alpha + s*dalpha for line search
-        '''
-        alpha = alpha + s*dalpha
-        f = self._mvmK(alpha,V,d0) + m
-        vargout = likfunc.evaluate(y,f,None,inffunc,None,3)
-        lp = vargout[0]; dlp = vargout[1]; d2lp = vargout[2]
-        W = -d2lp
-        Psi = old_div(np.dot(alpha.T,(f-m)),2.) - lp.sum()
-        return Psi[0],alpha,f,dlp,W
-
     def _fitcRefresh(self,d0,P0,R0,R0P0, w):
         '''
         Refresh the representation of the posterior from initial and site parameters
@@ -346,30 +462,83 @@ class Exact(Inference):
     Exact inference for a GP with Gaussian likelihood. Compute a parametrization
     of the posterior, the negative log marginal likelihood and its derivatives
     w.r.t. the hyperparameters.
+
+    The Cholesky factor is cached for the next call, which keeps an n by n matrix
+    in memory besides the one of the returned posterior (post.L is a copy).
     '''
+    _sn2 = None        # noise variance the cached Cholesky factor was computed for
+    _L = None          # cached Cholesky factor (the only n by n matrix kept, K is not cached)
+
     def __init__(self):
         self.name = "Exact inference"
     def evaluate(self, meanfunc, covfunc, likfunc, x, y, nargout=1):
         if not isinstance(likfunc, lik.Gauss):
             raise Exception ('Exact inference only possible with Gaussian likelihood')
         n, D = x.shape
-        K = covfunc.getCovMatrix(x=x, mode='train')            # evaluate covariance matrix
-        m = meanfunc.getMean(x)                                # evaluate mean vector
-
         sn2   = np.exp(2*likfunc.hyp[0])                       # noise variance of likGauss
-        #L     = np.linalg.cholesky(K/sn2+np.eye(n)).T         # Cholesky factor of covariance with noise
-        L     = jitchol(old_div(K,sn2)+np.eye(n)).T            # Cholesky factor of covariance with noise
-        alpha = old_div(solve_chol(L,y-m),sn2)
+        if self._L is None or sn2 != self._sn2 or not self._covKeyValid(covfunc, x):
+            K = covfunc.getCovMatrix(x=x, mode='train')        # refactorise only if K or noise changed
+            #L     = np.linalg.cholesky(K/sn2+np.eye(n)).T     # Cholesky factor of covariance with noise
+            L     = jitchol(old_div(K,sn2)+np.eye(n)).T        # Cholesky factor of covariance with noise
+            self._L = L; self._sn2 = sn2
+            self._covKey = self._makeCovKey(covfunc, x)
+        return self._posterior(meanfunc, covfunc, likfunc, x, y, self._L, sn2, nargout)
+
+    def clearCache(self):
+        '''Forget the cached Cholesky factor, e.g. to refactorise from scratch.'''
+        self._covKey = None; self._K = None
+        self._L = None; self._sn2 = None
+
+    def extend(self, meanfunc, covfunc, likfunc, x, y, xnew, ynew, nargout=1, nremove=0):
+        '''
+        Same as evaluate on the data (x, y) with the k observations (xnew, ynew)
+        appended, for fixed hyperparameters. The Cholesky factor for (x, y) is
+        taken from the cache (computed if the cache is not valid) and extended by
+        a block row, which costs O(n^2*k) instead of O((n+k)^3).
+        If nremove > 0, the first nremove observations are dropped beforehand
+        (sliding window). With R = [R11, R12; 0, R22], the factor of the remaining
+        observations is R22 modified by a rank-nremove Cholesky update with the
+        rows of R12, O(nremove*n^2).
+        The cache is updated to the resulting data set.
+        '''
+        if not isinstance(likfunc, lik.Gauss):
+            raise Exception ('Exact inference only possible with Gaussian likelihood')
+        n = x.shape[0]; k = xnew.shape[0]
+        if nremove >= n:
+            raise Exception('Can not remove %d of %d observations in extend' % (nremove, n))
+        sn2 = np.exp(2*likfunc.hyp[0])
+        if self._L is None or sn2 != self._sn2 or not self._covKeyValid(covfunc, x):
+            self._L = jitchol(old_div(covfunc.getCovMatrix(x=x, mode='train'),sn2)+np.eye(n)).T
+        R = self._L
+        if nremove > 0:                                              # R22'*R22 + R12'*R12 = K22/sn2 + I
+            R = cholupdate(R[nremove:,nremove:], R[:nremove,nremove:].T, '+')
+            x = x[nremove:,:]; y = y[nremove:,:]; n -= nremove
+        if k > 0:
+            Ks  = covfunc.getCovMatrix(x=x, z=xnew, mode='cross')         # n by k cross-covariances
+            Kss = covfunc.getCovMatrix(x=xnew, mode='train')              # k by k
+            B   = solve_triangular(R, old_div(Ks,sn2), trans='T', check_finite=False) # R'*B = Ks/sn2  O(n^2*k)
+            S   = jitchol(old_div(Kss,sn2) + np.eye(k) - np.dot(B.T,B)).T # Schur complement  O(n*k^2)
+            R   = np.vstack((np.hstack((R, B)), np.hstack((np.zeros((k,n)), S))))
+            x   = np.vstack((x, xnew)); y = np.vstack((y, ynew))
+        self._covKey = self._makeCovKey(covfunc, x)
+        self._L = R; self._sn2 = sn2
+        return self._posterior(meanfunc, covfunc, likfunc, x, y, R, sn2, nargout)
+
+    def _posterior(self, meanfunc, covfunc, likfunc, x, y, L, sn2, nargout):
+        '''Posterior, nlZ and dnlZ given the Cholesky factor L of K/sn2+I.'''
+        n, D = x.shape
+        m = meanfunc.getMean(x)                                # evaluate mean vector
+        alpha = old_div(solve_chol_tri(L,y-m),sn2)             # O(n^2) given L
         post = postStruct()
         post.alpha = alpha                                     # return the posterior parameters
         post.sW    = old_div(np.ones((n,1)),np.sqrt(sn2))               # sqrt of noise precision vector
-        post.L     = L                                         # L = chol(eye(n)+sW*sW'.*K)
+        post.L     = L.copy()                                  # L = chol(eye(n)+sW*sW'.*K), not the cached factor
 
         if nargout>1:                                          # do we want the marginal likelihood?
             nlZ = old_div(np.dot((y-m).T,alpha),2.) + np.log(np.diag(L)).sum() + n*np.log(2*np.pi*sn2)/2. # -log marg lik
             if nargout>2:                                      # do we want derivatives?
                 dnlZ = dnlZStruct(meanfunc, covfunc, likfunc)  # allocate space for derivatives
-                Q = old_div(solve_chol(L,np.eye(n)),sn2) - np.dot(alpha,alpha.T) # precompute for convenience
+                Q = old_div(solve_chol_tri(L,np.eye(n)),sn2) - np.dot(alpha,alpha.T) # precompute for convenience
                 dnlZ.lik = [sn2*np.trace(Q)]
                 if covfunc.hyp:
                     for ii in range(len(covfunc.hyp)):
@@ -383,6 +552,122 @@ class Exact(Inference):
         return post
 
 
+class eigPostStruct(postStruct):
+    '''
+    Posterior returned by ExactEig. Since no Cholesky factor is computed,
+    L = -inv(K+inv(W)) (the alternative parametrization, see postStruct)
+    is only formed from the eigendecomposition when it is accessed.
+    '''
+    def __init__(self, U, e):
+        self.alpha = np.array([])
+        self.sW    = np.array([])
+        self._L    = None
+        self._U    = U                   # eigenvectors of K
+        self._e    = e                   # eigenvalues of K + sn2*I
+
+    def _getL(self):
+        if self._L is None:
+            self._L = -np.dot(self._U/self._e.T, self._U.T)
+        return self._L
+    def _setL(self, L):
+        self._L = L
+    L = property(_getL,_setL)
+
+
+
+class ExactEig(Exact):
+    '''
+    Exact inference for a GP with Gaussian likelihood which caches the
+    eigendecomposition K = U*diag(lam)*U' of the training covariance matrix.
+    As long as x and the "shape" hyperparameters of the kernel (all but the
+    signal scale, see cov.Kernel.scaleHyp) are unchanged, a change of the noise,
+    signal scale or mean hyperparameters costs O(n^2) for alpha and O(n) for nlZ
+    and its derivatives w.r.t. these hyperparameters. Derivatives w.r.t. the
+    shape hyperparameters cost O(n^3) as in Exact; they are skipped (set to 0)
+    when shapeDerivatives is False, which is used by opt.Coordinate.
+    '''
+    def __init__(self):
+        self.name = "Exact inference with cached eigendecomposition"
+        self.shapeDerivatives = True
+        self._key = None                 # (x, shape hyperparameters, scale, covfunc, para) of the cached decomposition
+        self._U = None
+        self._lam = None
+
+    def _scaleIndex(self, covfunc):
+        '''Index and power of the signal scale hyperparameter of covfunc (or None).'''
+        if covfunc.scaleHyp is None or not covfunc.hyp:
+            return None
+        ind, power = covfunc.scaleHyp
+        return ind % len(covfunc.hyp), power
+
+    def cheapHypIndex(self, meanfunc, covfunc, likfunc):
+        '''
+        Indices into the flattened hyperparameters (mean, cov, lik) which can be
+        changed without recomputing the eigendecomposition.
+        '''
+        Lm = len(meanfunc.hyp); Lc = len(covfunc.hyp); Ll = len(likfunc.hyp)
+        ind = list(range(Lm))
+        sc = self._scaleIndex(covfunc)
+        if sc is not None:
+            ind.append(Lm+sc[0])
+        return ind + list(range(Lm+Lc, Lm+Lc+Ll))
+
+    def evaluate(self, meanfunc, covfunc, likfunc, x, y, nargout=1):
+        if not isinstance(likfunc, lik.Gauss):
+            raise Exception ('Exact inference only possible with Gaussian likelihood')
+        n, D = x.shape
+        sc = self._scaleIndex(covfunc)
+        hyp = list(covfunc.hyp)
+        if sc is None:
+            shape = tuple(hyp); scale = 0.
+        else:
+            shape = tuple(hyp[:sc[0]] + hyp[sc[0]+1:]); scale = sc[1]*hyp[sc[0]]
+        key = self._key
+        if key is None or not key[3] is covfunc or key[1] != shape or key[4] != _covPara(covfunc) \
+           or key[0].shape != x.shape or not np.array_equal(key[0], x):
+            K = covfunc.getCovMatrix(x=x, mode='train')         # evaluate covariance matrix
+            lam, U = np.linalg.eigh(K)                         # K = U*diag(lam)*U'  O(n^3)
+            self._lam = np.maximum(lam,0.); self._U = U
+            self._key = key = (np.array(x), shape, scale, covfunc, _covPara(covfunc))
+        lam = np.reshape(self._lam*np.exp(scale-key[2]),(n,1)) # eigenvalues of K for the current scale
+        U = self._U
+        m = meanfunc.getMean(x)                                # evaluate mean vector
+
+        sn2   = np.exp(2*likfunc.hyp[0])                       # noise variance of likGauss
+        e     = lam + sn2                                      # eigenvalues of K+sn2*I
+        be    = np.dot(U.T,y-m)                                # residual in eigenbasis  O(n^2)
+        alpha = np.dot(U,be/e)                                 # inv(K+sn2*I)*(y-m)      O(n^2)
+        post = eigPostStruct(U, e)
+        post.alpha = alpha                                     # return the posterior parameters
+        post.sW    = old_div(np.ones((n,1)),np.sqrt(sn2))      # sqrt of noise precision vector
+
+        if nargout>1:                                          # do we want the marginal likelihood?
+            nlZ = old_div(np.dot(be.T,be/e),2.) + old_div(np.log(e).sum(),2.) + n*np.log(2*np.pi)/2. # -log marg lik
+            if nargout>2:                                      # do we want derivatives?
+                dnlZ = dnlZStruct(meanfunc, covfunc, likfunc)  # allocate space for derivatives
+                dnlZ.lik = [sn2*((1./e).sum() - np.dot(alpha.T,alpha)[0,0])]      # O(n)
+                if covfunc.hyp:
+                    Q = None
+                    for ii in range(len(covfunc.hyp)):
+                        if sc is not None and ii == sc[0]:     # dK = power*K  O(n)
+                            aKa = (lam*be*be/(e*e)).sum()
+                            dnlZ.cov[ii] = sc[1]*((lam/e).sum() - aKa)/2.
+                        elif self.shapeDerivatives:
+                            if Q is None:                      # precompute for convenience  O(n^3)
+                                Q = np.dot(U/e.T,U.T) - np.dot(alpha,alpha.T)
+                            dnlZ.cov[ii] = old_div((Q*covfunc.getDerMatrix(x=x, mode='train', der=ii)).sum(),2.)
+                        else:
+                            dnlZ.cov[ii] = 0.
+                if meanfunc.hyp:
+                    for ii in range(len(meanfunc.hyp)):
+                        dnlZ.mean[ii] = np.dot(-meanfunc.getDerMatrix(x, ii).T,alpha)
+                        dnlZ.mean[ii] = dnlZ.mean[ii][0,0]
+                return post, nlZ[0,0], dnlZ
+            return post, nlZ[0,0]
+        return post
+
+
+
 class FITC_Exact(Inference):
     '''
     FITC approximation to the posterior Gaussian process. The function is
@@ -390,10 +675,37 @@ class FITC_Exact(Inference):
     Kt = Q + G; G = diag(g); g = diag(K-Q);  Q = Ku' * inv(Quu) * Ku;
     where Ku and Kuu are covariances w.r.t. to inducing inputs xu, snu2 = sn2/1e6
     is the noise of the inducing inputs and Quu = Kuu + snu2*eye(nu).
+
+    The posterior depends on the data only through S = Ku*diag(1/(g+sn2))*Ku'
+    and s = Ku*diag(1/(g+sn2))*(y-m). These statistics of the last call are kept,
+    so that update() can add further observations without the previous ones.
+    evaluate() only keeps the factors they are formed from; the O(nu^3) products
+    are computed by the first update(). Unlike caches, the statistics are pickled
+    and copied with the object (e.g. by GP.save), so that a stream can be continued.
     '''
+    _statKey = None    # (covfunc, covfunc.hyp, inducing inputs, sn2) the statistics were computed for
+    _statFactors = None  # (Lu, Luu, be) of evaluate, S and s are formed from them on demand
+    _S = None          # Ku*diag(1/(g+sn2))*Ku'
+    _s = None          # Ku*diag(1/(g+sn2))*(y-m)
+    _Quu = None        # Kuu + snu2*eye(nu)
+    _nlZparts = None   # [n, sum(log(g+sn2)), sum((y-m).^2/(g+sn2))] or None after a change of the inducing inputs
+
+    _streamState = ('_statKey', '_statFactors', '_S', '_s', '_Quu', '_nlZparts')
+
     def __init__(self):
         self.name = 'FICT exact inference'
 
+    def __getstate__(self):
+        state = super(FITC_Exact, self).__getstate__()
+        for key in self._streamState:                            # the statistics are not a cache
+            if key in self.__dict__:
+                state[key] = self.__dict__[key]
+        return state
+
+    def hasStatistics(self):
+        '''Whether the statistics of earlier observations are available to update().'''
+        return not self._statKey is None
+
     def evaluate(self, meanfunc, covfunc, likfunc, x, y, nargout=1):
         if not isinstance(likfunc, lik.Gauss):                  # NOTE: no explicit call to likGauss
             raise Exception ('Exact inference only possible with Gaussian likelihood')
@@ -423,6 +735,9 @@ class FITC_Exact(Inference):
         post.L  = solve_chol(np.dot(Lu,Luu),np.eye(nu)) - iKuu   # Sigma-inv(Kuu)
         post.sW = old_div(np.ones((n,1)),np.sqrt(sn2))                    # unused for FITC prediction  with gp.m
 
+        self._setStats(covfunc, sn2, None, None, None, [n, np.log(g_sn2).sum(), np.dot(r.T,r)[0,0]])
+        self._statFactors = (Lu, Luu, be)                        # statistics for update(), formed there
+
         if nargout>1:                                            # do we want the marginal likelihood
             nlZ = np.log(np.diag(Lu)).sum() + old_div((np.log(g_sn2).sum() + n*np.log(2*np.pi) + np.dot(r.T,r) - np.dot(be.T,be)),2.)
             if nargout>2:                                        # do we want derivatives?
@@ -431,13 +746,12 @@ class FITC_Exact(Inference):
                 B = np.dot(iKuu,Ku)
                 w = np.dot(B,al)
                 W = np.linalg.solve(Lu.T,old_div(V,np.tile(g_sn2.T,(nu,1))))
-                for ii in range(len(covfunc.hyp)):
-                    [ddiagKi,dKuui,dKui] = covfunc.getDerMatrix(x=x, mode='train', der=ii)    # eval cov deriv
-                    R = 2.*dKui-np.dot(dKuui,B)
-                    v = ddiagKi - np.array([(R*B).sum(axis=0)]).T          # diag part of cov deriv
-                    dnlZ.cov[ii] = old_div(( np.dot(ddiagKi.T,old_div(1.,g_sn2)) + np.dot(w.T,(np.dot(dKuui,w)-2.*np.dot(dKui,al))) \
-                                   - np.dot(al.T,(v*al)) - np.dot(np.array([(W*W).sum(axis=0)]),v) - (np.dot(R,W.T)*np.dot(B,W.T)).sum() ),2.)
-                    dnlZ.cov[ii] = dnlZ.cov[ii][0,0]
+                c = al*al + np.array([(W*W).sum(axis=0)]).T              # adjoint of diag part of cov deriv
+                M = B*c.T - np.dot(np.dot(B,W.T),W)                      # adjoint of R = 2*dKu-dKuu*B
+                ad  = 0.5*(old_div(1.,g_sn2) - c)                        # adjoints of ddiagK, dKuu, dKu
+                Auu = 0.5*(np.dot(w,w.T) - np.dot(M,B.T))
+                Au  = M - np.dot(w,al.T)
+                dnlZ.cov = self._fitcCovDer(covfunc,x,ad,Auu,Au)
                 dnlZ.lik = sn2*((old_div(1.,g_sn2)).sum() - (np.array([(W*W).sum(axis=0)])).sum() - np.dot(al.T,al))
                 dKuui = 2*snu2
                 R = -dKuui*B
@@ -455,19 +769,252 @@ class FITC_Exact(Inference):
 
 
 
+    def _setStats(self, covfunc, sn2, S, s, Quu, nlZparts):
+        self._statKey = (covfunc, list(covfunc.hyp), np.array(covfunc.inducingInput), sn2)
+        self._statFactors = None
+        self._S = S; self._s = s; self._Quu = Quu; self._nlZparts = nlZparts
+
+    def _getStats(self):
+        '''S, s and Quu of the data seen so far (None if there are none).'''
+        if self._S is None and not self._statFactors is None:   # from the factors of evaluate, O(nu^3)
+            Lu, Luu, be = self._statFactors
+            LuLuu = np.dot(Lu,Luu)
+            self._Quu = np.dot(Luu.T,Luu)
+            self._S = np.dot(LuLuu.T,LuLuu) - self._Quu
+            self._s = np.dot(LuLuu.T,be)
+            self._statFactors = None
+        return self._S, self._s, self._Quu
+
+    def clearCache(self):
+        '''Forget the statistics of the data seen so far.'''
+        super(FITC_Exact, self).clearCache()
+        self._statKey = None; self._statFactors = None
+        self._S = None; self._s = None; self._Quu = None; self._nlZparts = None
+
+    def update(self, meanfunc, covfunc, likfunc, xnew, ynew, nargout=1, forget=1.):
+        '''
+        Posterior after adding the k observations (xnew, ynew) to the data of the
+        last call (evaluate or update), in O(k*nu^2) without the earlier data:
+        S and s are multiplied by the forgetting factor forget (in (0,1]) and the
+        statistics of the new observations are added.
+        If the inducing inputs or hyperparameters changed since the last call, the
+        earlier data are carried over to the current inducing inputs b by the collapsed
+        streaming update of Bui et al. (2017): the old posterior over the values a at
+        the old inducing inputs, divided by their old prior, is a Gaussian
+        pseudo-likelihood exp(-a'*P*a/2 + a'*h) with P = inv(Qaa)*S*inv(Qaa) and
+        h = inv(Qaa)*s (Qaa the old Quu). Under the current kernel a given b has mean
+        Kab*inv(Quu)*b and covariance C = Kaa - Kab*inv(Quu)*Kba; integrating a out gives
+        S <- Kba*inv(I+P*C)*P*Kab and s <- Kba*inv(I+P*C)*h,
+        i.e. the pseudo-observations enter like one PITC block. For C = 0 (b contains
+        a, or unchanged inducing inputs and hyperparameters) this is S <- T*S*T' and
+        s <- T*s with T = Kba*inv(Qaa). The mean function is assumed unchanged.
+        The returned nlZ is None once the earlier data were carried over.
+        '''
+        if not isinstance(likfunc, lik.Gauss):
+            raise Exception ('Exact inference only possible with Gaussian likelihood')
+        if not isinstance(covfunc, cov.FITCOfKernel):
+            raise Exception('Only covFITC supported.')
+        diagK,Kuu,Ku = covfunc.getCovMatrix(x=xnew, mode='train')
+        m  = meanfunc.getMean(xnew)
+        k  = xnew.shape[0]
+        nu = Kuu.shape[0]
+        sn2   = np.exp(2*likfunc.hyp[0])
+        snu2  = 1.e-6*sn2
+        Quu   = Kuu+snu2*np.eye(nu)
+        Luu   = jitchol(Quu).T
+
+        key = self._statKey
+        S, s, Quu_old = self._getStats()
+        if S is None:                                            # no data yet
+            S = np.zeros((nu,nu)); s = np.zeros((nu,1)); parts = [0, 0., 0.]
+        elif key[0] is covfunc and key[1] == list(covfunc.hyp) and key[3] == sn2 \
+             and key[2].shape == covfunc.inducingInput.shape and np.array_equal(key[2], covfunc.inducingInput):
+            parts = self._nlZparts
+        else:                                                    # carry the old posterior over (Bui et al.)
+            xa  = key[2]
+            Kaa = covfunc.covfunc.getCovMatrix(x=xa, mode='train')
+            Kab = covfunc.covfunc.getCovMatrix(x=xa, z=covfunc.inducingInput, mode='cross')
+            C   = Kaa - np.dot(Kab, solve_chol(Luu, Kab.T))         # covariance of a given b
+            iQaa = np.linalg.inv(Quu_old)
+            P   = np.dot(iQaa, np.dot(S, iQaa))                   # pseudo-likelihood of a: precision P,
+            h   = np.dot(iQaa, s)                                 # linear term h
+            G   = np.eye(P.shape[0]) + np.dot(P, C)
+            MP  = np.linalg.solve(G, P); MP = (MP + MP.T)/2.      # inv(inv(P)+C), symmetric
+            S   = np.dot(Kab.T, np.dot(MP, Kab))
+            s   = np.dot(Kab.T, np.linalg.solve(G, h)); parts = None
+        S = forget*S; s = forget*s                               # forgetting of earlier observations
+        if not parts is None:
+            parts = [forget*p for p in parts]
+
+        V     = np.linalg.solve(Luu.T,Ku)                        # statistics of the new observations
+        g_sn2 = diagK + sn2 - np.array([(V*V).sum(axis=0)]).T
+        r     = ynew-m
+        S = S + np.dot(old_div(Ku,g_sn2.T),Ku.T)
+        s = s + np.dot(Ku,old_div(r,g_sn2))
+        if not parts is None:
+            parts = [parts[0]+k, parts[1]+np.log(g_sn2).sum(), parts[2]+np.dot(r.T,old_div(r,g_sn2))[0,0]]
+        self._setStats(covfunc, sn2, S, s, Quu, parts)
+
+        iLuu  = np.linalg.solve(Luu,np.eye(nu))
+        Lu    = jitchol(np.eye(nu) + np.dot(iLuu.T,np.dot(S,iLuu))).T   # Lu'*Lu = I+inv(Luu')*S*inv(Luu)
+        be    = np.linalg.solve(Lu.T,np.dot(iLuu.T,s))
+        post = postStruct()
+        post.alpha = np.linalg.solve(Luu,np.linalg.solve(Lu,be))
+        post.L  = solve_chol(np.dot(Lu,Luu),np.eye(nu)) - solve_chol(Luu,np.eye(nu))
+        post.sW = old_div(np.ones((k,1)),np.sqrt(sn2))           # unused for FITC prediction
+        if nargout>1:
+            nlZ = None
+            if not parts is None:
+                nlZ = np.log(np.diag(Lu)).sum() + old_div((parts[1] + parts[0]*np.log(2*np.pi) + parts[2] - np.dot(be.T,be)[0,0]),2.)
+            return post, nlZ
+        return post
+
+
+
+class PITC_Exact(Inference):
+    '''
+    PITC approximation to the posterior Gaussian process. The function is
+    equivalent to infExact with the covariance function:
+    Kt = Q + G; G = blkdiag(K_b-Q_b);  Q = Ku' * inv(Quu) * Ku;
+    where the blocks b partition the training inputs (see cov.PITCOfKernel),
+    Ku and Kuu are covariances w.r.t. to inducing inputs xu, snu2 = sn2/1e6
+    is the noise of the inducing inputs and Quu = Kuu + snu2*eye(nu).
+    With blocks of single inputs PITC is FITC. The posterior has the same form
+    as for FITC_Exact, so predictions use the inducing inputs only.
+
+    The factorisations of the blocks and their contributions to the derivatives
+    are computed on a pool of numWorkers threads (numpy releases the GIL in
+    its linear algebra); by default one per CPU, at most one per block.
+    The pool is created on first use and kept for later calls; it is not
+    pickled or copied.
+
+    :param int numWorkers: number of threads, 1 for sequential computation
+    '''
+    def __init__(self, numWorkers=None):
+        self.name = 'PITC exact inference'
+        self.numWorkers = numWorkers
+        self._pool = None                  # thread pool of _blockMap, created lazily
+        self._poolSize = None
+
+    def __del__(self):
+        pool = getattr(self, '_pool', None)
+        if not pool is None:
+            pool.close()
+
+    def _blockMap(self, func, blocks):
+        '''Apply func to the indices of all blocks, in parallel if possible.'''
+        nw = self.numWorkers
+        if nw is None:
+            nw = cpu_count()
+        if min(nw, len(blocks)) <= 1:
+            return [func(b) for b in range(len(blocks))]
+        if getattr(self, '_pool', None) is None or self._poolSize != nw:
+            if not getattr(self, '_pool', None) is None:   # numWorkers was changed
+                self._pool.close()
+            self._pool = ThreadPool(nw)
+            self._poolSize = nw
+        return self._pool.map(func, list(range(len(blocks))))
+
+    def evaluate(self, meanfunc, covfunc, likfunc, x, y, nargout=1):
+        if not isinstance(likfunc, lik.Gauss):                  # NOTE: no explicit call to likGauss
+            raise Exception ('Exact inference only possible with Gaussian likelihood')
+        if not isinstance(covfunc, cov.PITCOfKernel):
+            raise Exception('Only covPITC supported.')          # check cov
+
+        blocks = covfunc.getBlocks(x)                           # partition of the training inputs
+        Kb,Kuu,Ku = covfunc.getCovMatrix(x=x, mode='train')     # evaluate covariance matrix
+        m  = meanfunc.getMean(x)                                # evaluate mean vector
+        n, D = x.shape
+        nu = Kuu.shape[0]
+
+        sn2   = np.exp(2*likfunc.hyp[0])                         # noise variance of likGauss
+        snu2  = 1.e-6*sn2                                        # hard coded inducing inputs noise
+        Luu   = jitchol(Kuu+snu2*np.eye(nu)).T                   # Kuu + snu2*I = Luu'*Luu
+        V     = np.linalg.solve(Luu.T,Ku)                        # V = inv(Luu')*Ku => V'*V = Q
+        r     = y-m
+
+        def factor(b):                                           # G_b + sn2*I = Lb'*Lb
+            idx = blocks[b]
+            Vb  = V[:,idx]
+            Lb  = jitchol(Kb[b] - np.dot(Vb.T,Vb) + sn2*np.eye(len(idx))).T
+            iGb = solve_chol_tri(Lb,np.eye(len(idx)))
+            return np.log(np.diag(Lb)).sum(), iGb, np.dot(iGb,Vb.T), np.dot(iGb,r[idx])
+        fac = self._blockMap(factor, blocks)
+
+        iGV = np.zeros((n,nu)); iGr = np.zeros((n,1))            # inv(G+sn2*I)*V', inv(G+sn2*I)*r
+        for b in range(len(blocks)):
+            iGV[blocks[b],:] = fac[b][2]
+            iGr[blocks[b]]   = fac[b][3]
+        Lu    = jitchol(np.eye(nu) + np.dot(V,iGV)).T            # Lu'*Lu=I+V*inv(G+sn2*I)*V'
+        be    = np.linalg.solve(Lu.T,np.dot(V,iGr))
+        iKuu  = solve_chol(Luu,np.eye(nu))                       # inv(Kuu + snu2*I) = iKuu
+
+        post = postStruct()
+        post.alpha = np.linalg.solve(Luu,np.linalg.solve(Lu,be)) # return the posterior parameters
+        post.L  = solve_chol(np.dot(Lu,Luu),np.eye(nu)) - iKuu   # Sigma-inv(Kuu)
+        post.sW = old_div(np.ones((n,1)),np.sqrt(sn2))           # unused for PITC prediction with gp.m
+
+        if nargout>1:                                            # do we want the marginal likelihood
+            nlZ = sum([f[0] for f in fac]) + np.log(np.diag(Lu)).sum() \
+                  + old_div((np.dot(r.T,iGr) - np.dot(be.T,be) + n*np.log(2*np.pi)),2.)
+            if nargout>2:                                        # do we want derivatives?
+                dnlZ = dnlZStruct(meanfunc, covfunc, likfunc)    # allocate space for derivatives
+                al = iGr - np.dot(iGV,np.linalg.solve(Lu,be))    # al = (Kt+sn2*eye(n))\y
+                W  = np.linalg.solve(Lu.T,iGV.T)                 # inv(Kt+sn2*eye(n)) = inv(G+sn2*I) - W'*W
+                B  = np.linalg.solve(Luu,V)                      # B = iKuu*Ku
+                # nlZ changes by tr(P*dKt)/2 with P = inv(Kt+sn2*eye(n)) - al*al' and
+                # dKt = dQ + blkdiag(dK_b-dQ_b), dQ = dKu'*B + B'*dKu - B'*dKuu*B
+                PB = np.dot(iGV,np.linalg.solve(Luu.T,np.eye(nu))) - np.dot(W.T,np.dot(W,B.T)) \
+                     - np.dot(al,np.dot(B,al).T)                 # P*B'
+                def blockDer(b):                                 # diagonal block of P and B_b*P_bb
+                    idx = blocks[b]
+                    Pbb = fac[b][1] - np.dot(W[:,idx].T,W[:,idx]) - np.dot(al[idx],al[idx].T)
+                    return Pbb, np.dot(B[:,idx],Pbb)
+                der = self._blockMap(blockDer, blocks)
+                Au  = PB.T                                       # adjoints of dKu, dKuu and dK_b
+                BPB = np.dot(B,PB)
+                for b in range(len(blocks)):
+                    Au[:,blocks[b]] -= der[b][1]
+                    BPB -= np.dot(der[b][1],B[:,blocks[b]].T)
+                Auu = -0.5*BPB
+                for ii in range(len(covfunc.covfunc.hyp)):
+                    dKb,dKuu,dKu = covfunc.getDerMatrix(x=x, mode='train', der=ii)    # eval cov deriv
+                    dnlZ.cov[ii] = 0.5*sum([(der[b][0]*dKb[b]).sum() for b in range(len(blocks))]) \
+                                   + (Auu*dKuu).sum() + (Au*dKu).sum()
+                if covfunc.optimizeInducing:
+                    dnlZ.cov[len(covfunc.covfunc.hyp):] = covfunc.getInducingDer(x,Auu,Au)
+                trP = sum([np.trace(d[0]) for d in der])
+                dnlZ.lik = [sn2*trP + 2*snu2*np.trace(Auu)]      # noise of data and of inducing inputs
+                for ii in range(len(meanfunc.hyp)):
+                    dnlZ.mean[ii] = np.dot(-meanfunc.getDerMatrix(x, ii).T, al)
+                    dnlZ.mean[ii] = dnlZ.mean[ii][0,0]
+
+                return post, nlZ[0,0], dnlZ
+            return post, nlZ[0,0]
+        return post
+
+
+
 class Laplace(Inference):
     '''
     Laplace's Approximation to the posterior Gaussian process.
+
+    The training covariance matrix is cached for the next call (see
+    Inference._trainCov), which keeps an extra n by n matrix in memory.
+
+    :param str linesearch: line search used in the Newton iterations,
+                           'brent' (default) or 'backtrack' (Armijo backtracking)
     '''
-    def __init__(self):
+    def __init__(self, linesearch='brent'):
         self.last_alpha = None
+        self.linesearch = linesearch
 
     def evaluate(self, meanfunc, covfunc, likfunc, x, y, nargout=1):
         tol = 1e-6                           # tolerance for when to stop the Newton iterations
         smax = 2; Nline = 20; thr = 1e-4     # line search parameters
         maxit = 20                           # max number of Newton steps in f
         inffunc = self
-        K = covfunc.getCovMatrix(x=x, mode='train')    # evaluate the covariance matrix
+        K, newK = self._trainCov(covfunc, x)  # evaluate the covariance matrix (cached)
         m = meanfunc.getMean(x)              # evaluate the mean vector
         n, D = x.shape
         Psi_old = np.inf                     # make sure while loop starts by the largest old objective val
@@ -505,14 +1052,8 @@ class Laplace(Inference):
             sW = np.sqrt(W); L = jitchol(np.eye(n) + np.dot(sW,sW.T)*K).T
             b = W*(f-m) + dlp;
             dalpha = b - sW*solve_chol(L,sW*np.dot(K,b)) - alpha
-            vargout = brentmin(0,smax,Nline,thr,self._Psi_line,4,dalpha,alpha,K,m,likfunc,y,inffunc)
-            s = vargout[0]
-            Psi_new = vargout[1]
-            Nfun = vargout[2]
-            alpha = vargout[3]
-            f = vargout[4]
-            dlp = vargout[5]
-            W = vargout[6]
+            Kalpha = f - m; Kdalpha = np.dot(K,dalpha)  # f is affine along the search direction
+            Psi_new,alpha,f,dlp,W = self._lineSearch(dalpha,alpha,Kdalpha,Kalpha,dlp,m,likfunc,y,inffunc,smax,Nline,thr)
             isWneg = np.any(W<0)
         self.last_alpha = alpha                 # remember for next call
         vargout = likfunc.evaluate(y,f,None,inffunc,None,4)
@@ -574,9 +1115,13 @@ class FITC_Laplace(Inference):
     deviation of the inducing inputs snu to be a one per mil of the measurement
     noise's standard deviation sn. In case of a likelihood without noise
     parameter sn2, we simply use snu2 = 1e-6.
+
+    :param str linesearch: line search used in the Newton iterations,
+                           'brent' (default) or 'backtrack' (Armijo backtracking)
     '''
-    def __init__(self):
+    def __init__(self, linesearch='brent'):
         self.last_alpha = None
+        self.linesearch = linesearch
 
     def evaluate(self, meanfunc, covfunc, likfunc, x, y, nargout=1):
         if not isinstance(covfunc, cov.FITCOfKernel):
@@ -637,9 +1182,8 @@ class FITC_Laplace(Inference):
             b = W*(f-m) + dlp; dd = old_div(1,(1+W*d0))
             RV = np.dot( chol_inv( np.eye(nu) + np.dot(V*np.tile((W*dd).T,(nu,1)),V.T)),V )
             dalpha = dd*b - (W*dd)*np.dot(RV.T,np.dot(RV,(dd*b))) - alpha # Newt dir + line search
-            vargout = brentmin(0,smax,Nline,thr,self._Psi_lineFITC,4,dalpha,alpha,V,d0,m,likfunc,y,inffunc)
-            s = vargout[0]; Psi_new = vargout[1]; Nfun = vargout[2]; alpha = vargout[3]
-            f = vargout[4]; dlp = vargout[5]; W = vargout[6]
+            Kalpha = f - m; Kdalpha = self._mvmK(dalpha,V,d0) # f is affine along the search direction
+            Psi_new,alpha,f,dlp,W = self._lineSearch(dalpha,alpha,Kdalpha,Kalpha,dlp,m,likfunc,y,inffunc,smax,Nline,thr)
             isWneg = np.any(W<0)
 
         self.last_alpha = alpha                                     # remember for next call
@@ -672,18 +1216,17 @@ class FITC_Laplace(Inference):
             t = old_div(W,(1+W*d0))
 
             dfhat = g*d3lp  # deriv. of nlZ wrt. fhat: dfhat=diag(inv(inv(K)+W)).*d3lp/2
-            for ii in range(len(covfunc.hyp)):                      # covariance hypers
-                ddiagK,dKuu,dKu = covfunc.getDerMatrix(x=x, mode='train', der=ii)      # eval cov derivatives
-                dA = 2.*dKu.T-np.dot(R0tV.T,dKuu)                   # dQ = dA*R0tV
-                w = np.atleast_2d((dA*R0tV.T).sum(axis=1)).T        # w = diag(dQ)
-                v = ddiagK-w                                        # v = diag(dK)-diag(dQ);
-                dnlZ.cov[ii] = np.dot(ddiagK.T,t) - np.dot((RVdd*RVdd).sum(axis=0),v)   # explicit part
-                dnlZ.cov[ii] -= (np.dot(RVdd,dA)*np.dot(RVdd,R0tV.T)).sum()             # explicit part
-                dnlZ.cov[ii] = 0.5*dnlZ.cov[ii] - old_div(np.dot(alpha.T,np.dot(dA,np.dot(R0tV,alpha))+v*alpha),2.) # explicit
-                b = np.dot(dA,np.dot(R0tV,dlp)) + v*dlp             # b-K*(Z*b) = inv(eye(n)+K*diag(W))*b
-                KZb = self._mvmK(self._mvmZ(b,RVdd,t),V,d0)
-                dnlZ.cov[ii] -= np.dot(dfhat.T,(b-KZb))             # implicit part
-                dnlZ.cov[ii] = dnlZ.cov[ii][0,0]
+            # covariance hypers: dnlZ = sum(C.*dK) for dK = dQ + diag(v), v = diag(dK)-diag(dQ), with
+            # C = (Z - alpha*alpha')/2 - (h*dlp'+dlp*h')/2 symmetric, Z = inv(K+inv(W)) = diag(t)-RVdd'*RVdd,
+            # and the implicit part h'*dK*dlp, h = dfhat-Z*K*dfhat (i.e. h'*b = dfhat'*(b-K*Z*b)).
+            # dQ = dKu'*R0tV + R0tV'*dKu - R0tV'*dKuu*R0tV is symmetric, so the adjoint of v is
+            # cv = diag(C) and the one of dQ is C - diag(cv), contracted with R0tV in E = (C-diag(cv))*R0tV'
+            h  = dfhat - self._mvmZ(self._mvmK(dfhat,V,d0),RVdd,t)
+            cv = -0.5*np.array([(RVdd*RVdd).sum(axis=0)]).T - 0.5*alpha*alpha - h*dlp
+            CA = -0.5*np.dot(RVdd.T,np.dot(RVdd,R0tV.T)) - 0.5*np.dot(alpha,np.dot(R0tV,alpha).T) \
+                 - 0.5*np.dot(h,np.dot(R0tV,dlp).T) - 0.5*np.dot(dlp,np.dot(R0tV,h).T)
+            E  = CA - cv*R0tV.T
+            dnlZ.cov = self._fitcCovDer(covfunc,x,0.5*t+cv,-np.dot(R0tV,E),2.*E.T)
 
             for ii in range(len(likfunc.hyp)):                      # likelihood hypers
                 vargout = likfunc.evaluate(y,f,None,inffunc,ii,3)
@@ -722,6 +1265,9 @@ class FITC_Laplace(Inference):
 class EP(Inference):
     '''
     Expectation Propagation approximation to the posterior Gaussian Process.
+
+    The training covariance matrix is cached for the next call (see
+    Inference._trainCov), which keeps an extra n by n matrix in memory.
     '''
     def __init__(self):
         self.name = 'Expectation Propagation'
@@ -731,7 +1277,7 @@ class EP(Inference):
         tol = 1e-4; max_sweep = 10; min_sweep = 2 # tolerance to stop EP iterations
         n = x.shape[0]
         inffunc = self
-        K = covfunc.getCovMatrix(x=x, mode='train') # evaluate the covariance matrix
+        K, newK = self._trainCov(covfunc, x)      # evaluate the covariance matrix (cached)
         m = meanfunc.getMean(x)                   # evaluate the mean vector
         nlZ0 = -likfunc.evaluate(y, m, np.reshape(np.diag(K),(np.diag(K).shape[0],1)), inffunc).sum()
         if self.last_ttau is None:                # find starting point for tilde parameters
@@ -753,6 +1299,8 @@ class EP(Inference):
         nlZ_old = np.inf; sweep = 0               # converged, max. sweeps or min. sweeps?
         while (np.abs(nlZ-nlZ_old) > tol and sweep < max_sweep) or (sweep < min_sweep):
             nlZ_old = nlZ; sweep += 1
+            Sigma = np.array(Sigma, order='F')    # private Fortran copy, updated in place by dger
+            mu    = np.array(mu, dtype=float)     # private copy, updated in place
             rperm = range(n)                     # randperm(n)
             for ii in rperm:                      # iterate EP updates (in random order) over examples
                 tau_ni = old_div(1,Sigma[ii,ii]) - ttau[ii]#  first find the cavity distribution ..
@@ -760,13 +1308,11 @@ class EP(Inference):
                 # compute the desired derivatives of the indivdual log partition function
                 lZ,dlZ,d2lZ = likfunc.evaluate(y[ii], old_div(nu_ni,tau_ni), old_div(1,tau_ni), inffunc, None, 3)
                 ttau_old = copy(ttau[ii])         # then find the new tilde parameters, keep copy of old
+                tnu_old  = copy(tnu[ii])
                 ttau[ii] = old_div(-d2lZ,(1.+old_div(d2lZ,tau_ni)))
                 ttau[ii] = max(ttau[ii],0)        # enforce positivity i.e. lower bound ttau by zero
                 tnu[ii]  = old_div(( dlZ + (m[ii]-old_div(nu_ni,tau_ni))*d2lZ ),(1.+old_div(d2lZ,tau_ni)))
-                ds2 = ttau[ii] - ttau_old         # finally rank-1 update Sigma ..
-                si  = np.reshape(Sigma[:,ii],(Sigma.shape[0],1))
-                Sigma = Sigma - ds2/(1.+ds2*si[ii])*np.dot(si,si.T)   # takes 70# of total time
-                mu = np.dot(Sigma,tnu)                                # .. and recompute mu
+                self._epRankOneUpdate(Sigma, mu, ii, ttau[ii]-ttau_old, tnu[ii]-tnu_old)
             # recompute since repeated rank-one updates can destroy numerical precision
             Sigma, mu, nlZ, L = self._epComputeParams(K, y, ttau, tnu, likfunc, m, inffunc)
         if sweep == max_sweep:
@@ -913,15 +1459,12 @@ class FITC_EP(Inference):
         if nargout>2:                                         # do we want derivatives?
             dnlZ = dnlZStruct(meanfunc, covfunc, likfunc)     # allocate space for derivatives
             RVdd = RV*np.tile(dd.T,(nu,1))
-            for ii in range(len(covfunc.hyp)):
-                ddiagK,dKuu,dKu = covfunc.getDerMatrix(x=x, mode='train', der=ii)
-                dA = 2*dKu.T - np.dot(R0tV.T,dKuu)            # dQ = dA*R0tV
-                w = np.atleast_2d((dA*R0tV.T).sum(axis=1)).T  # w = diag(dQ)
-                v = ddiagK - w                                # v = diag(dK)-diag(dQ)
-                z = np.dot(dd.T,(v+w)) - np.dot(np.atleast_2d((RVdd*RVdd).sum(axis=0)), v) \
-                       - (np.dot(RVdd,dA).T * np.dot(R0tV,RVdd.T)).sum()
-                dnlZ.cov[ii] = old_div((z - np.dot(alpha.T,(alpha*v)) - np.dot(np.dot(alpha.T,dA),np.dot(R0tV,alpha))),2.)
-                dnlZ.cov[ii] = dnlZ.cov[ii][0,0]
+            # covariance hypers: with dQ = dA*R0tV, dA = 2*dKu'-R0tV'*dKuu and v = diag(dK)-diag(dQ)
+            # the derivative is linear in (v,dA) with adjoints (cv,CA)
+            cv = -0.5*np.array([(RVdd*RVdd).sum(axis=0)]).T - 0.5*alpha*alpha
+            CA = -0.5*np.dot(RVdd.T,np.dot(RVdd,R0tV.T)) - 0.5*np.dot(alpha,np.dot(R0tV,alpha).T)
+            E  = CA - cv*R0tV.T
+            dnlZ.cov = self._fitcCovDer(covfunc,x,0.5*dd+cv,-np.dot(R0tV,E),2.*E.T)
             for ii in range(len(likfunc.hyp)):                # likelihood hypers
                 dlik = likfunc.evaluate(y, old_div(nu_n,tau_n)+m, old_div(1,tau_n), inffunc, ii, 1)
                 dnlZ.lik[ii] = -dlik.sum()
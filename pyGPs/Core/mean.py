@@ -136,6 +136,20 @@ class Mean(object):
 
 
 
+    def getInputDerMatrix(self, x=None, dim=None):
+        '''
+        Compute derivatives wrt. the inputs, i.e. the vector with
+        entries d m(x_i) / d x_i[dim].
+
+        :param x: inputs in shape (n,D)
+        :param int dim: index of the input dimension
+
+        :return: the corresponding derivative vector (n by 1)
+        '''
+        raise Exception("Input derivatives are not implemented for "+type(self).__name__)
+
+
+
 class ProductOfMean(Mean):
     '''Product of two mean fucntions.'''
     def __init__(self,mean1,mean2):
@@ -171,6 +185,11 @@ class ProductOfMean(Mean):
             raise Exception("Error: der out of range for meanProduct")
         return A
 
+    def getInputDerMatrix(self, x=None, dim=None):
+        A = self.mean1.getInputDerMatrix(x, dim) * self.mean2.getMean(x) \
+          + self.mean1.getMean(x) * self.mean2.getInputDerMatrix(x, dim)
+        return A
+
 
 
 class SumOfMean(Mean):
@@ -208,6 +227,10 @@ class SumOfMean(Mean):
             raise Exception("Error: der out of range for meanSum")
         return A
 
+    def getInputDerMatrix(self, x=None, dim=None):
+        A = self.mean1.getInputDerMatrix(x, dim) + self.mean2.getInputDerMatrix(x, dim)
+        return A
+
 
 
 class ScaleOfMean(Mean):
@@ -239,6 +262,11 @@ class ScaleOfMean(Mean):
             A = c * self.mean.getDerMatrix(x,der-1)
         return A
 
+    def getInputDerMatrix(self, x=None, dim=None):
+        c = self.hyp[0]                          # scale parameter
+        A = c * self.mean.getInputDerMatrix(x, dim)
+        return A
+
 
 
 class PowerOfMean(Mean):
@@ -273,6 +301,12 @@ class PowerOfMean(Mean):
             A = d * self.mean.getMean(x) ** (d-1) * self.mean.getDerMatrix(x, der-1)
         return A
 
+    def getInputDerMatrix(self, x=None, dim=None):
+        d = np.abs(np.floor(self.hyp[0]))
+        d = max(d,1)
+        A = d * self.mean.getMean(x) ** (d-1) * self.mean.getInputDerMatrix(x, dim)
+        return A
+
 
 
 class Zero(Mean):
@@ -291,6 +325,11 @@ class Zero(Mean):
         A = np.zeros((n,1))
         return A
 
+    def getInputDerMatrix(self, x=None, dim=None):
+        n, D = x.shape
+        A = np.zeros((n,1))
+        return A
+
 
 
 class One(Mean):
@@ -309,6 +348,11 @@ class One(Mean):
         A = np.zeros((n,1))
         return A
 
+    def getInputDerMatrix(self, x=None, dim=None):
+        n, D = x.shape
+        A = np.zeros((n,1))
+        return A
+
 
 
 class Const(Mean):
@@ -333,6 +377,11 @@ class Const(Mean):
             A = np.zeros((n,1))
         return A
 
+    def getInputDerMatrix(self, x=None, dim=None):
+        n,D = x.shape
+        A = np.zeros((n,1))
+        return A
+
 
 
 class Linear(Mean):
@@ -368,6 +417,11 @@ class Linear(Mean):
             A = np.zeros((n,1))
         return A
 
+    def getInputDerMatrix(self, x=None, dim=None):
+        n, D = x.shape
+        A = self.hyp[dim] * np.ones((n,1))
+        return A
+
 
 
 
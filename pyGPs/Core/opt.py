@@ -27,16 +27,27 @@ from builtins import object
 import numpy as np
 import pyGPs
 
-from scipy.optimize import fmin_bfgs as bfgs
-from scipy.optimize import fmin_cg as cg
+import copy
+import pickle
+import multiprocessing
+import scipy.optimize as spopt
+from collections import OrderedDict, deque
 from pyGPs.Optimization import minimize, scg
+from . import parallel
 from copy import deepcopy
 
 class Optimizer(object):
+    # number of hyperparameter vectors whose objective value and derivatives are kept
+    cacheSize = 8
+
     def __init__(self, model=None, searchConfig = None):
         self.model = model
+        self._cache = OrderedDict()     # objective values, see _objective
         from . import gp
 
+    # name of the method in messages
+    methodName = 'optimizer'
+
     def findMin(self, x, y, numIters):
         '''
         Find minimal value based on negative-log-marginal-likelihood.
@@ -54,25 +65,227 @@ class Optimizer(object):
         '''
         pass
 
+    def _run(self, hypInArray, numIters):
+        '''
+        One run of the optimizer started at hypInArray.
+        Returns the optimal hyperparameters (flattened numpy array) and the
+        negative-log-marginal-likelihood there. Implemented by the subclasses.
+        '''
+        raise Exception('_run is not implemented for %s' % type(self).__name__)
+
+    def _tryRun(self, hypInArray, numIters):
+        '''
+        Result of _run, or (None, None) if the run failed.
+        With numIters = 0 the objective is only evaluated (without derivatives).
+        '''
+        try:
+            if numIters == 0:
+                hyp = np.array(hypInArray, dtype=float)
+                self._apply_in_objects(hyp)
+                nlZ, post = self.model.getPosterior(der=False)
+                if not np.isfinite(nlZ):
+                    return None, None
+                return hyp, nlZ
+            optimalHyp, funcValue = self._run(np.array(hypInArray, dtype=float), numIters)
+            return np.asarray(optimalHyp, dtype=float), funcValue
+        except Exception:
+            return None, None
+
+    def _findMinRestarts(self, numIters):
+        '''
+        findMin with the restart strategy of searchConfig (if given).
+
+        Run r = 0 starts at the current hyperparameters, run r > 0 at a point
+        from the search range (meanRange, covRange, likRange) by the design of
+        searchConfig (see pyGPs.Optimization.conf.random_init_conf.initialGuesses),
+        seeded with searchConfig.seed. With
+        searchConfig.n_jobs > 1 (or -1 for all cores) the runs are distributed
+        over a pool of worker processes, each with its own copy of the model.
+        The results are taken in the order of the runs, and the search stops
+        at the first run after which min_threshold is reached (the workers
+        still running are terminated). Hence the result does not depend on
+        the number of workers and, for a given seed, is deterministic.
+        With searchConfig.halving the restarts are pruned by successive
+        halving (see _findMinHalving).
+        '''
+        self.trailsCounter = 0
+        self.errorCounter = 0
+        self._clearCache()
+        hypInArray = self._convert_to_array()
+        conf = self.searchConfig
+        if not conf:
+            optimalHyp, funcValue = self._tryRun(hypInArray, numIters)
+            self.trailsCounter += 1
+            if optimalHyp is None:
+                self.errorCounter += 1
+                raise Exception("Can not learn hyperparamters using %s." % self.methodName)
+            return optimalHyp, funcValue
+
+        if not (conf.num_restarts or conf.min_threshold):
+            raise Exception('Specify at least one of the stop conditions')
+        seed = conf.seed
+        if seed is None:
+            seed = np.random.randint(2**31)
+        def starts():
+            yield hypInArray
+            guesses = conf.initialGuesses(seed)
+            r = 1
+            while not conf.num_restarts or r < conf.num_restarts:
+                yield next(guesses)
+                r += 1
+        if conf.halving:
+            return self._findMinHalving(starts(), numIters)
+
+        best = None
+        results = self._restartResults(starts(), numIters, conf.n_jobs)
+        try:
+            for optimalHyp, funcValue in results:
+                self.trailsCounter += 1
+                if optimalHyp is None:
+                    self.errorCounter += 1
+                elif best is None or funcValue < best[1]:
+                    best = (optimalHyp, funcValue)
+                if conf.num_restarts and self.errorCounter > old_div(conf.num_restarts,2):
+                    print("[%s] %d out of %d trails failed during optimization" % (type(self).__name__, self.errorCounter, self.trailsCounter))
+                    raise Exception("Over half of the trails failed for %s" % self.methodName)
+                if conf.min_threshold and not best is None and best[1] <= conf.min_threshold:   # reach provided mininal
+                    break
+        finally:
+            results.close()
+        print("[%s] %d out of %d trails failed during optimization" % (type(self).__name__, self.errorCounter, self.trailsCounter))
+        if best is None:
+            raise Exception("Can not learn hyperparamters using %s." % self.methodName)
+        return best
+
+    def _findMinHalving(self, starts, numIters):
+        '''
+        Successive halving over the num_restarts initial guesses in starts.
+        The guesses are screened by nlZ (one inference run each, without
+        derivatives) and the best 1/eta of them (eta = searchConfig.halving)
+        are optimized for a few iterations. The best 1/eta of those are
+        continued for eta times more iterations, and so on, until the last one
+        is continued for numIters iterations. Most guesses thus cost a single
+        evaluation instead of a full run. Failed runs are dropped.
+        '''
+        conf = self.searchConfig
+        eta = conf.halving
+        if not conf.num_restarts:
+            raise Exception('Successive halving needs num_restarts')
+        if eta < 2:
+            raise Exception('The reduction factor of successive halving must be at least 2')
+        hyps = list(starts)
+        sizes = []                                  # number of runs per rung
+        size = len(hyps)
+        while size > 1 or not sizes:
+            size = -(-size // eta)
+            sizes.append(size)
+        self.trailsCounter = len(hyps)
+        best = None
+        numIterations = 0                           # iterations of the current rung
+        for k in range(len(sizes)+1):
+            if k > 0:
+                order = sorted([r for r in range(len(hyps)) if not values[r] is None], key=lambda r: (values[r], r))
+                hyps = [hyps[r] for r in order[:sizes[k-1]]]
+                numIterations = max(1, numIters // eta**(len(sizes)-k))
+            runs = self._restartResults(hyps, numIterations, conf.n_jobs)
+            try:
+                results = list(runs)
+            finally:
+                runs.close()
+            hyps = [hyp if optimalHyp is None else optimalHyp for hyp, (optimalHyp, funcValue) in zip(hyps, results)]
+            values = [funcValue for optimalHyp, funcValue in results]
+            for funcValue in values:
+                if funcValue is None:
+                    self.errorCounter += 1
+            for hyp, funcValue in zip(hyps, values):
+                if not funcValue is None and (best is None or funcValue < best[1]):
+                    best = (hyp, funcValue)
+            if self.errorCounter > old_div(conf.num_restarts,2):
+                print("[%s] %d out of %d trails failed during optimization" % (type(self).__name__, self.errorCounter, self.trailsCounter))
+                raise Exception("Over half of the trails failed for %s" % self.methodName)
+            if best is None or (conf.min_threshold and best[1] <= conf.min_threshold):
+                break
+        print("[%s] %d out of %d trails failed during optimization" % (type(self).__name__, self.errorCounter, self.trailsCounter))
+        if best is None:
+            raise Exception("Can not learn hyperparamters using %s." % self.methodName)
+        return best
+
+    def _restartResults(self, starts, numIters, n_jobs):
+        '''
+        Generator of the results (as _tryRun) of the runs started at starts,
+        in order. Runs are computed ahead by n_jobs worker processes.
+        '''
+        n_jobs = parallel.numJobs(n_jobs)
+        if n_jobs == 1:
+            for hyp in starts:
+                yield self._tryRun(hyp, numIters)
+            return
+        pool = multiprocessing.Pool(n_jobs, _restartInit, (self._restartPayload(),))
+        try:
+            starts = iter(starts)
+            pending = deque()
+            while True:
+                while len(pending) < 2*n_jobs:              # keep the workers busy, runs may be unlimited
+                    hyp = next(starts, None)
+                    if hyp is None:
+                        break
+                    pending.append(pool.apply_async(_restartRun, (hyp, numIters)))
+                if not pending:
+                    return
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+
+    def _restartPayload(self):
+        '''Pickled copy of the optimizer and its model, without posterior and predictions.'''
+        model = copy.copy(self.model)
+        for key in ('xs', 'ys', 'ym', 'ys2', 'fm', 'fs2', 'lp', '_posterior', '_predictOp', '_localTreeCache'):
+            if key in vars(model):
+                setattr(model, key, None)
+        optimizer = copy.copy(self)
+        optimizer.model = model
+        optimizer._cache = OrderedDict()
+        model.optimizer = optimizer
+        return pickle.dumps(optimizer, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _objective(self, hypInArray):
+        '''
+        Negative-log-marginal-likelihood and its derivatives, both from one
+        inference run (evaluate with nargout=3). The results of the last
+        cacheSize hyperparameter vectors are kept (least recently used are
+        dropped), so that line searches and the separate value and gradient
+        callbacks of scipy do not evaluate the model twice at the same point.
+        The cache is cleared by findMin (see _clearCache).
+        '''
+        hyp = np.asarray(hypInArray, dtype=float)
+        key = (hyp.tobytes(), getattr(self.model.inffunc, 'shapeDerivatives', True))
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            nlZ, dnlZ = self._cache[key]
+            return nlZ, dnlZ.copy()
+        self._apply_in_objects(hyp)
+        nlZ, dnlZ, post = self.model.getPosterior()
+        dnlZ = np.array(dnlZ.mean + dnlZ.cov + dnlZ.lik)
+        self._cache[key] = (nlZ, dnlZ.copy())
+        while len(self._cache) > self.cacheSize:
+            self._cache.popitem(last=False)
+        return nlZ, dnlZ
+
+    def _clearCache(self):
+        '''Forget all objective values (the data or the model may have changed).'''
+        self._cache = OrderedDict()
+
     def _nlml(self, hypInArray):
         '''Find negative-log-marginal-likelihood'''
-        self._apply_in_objects(hypInArray)
-        nlZ, dnlZ = self.model.getPosterior(der=False)
-        return nlZ
+        return self._objective(hypInArray)[0]
 
     def _dnlml(self, hypInArray):
         '''Find derivatives wrt. negative-log-marginal-likelihood'''
-        self._apply_in_objects(hypInArray)
-        nlZ, dnlZ, post = self.model.getPosterior()
-        dnlml_List = dnlZ.mean + dnlZ.cov + dnlZ.lik
-        return np.array(dnlml_List)
+        return self._objective(hypInArray)[1]
 
     def _nlzAnddnlz(self, hypInArray):
         '''Find negative-log-marginal-likelihood and derivatives in one pass(faster)'''
-        self._apply_in_objects(hypInArray)
-        nlZ, dnlZ, post = self.model.getPosterior()
-        dnlml_List = dnlZ.mean + dnlZ.cov + dnlZ.lik
-        return nlZ, np.array(dnlml_List)
+        return self._objective(hypInArray)
 
     def _convert_to_array(self):
         '''Convert all hyparameters in the model to an array'''
@@ -88,9 +301,33 @@ class Optimizer(object):
         self.model.covfunc.hyp   = hypInList[Lm:(Lm+Lc)]
         self.model.likfunc.hyp   = hypInList[(Lm+Lc):]
 
+    def _hypBounds(self, bounds=None):
+        '''
+        Bounds (low, high) of the hyperparameters, in the order of _convert_to_array.
+        Unless given, they are the ranges of the initial guesses of searchConfig
+        (or the default ranges of pyGPs.Optimization.conf.random_init_conf),
+        extended to contain the current hyperparameters with a margin of half the
+        width of the range (e.g. a constant mean at the mean of the targets).
+        Ranges with low == high
+        (e.g. fixed inducing inputs) are unbounded. None stands for no bound.
+        '''
+        hyp = self._convert_to_array()
+        if bounds is None:
+            conf = self.searchConfig
+            if not conf:
+                conf = pyGPs.Optimization.conf.random_init_conf(self.model.meanfunc, self.model.covfunc, self.model.likfunc)
+            bounds = conf.meanRange + conf.covRange + conf.likRange
+            bounds = [(None, None) if low == high else (min(low, h-0.5*(high-low)), max(high, h+0.5*(high-low)))
+                      for (low, high), h in zip(bounds, hyp)]
+        if len(bounds) != hyp.shape[0]:
+            raise Exception('The number of bounds is not consistent with the number of hyperparameters')
+        return list(bounds)
+
 
 class CG(Optimizer):
     '''Conjugent gradient'''
+    methodName = 'conjugate gradient'
+
     def __init__(self, model, searchConfig = None):
         super(CG, self).__init__()
         self.model = model
@@ -98,58 +335,23 @@ class CG(Optimizer):
         self.trailsCounter = 0
         self.errorCounter = 0
 
+    def _run(self, hypInArray, numIters):
+        opt = spopt.minimize(self._nlzAnddnlz, hypInArray, jac=True, method='CG', options={'maxiter': numIters})
+        if opt.status == 1:
+            print("Maximum number of iterations exceeded.")
+        elif opt.status ==  2:
+            print("Gradient and/or function calls not changing.")
+        return deepcopy(opt.x), opt.fun
+
     def findMin(self, x, y, numIters = 100):
-        meanfunc = self.model.meanfunc
-        covfunc = self.model.covfunc
-        likfunc = self.model.likfunc
-        inffunc = self.model.inffunc
-        hypInArray = self._convert_to_array()
-        try:
-            opt = cg(self._nlml, hypInArray, self._dnlml, maxiter=numIters, disp=False, full_output=True)
-            optimalHyp = deepcopy(opt[0])
-            funcValue  = opt[1]
-            warnFlag   = opt[4]
-            if warnFlag == 1:
-                print("Maximum number of iterations exceeded.")
-            elif warnFlag ==  2:
-                print("Gradient and/or function calls not changing.")
-        except:
-            self.errorCounter += 1
-            if not self.searchConfig:         
-                raise Exception("Can not learn hyperparamters using conjugate gradient.")
-        self.trailsCounter += 1
-
-        if self.searchConfig:
-            searchRange = self.searchConfig.meanRange + self.searchConfig.covRange + self.searchConfig.likRange 
-            if not (self.searchConfig.num_restarts or self.searchConfig.min_threshold):
-                raise Exception('Specify at least one of the stop conditions')
-            while True:
-                self.trailsCounter += 1                 # increase counter
-                for i in range(hypInArray.shape[0]):   # random init of hyp
-                    hypInArray[i]= np.random.uniform(low=searchRange[i][0], high=searchRange[i][1])
-                # value this time is better than optiaml min value
-                try:
-                    thisopt = cg(self._nlml, hypInArray, self._dnlml, maxiter=100, disp=False, full_output=True)
-                    if thisopt[1] < funcValue:
-                        funcValue  = thisopt[1]
-                        optimalHyp = thisopt[0]
-                except:
-                    self.errorCounter += 1
-                if self.searchConfig.num_restarts and self.errorCounter > old_div(self.searchConfig.num_restarts,2):
-                    print("[CG] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    raise Exception("Over half of the trails failed for conjugate gradient")
-                if self.searchConfig.num_restarts and self.trailsCounter > self.searchConfig.num_restarts-1:         # if exceed num_restarts
-                    print("[CG] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    return optimalHyp, funcValue
-                if self.searchConfig.min_threshold and funcValue <= self.searchConfig.min_threshold:           # reach provided mininal
-                    print("[CG] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    return optimalHyp, funcValue 
-        return optimalHyp, funcValue
+        return self._findMinRestarts(numIters)
 
 
 
 class BFGS(Optimizer):
     '''quasi-Newton method of Broyden, Fletcher, Goldfarb, and Shanno (BFGS)'''
+    methodName = 'BFGS'
+
     def __init__(self, model, searchConfig = None):
         super(BFGS, self).__init__()
         self.model = model
@@ -157,61 +359,23 @@ class BFGS(Optimizer):
         self.trailsCounter = 0
         self.errorCounter = 0
 
-    def findMin(self, x, y, numIters = 100):
-        meanfunc = self.model.meanfunc
-        covfunc = self.model.covfunc
-        likfunc = self.model.likfunc
-        inffunc = self.model.inffunc
-        hypInArray = self._convert_to_array()
-
-        try:
-            opt = bfgs(self._nlml, hypInArray, self._dnlml, maxiter=numIters, disp=False, full_output=True)
-            optimalHyp = deepcopy(opt[0])
-            funcValue  = opt[1]
-            warnFlag   = opt[6]
-            if warnFlag == 1:
-                print("Maximum number of iterations exceeded.")
-            elif warnFlag ==  2:
-                print("Gradient and/or function calls not changing.")
-        except:
-            self.errorCounter += 1
-            if not self.searchConfig:         
-                raise Exception("Can not learn hyperparamters using BFGS.")
-        self.trailsCounter += 1
-
-
-        if self.searchConfig:
-            searchRange = self.searchConfig.meanRange + self.searchConfig.covRange + self.searchConfig.likRange 
-            if not (self.searchConfig.num_restarts or self.searchConfig.min_threshold):
-                raise Exception('Specify at least one of the stop conditions')
-            while True:
-                self.trailsCounter += 1                 # increase counter
-                for i in range(hypInArray.shape[0]):   # random init of hyp
-                    hypInArray[i]= np.random.uniform(low=searchRange[i][0], high=searchRange[i][1])
-                # value this time is better than optiaml min value
-                try:
-                    thisopt = bfgs(self._nlml, hypInArray, self._dnlml, maxiter=100, disp=False, full_output=True)
-                    if thisopt[1] < funcValue:
-                        funcValue  = thisopt[1]
-                        optimalHyp = thisopt[0]
-                except:
-                    self.errorCounter += 1
-                if self.searchConfig.num_restarts and self.errorCounter > old_div(self.searchConfig.num_restarts,2):
-                    print("[BFGS] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    raise Exception("Over half of the trails failed for BFGS")
-                if self.searchConfig.num_restarts and self.trailsCounter > self.searchConfig.num_restarts-1:         # if exceed num_restarts
-                    print("[BFGS] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    return optimalHyp, funcValue
-                if self.searchConfig.min_threshold and funcValue <= self.searchConfig.min_threshold:           # reach provided mininal
-                    print("[BFGS] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    return optimalHyp, funcValue
+    def _run(self, hypInArray, numIters):
+        opt = spopt.minimize(self._nlzAnddnlz, hypInArray, jac=True, method='BFGS', options={'maxiter': numIters})
+        if opt.status == 1:
+            print("Maximum number of iterations exceeded.")
+        elif opt.status ==  2:
+            print("Gradient and/or function calls not changing.")
+        return deepcopy(opt.x), opt.fun
 
-        return optimalHyp, funcValue
+    def findMin(self, x, y, numIters = 100):
+        return self._findMinRestarts(numIters)
 
 
 
 class Minimize(Optimizer):
     '''minimize by Carl Rasmussen (python implementation of "minimize" in GPML)'''
+    methodName = 'minimize'
+
     def __init__(self, model, searchConfig = None):
         super(Minimize, self).__init__()
         self.model = model
@@ -219,58 +383,21 @@ class Minimize(Optimizer):
         self.trailsCounter = 0
         self.errorCounter = 0
 
-    def findMin(self, x, y, numIters = 200):
-        meanfunc = self.model.meanfunc
-        covfunc = self.model.covfunc
-        likfunc = self.model.likfunc
-        inffunc = self.model.inffunc
-        hypInArray = self._convert_to_array()
+    def _run(self, hypInArray, numIters):
+        # opt = minimize.run(self._nlzAnddnlz, hypInArray, length=-numIters)
+        opt = minimize.run(self._nlzAnddnlz, hypInArray, length=numIters)
+        print("Number of line searches %g" % opt[2])
+        return deepcopy(opt[0]), opt[1][-1]
 
-        try:
-            # opt = minimize.run(self._nlzAnddnlz, hypInArray, length=-numIters)
-            opt = minimize.run(self._nlzAnddnlz, hypInArray, length=numIters)
-            optimalHyp = deepcopy(opt[0])
-            funcValue  = opt[1][-1]
-            print("Number of line searches %g" % opt[2])
-        except:
-            self.errorCounter += 1
-            if not self.searchConfig:
-                raise Exception("Can not learn hyperparamters using minimize.")
-        self.trailsCounter += 1
-
-        if self.searchConfig:
-            searchRange = self.searchConfig.meanRange + self.searchConfig.covRange + self.searchConfig.likRange
-            if not (self.searchConfig.num_restarts or self.searchConfig.min_threshold):
-                raise Exception('Specify at least one of the stop conditions')
-            while True:
-                self.trailsCounter += 1                 # increase counter
-                for i in xrange(hypInArray.shape[0]):   # random init of hyp
-                    hypInArray[i]= np.random.uniform(low=searchRange[i][0], high=searchRange[i][1])
-                # value this time is better than optiaml min value
-                try:
-                    # thisopt = minimize.run(self._nlzAnddnlz, hypInArray, length=-numIters)
-                    thisopt = minimize.run(self._nlzAnddnlz, hypInArray, length=numIters)
-                    print("Number of line searches %g" % thisopt[2])
-                    if thisopt[1][-1] < funcValue:
-                        funcValue  = thisopt[1][-1]
-                        optimalHyp = thisopt[0]
-                except:
-                    self.errorCounter += 1
-                if self.searchConfig.num_restarts and self.errorCounter > self.searchConfig.num_restarts/2:
-                    print("[Minimize] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    raise Exception("Over half of the trails failed for minimize")
-                if self.searchConfig.num_restarts and self.trailsCounter > self.searchConfig.num_restarts-1:         # if exceed num_restarts
-                    print("[Minimize] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    return optimalHyp, funcValue
-                if self.searchConfig.min_threshold and funcValue <= self.searchConfig.min_threshold:           # reach provided mininal
-                    print("[Minimize] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    return optimalHyp, funcValue
-        return optimalHyp, funcValue
+    def findMin(self, x, y, numIters = 200):
+        return self._findMinRestarts(numIters)
 
 
 
 class SCG(Optimizer):
     '''Scaled conjugent gradient (faster than CG)'''
+    methodName = 'Scaled conjugate gradient'
+
     def __init__(self, model, searchConfig = None):
         super(SCG, self).__init__()
         self.model = model
@@ -278,49 +405,145 @@ class SCG(Optimizer):
         self.trailsCounter = 0
         self.errorCounter = 0
 
+    def _run(self, hypInArray, numIters):
+        opt = scg.run(self._nlzAnddnlz, hypInArray, niters = numIters)
+        return deepcopy(opt[0]), opt[1][-1]
+
+    def findMin(self, x, y, numIters = 100):
+        return self._findMinRestarts(numIters)
+
+
+
+
+
+class LBFGSB(Optimizer):
+    '''
+    Limited-memory BFGS with bounds on the hyperparameters (L-BFGS-B).
+    Keeps memory pairs of updates instead of a dense inverse Hessian, so that
+    kernels with many hyperparameters (e.g. SM, ARD) are cheap to optimize.
+    The bounds keep the (log) hyperparameters out of regions where the kernel
+    matrix is numerically singular. By default they are the ranges of the initial
+    guesses (see Optimizer._hypBounds), or given as a list of (low, high).
+    '''
+    methodName = 'L-BFGS-B'
+
+    def __init__(self, model, searchConfig = None, bounds = None, memory = 10):
+        super(LBFGSB, self).__init__()
+        self.model = model
+        self.searchConfig = searchConfig
+        self.bounds = bounds            # list of (low, high) per hyperparameter, None: see _hypBounds
+        self.memory = memory            # number of updates kept for the Hessian approximation
+        self.trailsCounter = 0
+        self.errorCounter = 0
+
+    def _run(self, hypInArray, numIters):
+        opt = spopt.minimize(self._nlzAnddnlz, hypInArray, jac=True, method='L-BFGS-B', bounds=self._runBounds,
+                             options={'maxiter': numIters, 'maxcor': self.memory})
+        if opt.status == 1:
+            print("Maximum number of iterations exceeded.")
+        elif opt.status == 2:
+            print("Abnormal termination in line search.")
+        return deepcopy(opt.x), opt.fun
+
     def findMin(self, x, y, numIters = 100):
-        meanfunc = self.model.meanfunc
-        covfunc = self.model.covfunc
-        likfunc = self.model.likfunc
+        self._runBounds = self._hypBounds(self.bounds)
+        return self._findMinRestarts(numIters)
+
+
+
+class TrustConstr(Optimizer):
+    '''
+    Trust-region method with bounds on the hyperparameters (scipy's trust-constr)
+    and a quasi-Newton (BFGS) approximation of the Hessian.
+    Bounds as for LBFGSB.
+    '''
+    methodName = 'trust-region'
+
+    def __init__(self, model, searchConfig = None, bounds = None):
+        super(TrustConstr, self).__init__()
+        self.model = model
+        self.searchConfig = searchConfig
+        self.bounds = bounds            # list of (low, high) per hyperparameter, None: see _hypBounds
+        self.trailsCounter = 0
+        self.errorCounter = 0
+
+    def _run(self, hypInArray, numIters):
+        low  = [-np.inf if b[0] is None else b[0] for b in self._runBounds]
+        high = [np.inf if b[1] is None else b[1] for b in self._runBounds]
+        opt = spopt.minimize(self._nlzAnddnlz, hypInArray, jac=True, hess=spopt.BFGS(), method='trust-constr',
+                             bounds=spopt.Bounds(low, high), options={'maxiter': numIters})
+        if opt.status == 0:
+            print("Maximum number of iterations exceeded.")
+        return deepcopy(opt.x), opt.fun
+
+    def findMin(self, x, y, numIters = 100):
+        self._runBounds = self._hypBounds(self.bounds)
+        return self._findMinRestarts(numIters)
+
+
+
+class Coordinate(Optimizer):
+    '''
+    Coordinate-wise minimize. Alternates between a run of minimize over the
+    "cheap" hyperparameters only (see inf.ExactEig.cheapHypIndex: mean, signal
+    scale and likelihood hyperparameters), during which the kernel matrix is not
+    refactorised, and a few line searches over all hyperparameters.
+    Requires an inference method providing cheapHypIndex, i.e. inf.ExactEig.
+    '''
+    methodName = 'coordinate-wise minimize'
+
+    def __init__(self, model, searchConfig = None, numBlocks = 10, numFull = 3, tol = 1e-6):
+        super(Coordinate, self).__init__()
+        self.model = model
+        self.searchConfig = searchConfig
+        self.numBlocks = numBlocks      # maximal number of (cheap, full) alternations
+        self.numFull = numFull          # line searches over all hyperparameters per alternation
+        self.tol = tol                  # stop when one alternation improves nlZ by less than tol
+        self.trailsCounter = 0
+        self.errorCounter = 0
+
+    def _nlzAnddnlzCheap(self, hypCheap, hypInArray, cheap):
+        '''nlZ and derivatives as a function of the cheap hyperparameters only'''
+        hyp = hypInArray.copy()
+        hyp[cheap] = hypCheap
+        nlZ, dnlZ = self._nlzAnddnlz(hyp)
+        return nlZ, dnlZ[cheap]
+
+    def _run(self, hypInArray, numIters):
+        '''One coordinate-wise minimization started at hypInArray.'''
         inffunc = self.model.inffunc
-        hypInArray = self._convert_to_array()
-        try:
-            opt = scg.run(self._nlzAnddnlz, hypInArray, niters = numIters)
-            optimalHyp = deepcopy(opt[0])
-            funcValue  = opt[1][-1]
-        except:
-            self.errorCounter += 1
-            if not self.searchConfig:
-                raise Exception("Can not learn hyperparamters using Scaled conjugate gradient.")
-        self.trailsCounter += 1
-
-        if self.searchConfig:
-            searchRange = self.searchConfig.meanRange + self.searchConfig.covRange + self.searchConfig.likRange
-            if not (self.searchConfig.num_restarts or self.searchConfig.min_threshold):
-                raise Exception('Specify at least one of the stop conditions')
-            while True:
-                self.trailsCounter += 1                 # increase counter
-                for i in range(hypInArray.shape[0]):   # random init of hyp
-                    hypInArray[i]= np.random.uniform(low=searchRange[i][0], high=searchRange[i][1])
-                # value this time is better than optiaml min value
+        cheap = np.array(inffunc.cheapHypIndex(self.model.meanfunc, self.model.covfunc, self.model.likfunc), dtype=int)
+        hyp = np.array(hypInArray, dtype=float)
+        funcValue = np.inf
+        for block in range(self.numBlocks):
+            if cheap.size > 0:
+                inffunc.shapeDerivatives = False
                 try:
-                    thisopt = scg.run(self._nlzAnddnlz, hypInArray)
-                    if thisopt[1][-1] < funcValue:
-                        funcValue  = thisopt[1][-1]
-                        optimalHyp = thisopt[0]
-                except:
-                    self.errorCounter += 1
-                if self.searchConfig.num_restarts and self.errorCounter > old_div(self.searchConfig.num_restarts,2):
-                    print("[SCG] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    raise Exception("Over half of the trails failed for Scaled conjugate gradient")
-                if self.searchConfig.num_restarts and self.trailsCounter > self.searchConfig.num_restarts-1:         # if exceed num_restarts
-                    print("[SCG] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    return optimalHyp, funcValue
-                if self.searchConfig.min_threshold and funcValue <= self.searchConfig.min_threshold:           # reach provided mininal
-                    print("[SCG] %d out of %d trails failed during optimization" % (self.errorCounter, self.trailsCounter))
-                    return optimalHyp, funcValue 
+                    opt = minimize.run(self._nlzAnddnlzCheap, hyp[cheap], args=(hyp, cheap), length=numIters)
+                finally:
+                    inffunc.shapeDerivatives = True
+                hyp[cheap] = opt[0]
+            opt = minimize.run(self._nlzAnddnlz, hyp, length=self.numFull)
+            hyp = deepcopy(opt[0])
+            if funcValue - opt[1][-1] < self.tol:
+                funcValue = min(funcValue, opt[1][-1])
+                break
+            funcValue = opt[1][-1]
+        self._apply_in_objects(hyp)
+        return hyp, funcValue
+
+    def findMin(self, x, y, numIters = 200):
+        if not hasattr(self.model.inffunc, 'cheapHypIndex'):    # before the runs, which catch their errors
+            raise Exception('Coordinate optimizer requires an inference method with cheapHypIndex, e.g. inf.ExactEig')
+        return self._findMinRestarts(numIters)
+
 
-        return optimalHyp, funcValue
 
+# worker side of Optimizer._restartResults
+_restartWorker = {'optimizer': None}
 
+def _restartInit(payload):
+    _restartWorker['optimizer'] = pickle.loads(payload)
 
+def _restartRun(hypInArray, numIters):
+    return _restartWorker['optimizer']._tryRun(hypInArray, numIters)
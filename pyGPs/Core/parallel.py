@@ -0,0 +1,332 @@
+from __future__ import division
+from __future__ import absolute_import
+from builtins import range
+from builtins import object
+#================================================================================
+#    Marion Neumann [marion dot neumann at uni-bonn dot de]
+#    Daniel Marthaler [dan dot marthaler at gmail dot com]
+#    Shan Huang [shan dot huang at iais dot fraunhofer dot de]
+#    Kristian Kersting [kristian dot kersting at cs dot tu-dortmund dot de]
+#
+#    This file is part of pyGPs.
+#    The software package is released under the BSD 2-Clause (FreeBSD) License.
+#
+#    Copyright (c) by
+#    Marion Neumann, Daniel Marthaler, Shan Huang & Kristian Kersting, 18/02/2014
+#================================================================================
+
+# Parallel prediction on a pool of worker processes (see gp.GP.predict(n_jobs=k)
+# and gp.GP.predict_local(n_jobs=k)).
+#
+# The training inputs, the prediction operator of the posterior (alpha, L, sW)
+# and the pickled mean, covariance and likelihood functions (with their
+# hyperparameters) are copied once per posterior into a block of shared memory.
+# The block is reused as long as the posterior, the functions and their
+# hyperparameters are unchanged.
+# For every call the test inputs (and targets) are copied into a second block
+# that also holds the output buffer. Workers attach to the blocks zero-copy,
+# keep the posterior block attached as long as it is in use, predict
+# contiguous chunks of test points and write into the output buffer.
+# Pools stay alive across calls (one pool per number of workers).
+# Concurrent calls from several threads are allowed: a posterior block that is
+# replaced while calls are using it is removed when the last of them is done.
+#
+# Requires multiprocessing.shared_memory (Python >= 3.8).
+
+import atexit
+import pickle
+import weakref
+import threading
+import multiprocessing
+import numpy as np
+from . import inf
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+
+# names of the outputs of predict, in order (as gp.GP._predictNames)
+_outputNames = ('ym', 'ys2', 'fm', 'fs2', 'lp')
+
+
+
+def _attach(name):
+    '''Attach to an existing shared memory block without tracking it in this process.'''
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:                                   # Python < 3.13: suppress the registration
+        from multiprocessing import resource_tracker    # (the tracker may be shared with the parent)
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+
+def _close(shm):
+    '''Close a shared memory block; it stays mapped while views of it are alive.'''
+    try:
+        shm.close()
+    except BufferError:
+        pass
+
+
+
+class SharedArrays(object):
+    '''
+    Several arrays in one block of shared memory. The block is created from
+    a dictionary of arrays (None entries are skipped) and described by its
+    layout, a dictionary name -> (offset, shape, dtype) that can be sent to
+    other processes to rebuild the views with views(buf, layout).
+    '''
+    def __init__(self, arrays):
+        if shared_memory is None:
+            raise Exception('Parallel prediction needs multiprocessing.shared_memory (Python >= 3.8).')
+        layout = {}
+        offset = 0
+        for key in sorted(arrays):
+            a = arrays[key]
+            if a is None:
+                continue
+            a = np.asarray(a)
+            layout[key] = (offset, a.shape, a.dtype.str)
+            offset += -(-a.nbytes // 8) * 8                 # keep every array 8-byte aligned
+        self.shm = shared_memory.SharedMemory(create=True, size=max(offset, 8))
+        self.name = self.shm.name
+        self.layout = layout
+        self.arrays = SharedArrays.views(self.shm.buf, layout)
+        for key in layout:
+            self.arrays[key][...] = arrays[key]
+
+    @staticmethod
+    def views(buf, layout):
+        '''Numpy views of the arrays in buf.'''
+        res = {}
+        for key in layout:
+            offset, shape, dtype = layout[key]
+            res[key] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=buf, offset=offset)
+        return res
+
+    def release(self):
+        '''Close and remove the block (workers that are still attached keep their mapping).'''
+        if self.shm is None:
+            return
+        self.arrays = None
+        _close(self.shm)
+        try:
+            self.shm.unlink()
+        except Exception:
+            pass
+        self.shm = None
+
+    def __del__(self):
+        self.release()
+
+
+
+#----------------------------------------------------------------------
+# parent side
+#----------------------------------------------------------------------
+_pools = {}                                  # number of workers -> pool
+_shared = weakref.WeakKeyDictionary()        # model -> (key, SharedArrays, meta)
+_lock = threading.RLock()                    # guards _pools, _shared and the use counts
+
+
+def numJobs(n_jobs):
+    '''Number of worker processes for n_jobs (-1 for all cores).'''
+    if n_jobs == -1:
+        return multiprocessing.cpu_count()
+    if not isinstance(n_jobs, (int, np.integer)) or n_jobs < 1:
+        raise Exception('n_jobs must be a positive integer or -1 (all cores), got %r' % (n_jobs,))
+    return int(n_jobs)
+
+
+def getPool(n_jobs):
+    '''Pool of n_jobs worker processes, created once and reused across calls.'''
+    with _lock:
+        pool = _pools.get(n_jobs)
+        if pool is None:
+            pool = multiprocessing.Pool(n_jobs)
+            _pools[n_jobs] = pool
+        return pool
+
+
+def closePools():
+    '''Terminate all worker pools.'''
+    with _lock:
+        for n_jobs in list(_pools):
+            _pools.pop(n_jobs).terminate()
+
+atexit.register(closePools)
+
+
+def release(model):
+    '''Release the shared posterior of model (called when model.posterior changes).'''
+    with _lock:
+        entry = _shared.pop(model, None)
+        if not entry is None:
+            shared = entry[1]
+            shared.stale = True
+            if shared.users == 0:              # otherwise removed by the last call using it
+                shared.release()
+
+
+def _sharedKey(model, setup):
+    '''
+    Objects the shared block of model is built from (compared by identity) and
+    the hyperparameters and fixed parameters of its functions (compared by value).
+    '''
+    alpha, L, sW, Ltril = setup
+    funcs = (model.meanfunc, model.covfunc, model.likfunc)
+    objects = (alpha, L, sW, model.x) + funcs
+    values = [list(f.hyp) for f in funcs] + [inf._covPara(model.covfunc)]
+    return objects, values
+
+
+def _acquireShared(model, setup):
+    '''Shared memory block holding x, the prediction operator and the functions of model.'''
+    alpha, L, sW, Ltril = setup
+    objects, values = _sharedKey(model, setup)
+    with _lock:
+        entry = _shared.get(model)
+        if not entry is None:
+            key, shared, meta = entry
+            if all(a is b for a, b in zip(key[0], objects)) and key[1] == values:
+                shared.users += 1
+                return shared, meta
+            release(model)
+        funcs = pickle.dumps((model.meanfunc, model.covfunc, model.likfunc), protocol=pickle.HIGHEST_PROTOCOL)
+        arrays = {'x': model.x, 'alpha': alpha, 'L': L, 'sW': sW,
+                  'funcs': np.frombuffer(funcs, dtype=np.uint8)}
+        shared = SharedArrays(arrays)
+        shared.users = 1
+        shared.stale = False
+        meta = (shared.name, shared.layout, Ltril)
+        _shared[model] = ((objects, values), shared, meta)
+        return shared, meta
+
+
+def _releaseShared(shared):
+    '''End of a call using shared; remove the block if it was replaced meanwhile.'''
+    with _lock:
+        shared.users -= 1
+        if shared.stale and shared.users == 0:
+            shared.release()
+
+
+def predictBatches(model, setup, xs, ys, outputs, batchSize, n_jobs):
+    '''
+    Requested outputs of predict (list of ym, ys2, fm, fs2, lp; None if not
+    requested) computed by n_jobs worker processes in chunks of at most
+    batchSize test points.
+    '''
+    n_jobs = numJobs(n_jobs)
+    shared, meta = _acquireShared(model, setup)
+    try:
+        ns = xs.shape[0]
+        call = SharedArrays({'xs': np.asarray(xs, dtype=float), 'ys': ys, 'out': np.zeros((ns,len(_outputNames)))})
+        try:
+            nb = max(1, min(batchSize, -(-ns // (4*n_jobs))))     # several chunks per worker for load balancing
+            tasks = [(meta, call.name, call.layout, a, min(a+nb, ns), tuple(outputs)) for a in range(0, ns, nb)]
+            getPool(n_jobs).map(_predictChunk, tasks, chunksize=1)
+            out = call.arrays['out']
+            res = [out[:,[k]].copy() if name in outputs else None for k, name in enumerate(_outputNames)]
+            del out
+        finally:
+            call.release()
+    finally:
+        _releaseShared(shared)
+    return res
+
+
+
+def localBatches(model, xs, ys, idx, outputs, batchSize, n_jobs):
+    '''
+    Requested outputs of predict_local for test points xs with neighbourhoods
+    idx (nn by k), computed by n_jobs worker processes in chunks of at most
+    batchSize test points. The training data are shared for the call.
+    '''
+    n_jobs = numJobs(n_jobs)
+    funcs = pickle.dumps((model.meanfunc, model.covfunc, model.likfunc), protocol=pickle.HIGHEST_PROTOCOL)
+    ns = xs.shape[0]
+    call = SharedArrays({'x': model.x, 'y': model.y, 'xs': np.asarray(xs, dtype=float), 'ys': ys, 'idx': idx,
+                         'funcs': np.frombuffer(funcs, dtype=np.uint8), 'out': np.zeros((ns,len(_outputNames)))})
+    try:
+        tasks = [(call.name, call.layout, a, min(a+batchSize, ns), tuple(outputs)) for a in range(0, ns, batchSize)]
+        getPool(n_jobs).map(_localChunk, tasks, chunksize=1)
+        out = call.arrays['out']
+        res = [out[:,[k]].copy() if name in outputs else None for k, name in enumerate(_outputNames)]
+        del out
+    finally:
+        call.release()
+    return res
+
+
+
+#----------------------------------------------------------------------
+# worker side
+#----------------------------------------------------------------------
+_worker = {'name': None}                     # currently attached posterior
+
+
+def _workerModel(meta):
+    '''Model and prediction operator of the shared posterior, attached once per posterior.'''
+    name, layout, Ltril = meta
+    if _worker['name'] != name:
+        if not _worker['name'] is None:             # detach from the previous posterior
+            shm = _worker['shm']
+            _worker.update({'name': None, 'shm': None, 'model': None, 'setup': None})
+            _close(shm)
+        from .gp import GP
+        shm = _attach(name)
+        arrays = SharedArrays.views(shm.buf, layout)
+        model = GP()
+        model.meanfunc, model.covfunc, model.likfunc = pickle.loads(arrays['funcs'].tobytes())
+        model.x = arrays['x']
+        setup = (arrays['alpha'], arrays.get('L'), arrays.get('sW'), Ltril)
+        _worker.update({'name': name, 'shm': shm, 'model': model, 'setup': setup})
+    return _worker['model'], _worker['setup']
+
+
+def _predictChunk(task):
+    '''Predict test points a:b of the call buffer and write them into its output buffer.'''
+    meta, name, layout, a, b, outputs = task
+    model, setup = _workerModel(meta)
+    shm = _attach(name)
+    try:
+        arrays = SharedArrays.views(shm.buf, layout)
+        ys = arrays['ys'][a:b] if 'ys' in arrays else None
+        part = model._predictBatch(setup, arrays['xs'][a:b], ys, outputs)
+        out = arrays['out']
+        for k in range(len(_outputNames)):
+            if not part[k] is None:
+                out[a:b,k] = part[k][:,0]
+        del arrays, out, ys
+    finally:
+        _close(shm)
+
+
+
+def _localChunk(task):
+    '''Local prediction of test points a:b of the call buffer (see localBatches).'''
+    name, layout, a, b, outputs = task
+    from .gp import GP
+    shm = _attach(name)
+    try:
+        arrays = SharedArrays.views(shm.buf, layout)
+        model = GP()
+        model.meanfunc, model.covfunc, model.likfunc = pickle.loads(arrays['funcs'].tobytes())
+        model.x, model.y = arrays['x'], arrays['y']
+        ys = arrays['ys'][a:b] if 'ys' in arrays else None
+        part = model._localBatch(arrays['xs'][a:b], ys, arrays['idx'][a:b], outputs)
+        out = arrays['out']
+        for k in range(len(_outputNames)):
+            if not part[k] is None:
+                out[a:b,k] = part[k][:,0]
+        del arrays, out, ys, model
+    finally:
+        _close(shm)
@@ -0,0 +1,417 @@
+from __future__ import division
+from __future__ import absolute_import
+from __future__ import print_function
+#================================================================================
+#    Marion Neumann [marion dot neumann at uni-bonn dot de]
+#    Daniel Marthaler [dan dot marthaler at gmail dot com]
+#    Shan Huang [shan dot huang at iais dot fraunhofer dot de]
+#    Kristian Kersting [kristian dot kersting at cs dot tu-dortmund dot de]
+#
+#    This file is part of pyGPs.
+#    The software package is released under the BSD 2-Clause (FreeBSD) License.
+#
+#    Copyright (c) by
+#    Marion Neumann, Daniel Marthaler, Shan Huang & Kristian Kersting, 18/02/2014
+#================================================================================
+
+# Local prediction service with request micro-batching (standard library only).
+#
+# A PredictionServer serves fitted models (model objects or files written by
+# model.save) over a minimal HTTP/1.1 interface with keep-alive connections:
+#
+#   POST /predict/<name>   body {"x": [[...], ...], "outputs": ["ym", "ys2"]}
+#                          answer {"ym": [...], "ys2": [...]}
+#   GET  /stats            latency and throughput counters (see PredictionServer.stats)
+#   GET  /models           names of the served models
+#
+# Concurrent requests for the same model are coalesced into micro-batches of
+# at most maxBatch test points, waiting at most maxDelay seconds for further
+# requests after the first one. Each batch is predicted in one call of the
+# batched prediction path (GP.predict_result, safe for concurrent callers) on
+# a pool of numThreads threads that share the model.
+#
+# loadgen() is a load generator for benchmarks on localhost, see also
+# Demo/Regression/demo_GPR_serve.py. From the command line:
+#
+#   python -m pyGPs.Core.serve model.gp [name=model2.gp ...] --port 8000
+#
+# (models given without a name are served under their file name without extension)
+
+import asyncio
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from . import gp
+
+
+_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+
+class _Batcher(object):
+    '''Micro-batching queue of one model.'''
+    def __init__(self, server, name, model):
+        self.server = server
+        self.name   = name
+        self.model  = model
+        self.queue  = asyncio.Queue()
+        self.slots  = asyncio.Semaphore(server.numThreads)
+        self.task   = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        maxBatch = self.server.maxBatch
+        while True:
+            items = [await self.queue.get()]
+            n = items[0][0].shape[0]
+            deadline = loop.time() + self.server.maxDelay
+            while n < maxBatch:
+                if self.queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    item = self.queue.get_nowait()
+                items.append(item)
+                n += item[0].shape[0]
+            await self.slots.acquire()           # at most numThreads batches in flight
+            asyncio.ensure_future(self.predict(items))
+
+    async def predict(self, items):
+        loop = asyncio.get_event_loop()
+        try:
+            try:                                 # every failure is passed to the waiting requests
+                outputs = set()
+                for xs, requested, future in items:
+                    outputs.update(requested)
+                outputs = tuple(name for name in gp.GP._predictNames if name in outputs)
+                xs = np.vstack([item[0] for item in items])
+                res = await loop.run_in_executor(self.server.executor, _predict, self.model, xs, outputs)
+                answers = []
+                a = 0
+                for item in items:
+                    b = a + item[0].shape[0]
+                    answers.append(dict((name, res[name][a:b,0].tolist()) for name in item[1]))
+                    a = b
+            except Exception as e:
+                for item in items:
+                    if not item[2].done():
+                        item[2].set_exception(e)
+                return
+            self.server._countBatch(xs.shape[0])
+            for item, answer in zip(items, answers):
+                if not item[2].done():
+                    item[2].set_result(answer)
+        finally:
+            self.slots.release()
+
+
+
+def _predict(model, xs, outputs):
+    '''Requested outputs for xs as a dictionary (called on the thread pool).'''
+    res = model.predict_result(xs, outputs=outputs)
+    return dict((name, getattr(res, name)) for name in outputs)
+
+
+
+class PredictionServer(object):
+    '''
+    Local HTTP prediction server with micro-batching.
+
+    :param models: dictionary name -> model or file written by model.save (loaded with pyGPs.load)
+    :param int maxBatch: maximal number of test points of a micro-batch
+    :param float maxDelay: maximal time in seconds to wait for further requests of a micro-batch
+    :param int numThreads: number of threads for prediction (batches in flight per model)
+    :param outputs: default outputs of a request
+    :param bool mmap: memory-map models loaded from files
+    '''
+    def __init__(self, models, maxBatch=256, maxDelay=0.002, numThreads=1, outputs=('ym', 'ys2'), mmap=True):
+        self.models = {}
+        for name, model in models.items():
+            if not isinstance(model, gp.GP):
+                model = gp.load(model, mmap=mmap)
+            if model.posterior is None:            # fitted once, before concurrent predictions
+                model.getPosterior()
+            self.models[name] = model
+        self.maxBatch   = maxBatch
+        self.maxDelay   = maxDelay
+        self.numThreads = numThreads
+        self.outputs    = tuple(outputs)
+        self.executor   = ThreadPoolExecutor(numThreads)
+        self.batchers   = {}
+        self.server     = None
+        self.loop       = None
+        self.thread     = None
+        self.resetStats()
+
+    def resetStats(self):
+        '''Reset the counters of stats().'''
+        self.started   = time.time()
+        self.requests  = 0
+        self.points    = 0
+        self.batches   = 0
+        self.batchPoints = 0
+        self.errors    = 0
+        self.latencies = collections.deque(maxlen=10000)    # seconds, last requests
+
+    def _countBatch(self, n):
+        self.batches += 1
+        self.batchPoints += n
+
+    def stats(self):
+        '''
+        Counters since start (or resetStats): number of requests, test points,
+        micro-batches and errors, throughput and latency (in ms, over the
+        last 10000 requests).
+        '''
+        elapsed = max(time.time() - self.started, 1e-9)
+        lat = np.array(self.latencies) * 1000.
+        res = {'requests': self.requests, 'points': self.points, 'batches': self.batches, 'errors': self.errors,
+               'mean_batch_points': self.batchPoints / float(max(self.batches, 1)),
+               'requests_per_s': self.requests / elapsed, 'points_per_s': self.points / elapsed,
+               'uptime_s': elapsed}
+        if lat.size > 0:
+            res['latency_ms'] = {'mean': float(lat.mean()), 'p50': float(np.percentile(lat, 50)),
+                                 'p90': float(np.percentile(lat, 90)), 'p99': float(np.percentile(lat, 99)),
+                                 'max': float(lat.max())}
+        return res
+
+    async def predict(self, name, xs, outputs=None):
+        '''Predict the requested outputs for xs with model name through the micro-batching queue.'''
+        if not name in self.models:
+            raise KeyError(name)
+        if outputs is None:
+            outputs = self.outputs
+        for o in outputs:
+            if not o in gp.GP._predictNames[:4]:              # requests carry no test targets for lp
+                raise ValueError('Possible outputs are "ym", "ys2", "fm", "fs2".')
+        xs = np.asarray(xs, dtype=float)
+        if xs.ndim == 1:
+            xs = np.reshape(xs, (1, xs.shape[0]))
+        D = self.models[name].x.shape[1]
+        if xs.ndim != 2 or xs.shape[1] != D:
+            raise ValueError('x must be a list of test points with %d input dimensions' % D)
+        if not name in self.batchers:
+            self.batchers[name] = _Batcher(self, name, self.models[name])
+        start = time.time()
+        future = asyncio.get_event_loop().create_future()
+        await self.batchers[name].queue.put((xs, tuple(outputs), future))
+        res = await future
+        self.requests += 1
+        self.points += xs.shape[0]
+        self.latencies.append(time.time() - start)
+        return res
+
+    async def _handle(self, method, target, body):
+        '''Status and JSON answer of one HTTP request.'''
+        path = target.split('?')[0].strip('/').split('/')
+        if method == 'GET' and path == ['stats']:
+            return 200, self.stats()
+        if method == 'GET' and path == ['models']:
+            return 200, sorted(self.models)
+        if path[0] != 'predict' or len(path) > 2:
+            return 404, {'error': 'unknown path ' + target}
+        if method != 'POST':
+            return 405, {'error': 'use POST for predictions'}
+        if len(path) == 1:
+            if len(self.models) != 1:
+                return 404, {'error': 'name the model: /predict/<name>'}
+            name = list(self.models)[0]
+        else:
+            name = path[1]
+        if not name in self.models:
+            return 404, {'error': 'unknown model ' + name}
+        try:
+            request = json.loads(body.decode('utf-8'))
+            res = await self.predict(name, request['x'], request.get('outputs'))
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {'error': 'bad request: %s' % e}
+        return 200, res
+
+    async def _connection(self, reader, writer):
+        '''Serve the requests of one (keep-alive) connection.'''
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b'\r\n', b'\n', b''):
+                        break
+                    key, sep, value = h.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = b''
+                length = int(headers.get('content-length', 0))
+                if length > 0:
+                    body = await reader.readexactly(length)
+                try:
+                    status, res = await self._handle(method, target, body)
+                except Exception as e:
+                    status, res = 500, {'error': str(e)}
+                if status != 200:
+                    self.errors += 1
+                data = json.dumps(res).encode('utf-8')
+                writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                              % (status, _reasons[status], len(data))).encode('latin-1') + data)
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8000):
+        '''Start listening (in the running event loop); returns the bound (host, port).'''
+        self.server = await asyncio.start_server(self._connection, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def stop(self):
+        '''Stop listening and cancel the batching queues.'''
+        if not self.server is None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        for batcher in self.batchers.values():
+            batcher.task.cancel()
+        self.batchers = {}
+
+    def serveForever(self, host='127.0.0.1', port=8000):
+        '''Run the server in the current thread until interrupted.'''
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        address = loop.run_until_complete(self.start(host, port))
+        print('serving %s on http://%s:%d' % (', '.join(sorted(self.models)), address[0], address[1]))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.stop())
+            loop.close()
+            self.executor.shutdown()
+
+    def startBackground(self, host='127.0.0.1', port=0):
+        '''Run the server in a background thread (port 0: any free port); returns (host, port).'''
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+        address = []
+        def run():
+            asyncio.set_event_loop(self.loop)
+            address.extend(self.loop.run_until_complete(self.start(host, port)))
+            started.set()
+            self.loop.run_forever()
+        self.thread = threading.Thread(target=run)
+        self.thread.daemon = True
+        self.thread.start()
+        started.wait()
+        return tuple(address)
+
+    def stopBackground(self):
+        '''Stop a server started by startBackground.'''
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+        self.executor.shutdown()
+
+
+
+def serve(models, host='127.0.0.1', port=8000, **kwargs):
+    '''
+    Serve models (dictionary name -> model or file written by model.save)
+    until interrupted. Further keyword arguments are passed to PredictionServer.
+    '''
+    PredictionServer(models, **kwargs).serveForever(host, port)
+
+
+
+#----------------------------------------------------------------------
+# load generator
+#----------------------------------------------------------------------
+async def _client(host, port, path, bodies, latencies, results):
+    '''Send the requests bodies over one keep-alive connection.'''
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for i, body in bodies:
+            start = time.time()
+            writer.write(('POST %s HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                          % (path, host, len(body))).encode('latin-1') + body)
+            await writer.drain()
+            status = (await reader.readline()).decode('latin-1').split()[1]
+            length = 0
+            while True:
+                h = await reader.readline()
+                if h in (b'\r\n', b'\n', b''):
+                    break
+                key, sep, value = h.decode('latin-1').partition(':')
+                if key.strip().lower() == 'content-length':
+                    length = int(value)
+            data = await reader.readexactly(length)
+            latencies.append(time.time() - start)
+            if status != '200':
+                raise Exception('request failed: ' + data.decode('utf-8'))
+            results[i] = json.loads(data.decode('utf-8'))
+    finally:
+        writer.close()
+
+
+async def loadgen(host, port, name, xs, concurrency=16, pointsPerRequest=1, outputs=('ym',)):
+    '''
+    Load generator: sends the test points xs in requests of pointsPerRequest
+    points over concurrency keep-alive connections to /predict/<name>.
+
+    :return: dictionary with throughput, latency (ms) and the results in request order
+    '''
+    xs = np.asarray(xs, dtype=float)
+    chunks = [xs[a:a+pointsPerRequest] for a in range(0, xs.shape[0], pointsPerRequest)]
+    bodies = [(i, json.dumps({'x': c.tolist(), 'outputs': list(outputs)}).encode('utf-8')) for i, c in enumerate(chunks)]
+    latencies = []
+    results = [None] * len(bodies)
+    start = time.time()
+    await asyncio.gather(*[_client(host, port, '/predict/' + name, bodies[k::concurrency], latencies, results)
+                           for k in range(concurrency)])
+    elapsed = time.time() - start
+    lat = np.array(latencies) * 1000.
+    return {'requests': len(bodies), 'points': xs.shape[0], 'seconds': elapsed,
+            'requests_per_s': len(bodies) / elapsed, 'points_per_s': xs.shape[0] / elapsed,
+            'latency_ms': {'mean': float(lat.mean()), 'p50': float(np.percentile(lat, 50)),
+                           'p99': float(np.percentile(lat, 99)), 'max': float(lat.max())},
+            'results': results}
+
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    port = 8000
+    if '--port' in args:
+        i = args.index('--port')
+        port = int(args[i+1])
+        del args[i:i+2]
+    if not args:
+        print('usage: python -m pyGPs.Core.serve model.gp [name=model2.gp ...] [--port 8000]')
+        sys.exit(1)
+    models = {}
+    for a in args:
+        name, sep, path = a.rpartition('=')
+        models[name or os.path.splitext(os.path.basename(path))[0]] = path
+    serve(models, port=port)
@@ -27,6 +27,7 @@ import matplotlib.pyplot as plt
 import sys
 from math import sqrt
 import scipy.linalg.lapack as lapack
+from scipy.linalg import solve_triangular
 
 def jitchol(A,maxtries=5):
     ''' Copyright (c) 2012, GPy authors (James Hensman, Nicolo Fusi, Ricardo Andrade,
@@ -69,7 +70,7 @@ def jitchol(A,maxtries=5):
         while maxtries > 0 and np.isfinite(jitter):
             print('Warning: adding jitter of {:.10e} to diagnol of kernel matrix for numerical stability'.format(jitter))
             try:
-                return np.linalg.cholesky(A + np.eye(A.shape[0]).T * jitter, lower=True)
+                return np.linalg.cholesky(A + np.eye(A.shape[0]).T * jitter)
             except:
                 jitter *= 10
             finally:
@@ -98,6 +99,24 @@ def solve_chol(L, B):
 
 
 
+def solve_chol_tri(R, B):
+    '''
+    Same as solve_chol for an upper triangular Cholesky factor R (R'*R = A),
+    but using two triangular solves, i.e. O(n^2) per column of B instead of
+    two dense solves.
+
+    :param R: upper triangular matrix (cholesky decomposition of A)
+    :param B: matrix have the same first dimension of R
+    :return: X = A \\ B
+    '''
+    try:
+        assert(R.shape[0] == R.shape[1] and R.shape[0] == B.shape[0])
+    except AssertionError:
+        raise Exception('Wrong sizes of matrix arguments in solve_chol_tri');
+    return solve_triangular(R, solve_triangular(R, B, trans='T', check_finite=False), check_finite=False)
+
+
+
 def unique(x):
     '''
     Return a list with unique elements.
@@ -275,20 +294,55 @@ def brentmin(xlow,xupp,Nitmax,tol,f,nout=None,*args):
 
 def cholupdate(R,x,sgn='+'):
     '''
-    Placeholder for a python version of MATLAB's cholupdate.  Now it is O(n^3)
+    Python version of MATLAB's cholupdate: rank-1 update (sgn='+') or downdate
+    (sgn='-') of an upper triangular Cholesky factor, i.e. R1'*R1 = R'*R +/- x*x'.
+    For sgn='+', x may also be an n by k matrix, giving the rank-k update
+    R1'*R1 = R'*R + x*x'. The update triangularises [R; x'] by blocked QR,
+    the downdate is one sweep of hyperbolic rotations. Effort is O(n^2) for
+    fixed k, R is not modified. If the downdated matrix is not (numerically)
+    positive definite, it is formed explicitly and factorised by jitchol, which
+    adds jitter to the diagonal (O(n^3), as the former implementation).
+
+    :param R: upper triangular Cholesky factor of A (R'*R = A)
+    :param x: vector of length n (or n by k matrix for sgn='+')
+    :param str sgn: '+' for update, '-' for downdate
+    :return: upper triangular Cholesky factor R1 of A +/- x*x'
     '''
-    if len(x.shape) == 1:
-        # Reshape x so that the dot product below is correct
-        x = np.reshape(x,(x.shape[0],1))
-    assert(R.shape[0] == x.shape[0])
-    A = np.dot(R.T,R)
-    if sgn == '+':
-        R1 = A + np.dot(x,x.T)
-    elif sgn == '-':
-        R1 = A - np.dot(x,x.T)
-    else:
+    if not sgn in ['+', '-']:
         raise Exception('Sign needs to be + or - in cholupdate')
-    return jitchol(R1).T
+    X = np.array(x, dtype=float)
+    X = np.reshape(X, (X.shape[0],1)) if X.ndim == 1 else X
+    assert(R.shape[0] == X.shape[0])
+    R1 = np.triu(np.asarray(R, dtype=float))
+    n = X.shape[0]
+    if sgn == '+':
+        X = X.T.copy()                                  # k by n, rows are the update vectors
+        k = X.shape[0]
+        nb = 64                                         # block of rows triangularised at once
+        for j in range(0, n, nb):
+            J = slice(j, min(j+nb, n)); b = J.stop - j
+            # QR of the (b+k) by b column block [R1[J,J]; X[:,J]], applied to the trailing columns
+            Q, Rb = np.linalg.qr(np.vstack((R1[J,J], X[:,J])), mode='complete')
+            sgnd = np.sign(np.diag(Rb)); sgnd[sgnd == 0] = 1.
+            Q[:,:b] *= sgnd; Rb[:b] *= sgnd[:,None]        # positive diagonal
+            R1[J,J] = Rb[:b]; X[:,J] = 0.
+            if J.stop < n:
+                T = np.dot(Q.T, np.vstack((R1[J,J.stop:], X[:,J.stop:])))
+                R1[J,J.stop:] = T[:b]; X[:,J.stop:] = T[b:]
+        return R1
+    x = X[:,0].copy()
+    for k in range(n):
+        r2 = R1[k,k]**2 - x[k]**2
+        if r2 <= 0.:                                    # not positive definite: add jitter
+            A = np.dot(R.T,R) - np.dot(X,X.T)
+            return jitchol(A).T
+        r = np.sqrt(r2)
+        c = old_div(r,R1[k,k]); s = old_div(x[k],R1[k,k])
+        R1[k,k] = r
+        if k < n-1:
+            R1[k,k+1:] = old_div(R1[k,k+1:] - s*x[k+1:], c)
+            x[k+1:] = c*x[k+1:] - s*R1[k,k+1:]
+    return R1
 
 
 
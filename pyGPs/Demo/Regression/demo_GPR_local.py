@@ -0,0 +1,58 @@
+from __future__ import print_function
+#================================================================================
+#    Marion Neumann [marion dot neumann at uni-bonn dot de]
+#    Daniel Marthaler [dan dot marthaler at gmail dot com]
+#    Shan Huang [shan dot huang at iais dot fraunhofer dot de]
+#    Kristian Kersting [kristian dot kersting at cs dot tu-dortmund dot de]
+#
+#    This file is part of pyGPs.
+#    The software package is released under the BSD 2-Clause (FreeBSD) License.
+#
+#    Copyright (c) by
+#    Marion Neumann, Daniel Marthaler, Shan Huang & Kristian Kersting, 18/02/2014
+#================================================================================
+
+import pyGPs
+import numpy as np
+import time
+
+# This demo shows local GP prediction for a training set that is too large
+# for a global posterior: model.predict_local(xs, k) predicts every test point
+# with an exact GP on its k nearest training points (found with a KD-tree)
+# using the hyperparameters of the model. The hyperparameters are learned on
+# a subset. The accuracy versus k is reported with model.local_report,
+# first on a smaller problem where the global prediction is available.
+
+if __name__ == '__main__':              # needed for worker processes on spawn platforms
+    print('')
+    print('-------------------GPR LOCAL PREDICTION DEMO--------------------')
+
+    np.random.seed(0)
+    f  = lambda x: np.sin(3*x[:,:1]) * np.cos(2*x[:,1:2])
+    n  = 500000                # training points
+    ns = 10000                 # test points
+    x  = np.random.uniform(-2, 2, size=(n,2))
+    y  = f(x) + 0.1*np.random.randn(n,1)
+    xs = np.random.uniform(-2, 2, size=(ns,2))
+    ys = f(xs)
+
+    model = pyGPs.GPR()
+    model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBFard(D=2))
+    model.optimize(x[:500], y[:500])                # hyperparameters from a subset
+    print('hyperparameters learned on 500 points')
+
+    print('accuracy versus k against the global GP on 2000 points:')
+    model.getPosterior(x[:2000], y[:2000], der=False)
+    for row in model.local_report(xs[:2000], ys[:2000], ks=(8, 16, 32, 64, 128)):
+        print('k = %3d: %.3f s, mse %.2e, max |fm - fm_global| %.1e, max |fs2 - fs2_global| %.1e'
+              % (row['k'], row['time'], row['mse'], row['dfm'], row['dfs2']))
+
+    model.posterior = None
+    model.setData(x, y)
+    print('local prediction with all %d training points:' % n)
+    for k in (16, 32, 64):
+        start = time.time()
+        res = model.predict_local(xs, k)
+        elapsed = time.time() - start
+        print('k = %3d: %.2f s, %.0f points/s, mse %.2e' % (k, elapsed, ns/elapsed, np.mean((res.ym - ys)**2)))
+    print('--------------------END OF DEMO-----------------------')
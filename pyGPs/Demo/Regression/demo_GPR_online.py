@@ -0,0 +1,66 @@
+from __future__ import print_function
+#================================================================================
+#    Marion Neumann [marion dot neumann at uni-bonn dot de]
+#    Daniel Marthaler [dan dot marthaler at gmail dot com]
+#    Shan Huang [shan dot huang at iais dot fraunhofer dot de]
+#    Kristian Kersting [kristian dot kersting at cs dot tu-dortmund dot de]
+#
+#    This file is part of pyGPs.
+#    The software package is released under the BSD 2-Clause (FreeBSD) License.
+#
+#    Copyright (c) by
+#    Marion Neumann, Daniel Marthaler, Shan Huang & Kristian Kersting, 18/02/2014
+#================================================================================
+
+import pyGPs
+import numpy as np
+import time
+
+# This demo shows GP regression on a data stream.
+# model.addData extends the Cholesky factor of a fitted GPR with new points,
+# model.setWindow keeps only the last W points (or those within a time horizon)
+# and evicts old points without refactorising the covariance matrix.
+# The throughput per update is compared with a full refit.
+
+print('')
+print('-------------------GPR ONLINE DEMO--------------------')
+
+#----------------------------------------------------------------------
+# A stream of noisy observations of a slowly drifting function
+#----------------------------------------------------------------------
+np.random.seed(0)
+W      = 1000                # window size
+batch  = 5                   # points per update
+nsteps = 200                 # number of updates
+t = np.arange(W + nsteps*batch, dtype=float)
+x = np.reshape(t/100., (t.shape[0],1))
+y = np.sin(x) + 0.1*np.random.randn(x.shape[0],1)
+
+#----------------------------------------------------------------------
+# Sliding window with incremental updates
+#----------------------------------------------------------------------
+model = pyGPs.GPR()
+model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+model.setWindow(size=W, refresh=100)          # refactorise every 100 updates
+model.addData(x[:W], y[:W], t=t[:W])
+start = time.time()
+for i in range(W, W + nsteps*batch, batch):
+    model.addData(x[i:i+batch], y[i:i+batch], t=t[i:i+batch])
+elapsed = time.time() - start
+print('sliding window: %.2f ms per update, %.1f updates/s' % (1000.*elapsed/nsteps, nsteps/elapsed))
+
+#----------------------------------------------------------------------
+# Full refit of the same window for comparison
+#----------------------------------------------------------------------
+refit = pyGPs.GPR()
+refit.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+nref  = 20
+start = time.time()
+for i in range(W, W + nref*batch, batch):
+    refit.getPosterior(x[i+batch-W:i+batch], y[i+batch-W:i+batch], der=False)
+elapsed = time.time() - start
+print('full refit:     %.2f ms per update, %.1f updates/s' % (1000.*elapsed/nref, nref/elapsed))
+
+refit.getPosterior(model.x, model.y, der=False)
+print('difference in nlZ after %d updates: %.2e' % (nsteps, abs(model.nlZ - refit.nlZ)))
+print('--------------------END OF DEMO-----------------------')
@@ -0,0 +1,57 @@
+from __future__ import print_function
+#================================================================================
+#    Marion Neumann [marion dot neumann at uni-bonn dot de]
+#    Daniel Marthaler [dan dot marthaler at gmail dot com]
+#    Shan Huang [shan dot huang at iais dot fraunhofer dot de]
+#    Kristian Kersting [kristian dot kersting at cs dot tu-dortmund dot de]
+#
+#    This file is part of pyGPs.
+#    The software package is released under the BSD 2-Clause (FreeBSD) License.
+#
+#    Copyright (c) by
+#    Marion Neumann, Daniel Marthaler, Shan Huang & Kristian Kersting, 18/02/2014
+#================================================================================
+
+import pyGPs
+import numpy as np
+import time
+from multiprocessing import cpu_count
+
+# This demo benchmarks parallel prediction: model.predict(xs, n_jobs=k) shares
+# the posterior with k worker processes through shared memory and lets every
+# worker predict chunks of the test points. The throughput is reported for
+# k = 1, 2, 4, ... up to the number of cores, together with the speed-up
+# relative to sequential prediction. The first call for each k starts the
+# pool and copies the posterior, so it is excluded from the timing.
+
+if __name__ == '__main__':              # needed for worker processes on spawn platforms
+    print('')
+    print('-------------------GPR PARALLEL PREDICTION DEMO--------------------')
+
+    np.random.seed(0)
+    n  = 2000                  # training points
+    ns = 50000                 # test points
+    x  = np.random.uniform(-5, 5, size=(n,3))
+    y  = np.sin(x[:,:1]) * np.cos(x[:,1:2]) + 0.1*np.random.randn(n,1)
+    xs = np.random.uniform(-5, 5, size=(ns,3))
+
+    model = pyGPs.GPR()
+    model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBFard(D=3))
+    model.getPosterior(x, y, der=False)
+
+    jobs = [1]
+    while jobs[-1]*2 <= cpu_count():
+        jobs.append(jobs[-1]*2)
+    reference = None
+    for k in jobs:
+        model.predict(xs[:1000], n_jobs=k)      # warm up pool and shared posterior
+        start = time.time()
+        ym, ys2, fm, fs2, lp = model.predict(xs, n_jobs=k)
+        elapsed = time.time() - start
+        if reference is None:
+            reference = elapsed
+            ym1 = ym
+        print('n_jobs = %2d: %.2f s, %.0f points/s, speed-up %.2f, max difference %.1e'
+              % (k, elapsed, ns/elapsed, reference/elapsed, np.abs(ym - ym1).max()))
+    pyGPs.parallel.closePools()
+    print('--------------------END OF DEMO-----------------------')
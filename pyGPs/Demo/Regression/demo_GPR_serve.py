@@ -0,0 +1,57 @@
+from __future__ import print_function
+#================================================================================
+#    Marion Neumann [marion dot neumann at uni-bonn dot de]
+#    Daniel Marthaler [dan dot marthaler at gmail dot com]
+#    Shan Huang [shan dot huang at iais dot fraunhofer dot de]
+#    Kristian Kersting [kristian dot kersting at cs dot tu-dortmund dot de]
+#
+#    This file is part of pyGPs.
+#    The software package is released under the BSD 2-Clause (FreeBSD) License.
+#
+#    Copyright (c) by
+#    Marion Neumann, Daniel Marthaler, Shan Huang & Kristian Kersting, 18/02/2014
+#================================================================================
+
+import pyGPs
+import numpy as np
+import asyncio
+import os
+import tempfile
+
+# This demo is a load generator for the local prediction service pyGPs.serve.
+# A fitted model is saved, served on localhost from a background thread and
+# queried with one-point requests over many concurrent connections.
+# The server coalesces concurrent requests into micro-batches; the throughput
+# and latency are reported for several batching settings, where maxBatch=1
+# corresponds to predicting every request on its own.
+
+print('')
+print('-------------------GPR SERVE DEMO--------------------')
+
+np.random.seed(0)
+n  = 2000                  # training points
+x  = np.random.uniform(-5, 5, size=(n,2))
+y  = np.sin(x[:,:1]) * np.cos(x[:,1:2]) + 0.1*np.random.randn(n,1)
+xs = np.random.uniform(-5, 5, size=(5000,2))
+
+model = pyGPs.GPR()
+model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBFard(D=2))
+model.getPosterior(x, y, der=False)
+path = os.path.join(tempfile.mkdtemp(), 'demo_model.gp')
+model.save(path)
+
+concurrency = 64
+for maxBatch, maxDelay in [(1, 0.), (64, 0.002), (256, 0.005)]:
+    server = pyGPs.serve.PredictionServer({'demo': path}, maxBatch=maxBatch, maxDelay=maxDelay)
+    host, port = server.startBackground()
+    res = asyncio.run(pyGPs.serve.loadgen(host, port, 'demo', xs, concurrency=concurrency, outputs=('ym','ys2')))
+    stats = server.stats()
+    server.stopBackground()
+    print('maxBatch %3d, maxDelay %.3f s: %6.0f requests/s, latency p50 %5.1f ms, p99 %6.1f ms, %.1f points per batch'
+          % (maxBatch, maxDelay, res['requests_per_s'], res['latency_ms']['p50'], res['latency_ms']['p99'],
+             stats['mean_batch_points']))
+
+ym = np.array([r['ym'][0] for r in res['results']])
+print('max difference to model.predict: %.1e' % np.abs(ym - model.predict_mean(xs)[:,0]).max())
+os.remove(path)
+print('--------------------END OF DEMO-----------------------')
@@ -15,15 +15,26 @@ from builtins import object
 
 import numpy as np
 
+try:
+    from scipy.stats import qmc     # scipy >= 1.7, needed for the 'sobol' and 'lhs' designs
+except ImportError:
+    qmc = None
+
 class random_init_conf(object):
     def __init__(self, mean, cov, lik):
         self.num_restarts = None
         self.min_threshold = None
+        self.n_jobs = 1               # number of worker processes for the restarts (-1: all cores)
+        self.seed = None              # seed of the random initial guesses (None: drawn from np.random)
+        self.design = 'random'        # initial guesses: 'random', 'sobol' or 'lhs' (see initialGuesses)
+        self.halving = None           # reduction factor (e.g. 3) of successive halving, None: full restarts
         self.mean = mean
         self.cov = cov
         self.lik = lik
         self._meanRange = [(-5,5) for i in mean.hyp]
         self._covRange  = [(-5,5) for i in cov.hyp]        
+        if getattr(cov, 'optimizeInducing', False):   # restarts keep the initial inducing points
+            self._covRange = [(-5,5) for i in cov.covfunc.hyp] + [(v,v) for v in cov.hyp[len(cov.covfunc.hyp):]]
         self._likRange  = [(-5,5) for i in lik.hyp]
 
     def _getmr(self):
@@ -54,11 +65,44 @@ class random_init_conf(object):
     likRange = property(_getlr,_setlr)
 
 
+    def initialGuesses(self, seed):
+        '''
+        Generator of the initial guesses of restarts 1, 2, ... (restart 0 starts
+        at the current hyperparameters) in the ranges meanRange + covRange + likRange,
+        as flattened numpy arrays. By design:
 
+        | 'random': independent uniform draws, restart r seeded with (seed, r)
+        | 'sobol':  scrambled Sobol' sequence (in blocks of a power of two points)
+        | 'lhs':    Latin hypercube of num_restarts-1 points
 
-
-
-
-
-
-
+        The space-filling designs cover the ranges more evenly than random draws
+        for the same number of restarts.
+        '''
+        searchRange = np.array(self.meanRange + self.covRange + self.likRange, dtype=float).reshape(-1,2)
+        low = searchRange[:,0]
+        width = searchRange[:,1] - low
+        D = searchRange.shape[0]
+        if self.design == 'random':
+            r = 1
+            while True:
+                rng = np.random.default_rng((seed, r))
+                yield rng.uniform(low=low, high=low+width)
+                r += 1
+        if not self.design in ('sobol', 'lhs'):
+            raise Exception('Unknown design %s of initial guesses (use random, sobol or lhs)' % str(self.design))
+        if qmc is None:
+            raise Exception('The %s design needs scipy.stats.qmc (scipy >= 1.7).' % self.design)
+        if self.design == 'lhs':
+            if not self.num_restarts:
+                raise Exception('The lhs design needs num_restarts')
+            for u in qmc.LatinHypercube(D, seed=seed).random(max(self.num_restarts-1, 1)):
+                yield low + u*width
+            return
+        sobol = qmc.Sobol(D, seed=seed)
+        m = int(np.ceil(np.log2(max(self.num_restarts-1, 1)))) if self.num_restarts else 6
+        n = 0
+        while True:                                 # keep the number of points a power of two
+            for u in sobol.random_base2(m):
+                yield low + u*width
+            n += 2**m
+            m = int(np.log2(n))
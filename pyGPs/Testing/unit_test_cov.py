@@ -80,6 +80,19 @@ class CovarianceTests(unittest.TestCase):
             self.checkDerOutput(kd1, kd2, kd3)
 
 
+    def checkDerivativeFD(self, k, e=1e-6):
+        hyp = list(k.hyp)
+        for der in range(len(hyp)):                          # central differences of the covariance
+            for mode, inputs in [('train', dict(x=self.x)), ('cross', dict(x=self.x, z=self.z)), ('self_test', dict(z=self.z))]:
+                kd = k.getDerMatrix(mode=mode, der=der, **inputs)
+                k.hyp = hyp[:der] + [hyp[der]+e] + hyp[der+1:]
+                kp = k.getCovMatrix(mode=mode, **inputs)
+                k.hyp = hyp[:der] + [hyp[der]-e] + hyp[der+1:]
+                km = k.getCovMatrix(mode=mode, **inputs)
+                k.hyp = hyp
+                self.assertTrue(np.allclose(kd, (kp-km)/(2*e), atol=1e-6))
+
+
     def test_covSM(self):
         print("testing covSM...")
         k = pyGPs.cov.SM(Q=10,D=self.x.shape[1])
@@ -131,21 +144,25 @@ class CovarianceTests(unittest.TestCase):
         print("...d = 1...")
         k = pyGPs.cov.Matern(d=1)
         self.checkCovariance(k)
+        self.checkDerivativeFD(k)
 
         print("testing covMatern...")
         print("...d = 3...")
         k = pyGPs.cov.Matern(d=3)
         self.checkCovariance(k)
+        self.checkDerivativeFD(k)
 
         print("testing covMatern...")
         print("...d = 5...")
         k = pyGPs.cov.Matern(d=5)
         self.checkCovariance(k)
+        self.checkDerivativeFD(k)
 
         print("testing covMatern...")
         print("...d = 7...")
         k = pyGPs.cov.Matern(d=7)
         self.checkCovariance(k)
+        self.checkDerivativeFD(k)
 
 
     def test_covPeriodic(self):
@@ -222,6 +239,7 @@ class CovarianceTests(unittest.TestCase):
         print("testing (composing kernel) muliply by a scalar...")
         k = pyGPs.cov.RBF()*5
         self.checkCovariance(k)
+        self.checkDerivativeFD(k)
 
 
     def test_covSum(self):
@@ -236,6 +254,22 @@ class CovarianceTests(unittest.TestCase):
         self.checkCovariance(k)
 
 
+    def test_covInputDer(self):
+        print("testing derivatives wrt. inputs...")
+        x = self.x / 20.
+        z = self.z / 20.
+        kernels = [pyGPs.cov.RBF(), pyGPs.cov.RBFard(D=2), pyGPs.cov.Matern(d=5), pyGPs.cov.RQ(),
+                   pyGPs.cov.RQard(D=2), pyGPs.cov.Const(), pyGPs.cov.Linear(), pyGPs.cov.LINard(D=2),
+                   pyGPs.cov.Poly(d=3), pyGPs.cov.RBF() * pyGPs.cov.Linear() + pyGPs.cov.Poly() * 2.]
+        for k in kernels + [pyGPs.cov.Periodic()]:
+            if isinstance(k, pyGPs.cov.Periodic):
+                x, z = x[:,:1], z[:,:1]
+            for dim in range(x.shape[1]):
+                e = np.zeros((1,x.shape[1])); e[0,dim] = 1e-6
+                fd = (k.getCovMatrix(x=x+e, z=z, mode='cross') - k.getCovMatrix(x=x-e, z=z, mode='cross')) / 2e-6
+                self.assertTrue(np.allclose(k.getInputDerMatrix(x=x, z=z, dim=dim), fd, atol=1e-6))
+
+
     def test_covFITC(self):
         print("testing FITC kernel to be used with sparse GP...")
         n,D  = self.x.shape
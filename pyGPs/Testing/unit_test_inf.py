@@ -12,6 +12,7 @@ from __future__ import print_function
 #    Marion Neumann, Daniel Marthaler, Shan Huang & Kristian Kersting, 18/02/2014
 #================================================================================
 
+import copy
 import unittest
 import numpy as np
 import pyGPs
@@ -66,6 +67,61 @@ class InfTests(unittest.TestCase):
         self.checkInferenceOutput(post, nlZ, dnlZ)
 
 
+    def test_infExact_meanOnlyChange(self):
+        print("testing exact inference reusing K and L when only mean hyperparameters change...")
+        inffunc = pyGPs.inf.Exact()
+        meanfunc = pyGPs.mean.Linear(D=2)
+        covfunc = pyGPs.cov.RBF()
+        likfunc = pyGPs.lik.Gauss()
+        inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
+        L = inffunc._L
+        meanfunc.hyp = [0.5, -0.5]
+        post, nlZ, dnlZ = inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
+        self.assertTrue(inffunc._L is L)
+        L0 = L.copy()
+        post.L[:] = 0.                                   # the posterior does not share the cached factor
+        self.assertTrue(np.allclose(inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y).L, L0))
+        post_ex, nlZ_ex, dnlZ_ex = pyGPs.inf.Exact().evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
+        self.assertTrue(np.abs(nlZ - nlZ_ex) < 1e-10)
+        self.assertTrue(np.allclose(dnlZ.mean + dnlZ.cov + dnlZ.lik, dnlZ_ex.mean + dnlZ_ex.cov + dnlZ_ex.lik))
+        # a change of the fixed kernel parameters (para) must refactorise
+        covfunc = pyGPs.cov.Matern(d=3)
+        inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=2)
+        covfunc.para = [5]
+        post, nlZ = inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=2)
+        post_ex, nlZ_ex = pyGPs.inf.Exact().evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=2)
+        self.assertTrue(np.abs(nlZ - nlZ_ex) < 1e-10)
+
+
+    def test_infExactEig(self):
+        print("testing exact inference with cached eigendecomposition...")
+        inffunc = pyGPs.inf.ExactEig()
+        meanfunc = pyGPs.mean.Zero()
+        covfunc = pyGPs.cov.RBF()
+        likfunc = pyGPs.lik.Gauss()
+        post, nlZ, dnlZ = inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
+        self.checkInferenceOutput(post, nlZ, dnlZ)
+        # change noise and signal scale only: reuses the cached decomposition
+        likfunc.hyp = [np.log(0.3)]
+        covfunc.hyp = [covfunc.hyp[0], np.log(2.)]
+        post, nlZ, dnlZ = inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
+        post_ex, nlZ_ex, dnlZ_ex = pyGPs.inf.Exact().evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
+        self.assertTrue(np.abs(nlZ - nlZ_ex) < 1e-8)
+        self.assertTrue(np.allclose(dnlZ.cov + dnlZ.lik, dnlZ_ex.cov + dnlZ_ex.lik))
+        self.assertTrue(np.allclose(post.alpha, post_ex.alpha))
+        # another kernel with the same shape hyperparameters: must not reuse the decomposition
+        covfunc = pyGPs.cov.Matern(d=3)
+        covfunc.hyp = [0., np.log(2.)]
+        post, nlZ = inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=2)
+        post_ex, nlZ_ex = pyGPs.inf.Exact().evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=2)
+        self.assertTrue(np.abs(nlZ - nlZ_ex) < 1e-8)
+        # the same kernel with another fixed parameter: must not reuse the decomposition
+        covfunc.para = [7]
+        post, nlZ = inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=2)
+        post_ex, nlZ_ex = pyGPs.inf.Exact().evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=2)
+        self.assertTrue(np.abs(nlZ - nlZ_ex) < 1e-8)
+
+
     def test_infFITC_Exact(self):
         print("testing FITC inference...")
         inffunc = pyGPs.inf.FITC_Exact()
@@ -74,6 +130,77 @@ class InfTests(unittest.TestCase):
         likfunc = pyGPs.lik.Gauss()
         post, nlZ, dnlZ = inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
         self.checkFITCOutput(post, nlZ, dnlZ)
+        # moving the inducing inputs: the old posterior over a = f(u), divided by its prior,
+        # is a pseudo-likelihood exp(-a'*P*a/2 + a'*h) of the values at the new inducing inputs b
+        S, s, Qaa = [np.copy(t) for t in inffunc._getStats()]
+        P = np.linalg.solve(Qaa, np.linalg.solve(Qaa, S).T)
+        h = np.linalg.solve(Qaa, s)
+        ub = np.random.random(size=(4,2))
+        kernel = pyGPs.cov.RBF()
+        Kaa = kernel.getCovMatrix(x=self.u, mode='train')
+        Kab = kernel.getCovMatrix(x=self.u, z=ub, mode='cross')
+        Qbb = kernel.getCovMatrix(x=ub, mode='train') + 1e-6*np.exp(2*likfunc.hyp[0])*np.eye(4)
+        G = np.eye(5) + np.dot(P, Kaa)                        # posterior of b in covariance form
+        Sigma = Qbb - np.dot(Kab.T, np.linalg.solve(G, np.dot(P, Kab)))
+        mu = np.dot(Kab.T, np.linalg.solve(G, h))
+        post, nlZ = inffunc.update(meanfunc, kernel.fitc(ub), likfunc, self.x[:0], self.y[:0], nargout=2)
+        self.assertTrue(nlZ is None)
+        self.assertTrue(np.allclose(post.alpha, np.linalg.solve(Qbb, mu)))
+        self.assertTrue(np.allclose(post.L, np.linalg.solve(Qbb, np.linalg.solve(Qbb, Sigma).T) - np.linalg.inv(Qbb)))
+
+
+    def test_infFITC_inducingDer(self):
+        print("testing FITC derivatives wrt. inducing inputs...")
+        meanfunc = pyGPs.mean.Zero()
+        gauss = pyGPs.lik.Gauss()
+        erf = pyGPs.lik.Erf()
+        ys = np.sign(self.y)                                    # labels for the Erf likelihood
+        for covfunc in [pyGPs.cov.RBF(), pyGPs.cov.RBFard(D=2), pyGPs.cov.Matern(d=5), pyGPs.cov.RQ()]:
+            covfunc = covfunc.fitc(self.u, optimizeInducing=True)
+            hyp = covfunc.hyp
+            self.assertTrue(len(hyp) == len(covfunc.covfunc.hyp) + self.u.size)
+            # the Laplace derivatives have an implicit part (the mode moves with the hyperparameters); the
+            # relative tolerance there reflects the convergence of the Newton iterations, not the gradient
+            for inffunc, likfunc, y, tol in [(pyGPs.inf.FITC_Exact(), gauss, self.y, 1e-4),
+                                             (pyGPs.inf.FITC_EP(), gauss, self.y, 1e-4),
+                                             (pyGPs.inf.FITC_Laplace(), gauss, self.y, 5e-3),
+                                             (pyGPs.inf.FITC_Laplace(), erf, ys, 5e-3)]:
+                post, nlZ, dnlZ = inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, y, nargout=3)
+                self.checkFITCOutput(post, nlZ, dnlZ)
+                for ii in [0, len(hyp)-1, len(hyp)-self.u.size]:   # finite differences for three coordinates
+                    e = 1e-5
+                    covfunc.hyp = hyp[:ii] + [hyp[ii]+e] + hyp[ii+1:]
+                    post, nlZp = type(inffunc)().evaluate(meanfunc, covfunc, likfunc, self.x, y, nargout=2)
+                    covfunc.hyp = hyp[:ii] + [hyp[ii]-e] + hyp[ii+1:]
+                    post, nlZm = type(inffunc)().evaluate(meanfunc, covfunc, likfunc, self.x, y, nargout=2)
+                    covfunc.hyp = hyp
+                    self.assertTrue(abs(dnlZ.cov[ii] - (nlZp-nlZm)/(2*e)) < tol*max(1., abs(dnlZ.cov[ii])))
+
+
+    def test_infPITC_Exact(self):
+        print("testing PITC inference...")
+        meanfunc = pyGPs.mean.Zero()
+        likfunc = pyGPs.lik.Gauss()
+        covfunc = pyGPs.cov.RBF().pitc(self.u, numBlocks=4)
+        post, nlZ, dnlZ = pyGPs.inf.PITC_Exact(numWorkers=2).evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
+        self.checkFITCOutput(post, nlZ, dnlZ)
+        post1, nlZ1, dnlZ1 = pyGPs.inf.PITC_Exact(numWorkers=1).evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
+        self.assertTrue(np.abs(nlZ - nlZ1) < 1e-10)
+        # the k-means partition is seeded, the thread pool is kept and not copied
+        inffunc = pyGPs.inf.PITC_Exact(numWorkers=2)
+        post2, nlZ2 = inffunc.evaluate(meanfunc, pyGPs.cov.RBF().pitc(self.u, numBlocks=4), likfunc, self.x, self.y, nargout=2)
+        self.assertTrue(np.abs(nlZ - nlZ2) < 1e-10)
+        pool = inffunc._pool
+        inffunc.evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=2)
+        self.assertTrue(inffunc._pool is pool)
+        self.assertTrue(copy.deepcopy(inffunc)._pool is None)
+        # blocks of single inputs: PITC is FITC
+        covfunc = pyGPs.cov.RBF().pitc(self.u, blocks=[np.array([i]) for i in range(self.x.shape[0])])
+        post, nlZ, dnlZ = pyGPs.inf.PITC_Exact().evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
+        post_fitc, nlZ_fitc, dnlZ_fitc = pyGPs.inf.FITC_Exact().evaluate(meanfunc, covfunc.covfunc.fitc(self.u), likfunc, self.x, self.y, nargout=3)
+        self.assertTrue(np.abs(nlZ - nlZ_fitc) < 1e-8)
+        self.assertTrue(np.allclose(dnlZ.cov + dnlZ.lik, dnlZ_fitc.cov + dnlZ_fitc.lik))
+        self.assertTrue(np.allclose(post.L, post_fitc.L))
 
 
     def test_infEP(self):
@@ -96,6 +223,18 @@ class InfTests(unittest.TestCase):
         self.checkFITCOutput(post, nlZ, dnlZ)
 
 
+    def test_cholupdate(self):
+        print("testing Cholesky downdate of a (numerically) singular matrix...")
+        from pyGPs.Core.tools import cholupdate
+        R = np.linalg.cholesky(np.array([[1.+1e-12, 1e-5], [1e-5, 1.]])).T
+        x = np.array([1., 0.])
+        R1 = cholupdate(R, x, '-')                  # downdate to an indefinite matrix adds jitter
+        self.assertTrue(np.allclose(np.dot(R1.T,R1), np.dot(R.T,R) - np.outer(x,x), atol=1e-5))
+        x = np.array([0.5, 0.2])
+        R1 = cholupdate(R, x, '-')
+        self.assertTrue(np.allclose(np.dot(R1.T,R1), np.dot(R.T,R) - np.outer(x,x)))
+
+
     def test_infLaplace(self):
         print("testing Laplace inference...")
         inffunc = pyGPs.inf.Laplace()
@@ -106,6 +245,17 @@ class InfTests(unittest.TestCase):
         self.checkInferenceOutput(post, nlZ, dnlZ)
 
 
+    def test_infLaplace_backtrack(self):
+        print("testing Laplace inference with backtracking line search...")
+        meanfunc = pyGPs.mean.Zero()
+        covfunc = pyGPs.cov.RBF()
+        likfunc = pyGPs.lik.Erf()
+        post, nlZ, dnlZ = pyGPs.inf.Laplace(linesearch='backtrack').evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=3)
+        self.checkInferenceOutput(post, nlZ, dnlZ)
+        post_brent, nlZ_brent = pyGPs.inf.Laplace().evaluate(meanfunc, covfunc, likfunc, self.x, self.y, nargout=2)
+        self.assertTrue(np.abs(nlZ - nlZ_brent) < 1e-3)
+
+
     def test_infFITC_Laplace(self):
         print("testing FITC EP inference...")
         inffunc = pyGPs.inf.FITC_Laplace()
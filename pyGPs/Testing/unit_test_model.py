@@ -13,6 +13,7 @@ from builtins import zip
 #    Marion Neumann, Daniel Marthaler, Shan Huang & Kristian Kersting, 18/02/2014
 #================================================================================
 
+import copy
 import unittest
 import numpy as np
 import pyGPs
@@ -68,6 +69,331 @@ class ModelTests(unittest.TestCase):
         self.checkRegressionOutput(model)
 
 
+    def test_GPR_addData(self):
+        print("testing incremental data addition for GP regression...")
+        model = pyGPs.GPR()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.getPosterior(self.xr[:10], self.yr[:10])
+        model.addData(self.xr[10:15], self.yr[10:15])
+        model.addData(self.xr[15:], self.yr[15:], der=True)
+        refit = pyGPs.GPR()
+        refit.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        nlZ, dnlZ, post = refit.getPosterior(self.xr, self.yr)
+        self.assertTrue(np.abs(model.nlZ - nlZ) < 1e-8)
+        self.assertTrue(np.allclose(model.posterior.alpha, post.alpha))
+        self.assertTrue(np.allclose(model.posterior.L, post.L))
+        self.assertTrue(np.allclose(model.dnlZ.cov + model.dnlZ.lik, dnlZ.cov + dnlZ.lik))
+        ym, ys2, fm, fs2, lp = model.predict(self.zr)
+        ym_r, ys2_r, fm_r, fs2_r, lp_r = refit.predict(self.zr)
+        self.assertTrue(np.allclose(ym, ym_r) and np.allclose(ys2, ys2_r))
+
+
+    def test_GPR_predict_iter(self):
+        print("testing batched and streaming prediction for GP regression...")
+        model = pyGPs.GPR()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.getPosterior(self.xr, self.yr)
+        ys = np.sin(self.zr)
+        ym, ys2, fm, fs2, lp = model.predict(self.zr, ys)
+        res = model.predict(self.zr, ys, memory=48*self.xr.shape[0]*7)   # batches of 7 test points
+        for a, b in zip(res, (ym, ys2, fm, fs2, lp)):
+            self.assertTrue(np.allclose(a, b))
+        ym_s, ys2_s, fm_s, fs2_s, lp_s = model.predict(self.zr, outputs=('fm',))
+        self.assertTrue(np.allclose(fm_s, fm) and ym_s is None and fs2_s is None)
+        chunks = [self.zr[i:i+10] for i in range(0, self.zr.shape[0], 10)]
+        ychunks = [ys[i:i+10] for i in range(0, ys.shape[0], 10)]
+        res = list(model.predict_iter(chunks, ychunks, outputs=('ym','lp')))
+        self.assertTrue(np.allclose(np.vstack([r[0] for r in res]), ym))
+        self.assertTrue(np.allclose(np.vstack([r[4] for r in res]), lp))
+        self.assertTrue(res[0][1] is None)
+        self.assertRaises(Exception, model.predict, self.zr, None, ('mean',))
+        self.assertTrue(model.predict(self.zr)[4] is None)                    # no lp without test targets
+        self.assertRaises(Exception, model.predict, self.zr, None, ('ym','lp'))
+        self.assertRaises(Exception, next, model.predict_iter(chunks, outputs=('lp',)))
+
+
+    def test_predict_mean(self):
+        print("testing mean-only prediction...")
+        model = pyGPs.GPR()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.getPosterior(self.xr, self.yr)
+        ym = model.predict(self.zr)[0]
+        self.assertTrue(np.allclose(model.predict_mean(self.zr), ym))
+        model = pyGPs.GPR_FITC()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF(), inducing_points=self.ur)
+        model.getPosterior(self.xr, self.yr)
+        ym = model.predict(self.zr)[0]
+        self.assertTrue(np.allclose(model.predict_mean(self.zr, memory=1000), ym))
+        model = pyGPs.GPC()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.getPosterior(self.xc, self.yc)
+        ym, ys2, fm, fs2, lp = model.predict(self.zc)
+        self.assertTrue(np.allclose(model.predict_mean(self.zc, latent=True), fm))
+        self.assertTrue(np.allclose(model.predict_mean(self.zc), ym))
+
+
+    def test_predict_cache(self):
+        print("testing cached prediction operator...")
+        model = pyGPs.GPR()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.getPosterior(self.xr, self.yr)
+        ym, ys2, fm, fs2, lp = model.predict(self.zr)
+        op = model._predictOp
+        model.predict(self.zr[:1])
+        self.assertTrue(model._predictOp is op)
+        post = model.posterior
+        Ks = model.covfunc.getCovMatrix(x=self.xr, z=self.zr, mode='cross')
+        kss = model.covfunc.getCovMatrix(z=self.zr, mode='self_test')
+        V = np.linalg.solve(post.L.T, post.sW*Ks)
+        self.assertTrue(np.allclose(fs2, kss - (V*V).sum(axis=0)[:,None]))
+        model.addData(self.xr[:2], self.yr[:2])
+        self.assertTrue(model._predictOp is None)
+
+
+    def test_predict_result(self):
+        print("testing side-effect free and concurrent prediction...")
+        from concurrent.futures import ThreadPoolExecutor
+        model = pyGPs.GPR()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.setData(self.xr, self.yr)
+        self.assertRaises(Exception, model.predict_result, self.zr)
+        model.getPosterior()
+        ys = np.sin(self.zr)
+        res = model.predict_result(self.zr, ys)
+        self.assertTrue(model.xs is None and model.ym is None)
+        for a, b in zip(res, model.predict(self.zr, ys)):
+            self.assertTrue(np.allclose(a, b))
+        post, hyp = model.posterior, model.likfunc.hyp
+        model.likfunc.hyp = [np.log(0.5)]
+        model.getPosterior()
+        old = model.predict_result(self.zr, post=post)
+        self.assertTrue(np.allclose(old.fs2, res.fs2) and model.posterior is not post)
+        self.assertFalse(np.allclose(model.predict_result(self.zr).fs2, res.fs2))
+        model.likfunc.hyp, model.posterior = hyp, post
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda k: model.predict_result(self.zr[k::4]), list(range(4))*5))
+        for k, r in enumerate(results):
+            self.assertTrue(np.allclose(r.ym, res.ym[k%4::4]) and np.allclose(r.ys2, res.ys2[k%4::4]))
+
+
+    def test_predict_local(self):
+        print("testing local prediction on nearest neighbours...")
+        model = pyGPs.GPR()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.getPosterior(self.xr, self.yr)
+        ys = np.sin(self.zr)
+        ref = model.predict_result(self.zr, ys)
+        res = model.predict_local(self.zr, self.xr.shape[0], ys, memory=20000)   # all points are neighbours
+        for a, b in zip(res, ref):
+            self.assertTrue(np.allclose(a, b))
+        res = model.predict_local(self.zr, 5, outputs=('fm',))
+        self.assertTrue(res.fm.shape == ref.fm.shape and res.ys2 is None)
+        report = model.local_report(self.zr, ys, ks=(5, self.xr.shape[0]))
+        self.assertTrue(report[1]['dfm'] < 1e-8 and report[1]['mse'] > 0)
+        model = pyGPs.GPC()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.useInference('Laplace')
+        model.getPosterior(self.xc, self.yc)
+        zc = self.zc[::20]
+        ref = model.predict_result(zc)
+        res = model.predict_local(zc, self.xc.shape[0])
+        self.assertTrue(np.allclose(res.fm, ref.fm, atol=1e-4) and np.allclose(res.ym, ref.ym, atol=1e-4))
+
+
+    def test_predict_grad(self):
+        print("testing predictive gradients wrt. test inputs...")
+        models = [pyGPs.GPR(), pyGPs.GPR_FITC(), pyGPs.GPC()]
+        models[0].setPrior(mean=pyGPs.mean.Linear(D=1), kernel=pyGPs.cov.RBF() + pyGPs.cov.Linear())
+        models[1].setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF(), inducing_points=self.ur)
+        models[2].setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        data = [(self.xr, self.yr, self.zr), (self.xr, self.yr, self.zr), (self.xc, self.yc, self.zc[::20])]
+        for model, (x, y, z) in zip(models, data):
+            model.getPosterior(x, y)
+            fm, fs2, dfm, dfs2 = model.predict_grad(z)
+            res = model.predict_result(z)
+            self.assertTrue(np.allclose(fm, res.fm) and np.allclose(fs2, res.fs2))
+            for d in range(z.shape[1]):
+                e = np.zeros((1,z.shape[1])); e[0,d] = 1e-6
+                a = model.predict_result(z+e); b = model.predict_result(z-e)
+                self.assertTrue(np.allclose(dfm[:,[d]], (a.fm-b.fm)/2e-6, atol=1e-5))
+                self.assertTrue(np.allclose(dfs2[:,[d]], (a.fs2-b.fs2)/2e-6, atol=1e-5))
+
+
+    def test_compress(self):
+        print("testing compression of the posterior into a FITC model...")
+        model = pyGPs.GPR()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.getPosterior(self.xr, self.yr)
+        small, report = model.compress(8, xv=self.zr)
+        self.assertTrue(isinstance(small, pyGPs.GPR_FITC) and small.posterior.L.shape == (8,8))
+        ref = model.predict_result(self.zr)
+        res = small.predict_result(self.zr)
+        self.assertTrue(np.allclose(np.abs(res.fm - ref.fm).max(), report['dfm']))
+        self.assertTrue(np.allclose(np.abs(res.fs2 - ref.fs2).max(), report['dfs2']))
+        small, report = model.compress(self.xr.shape[0], tol=1e-3, xv=self.zr)
+        res = small.predict_result(self.zr)
+        self.assertTrue(report['dfs2'] <= 1e-3 and np.allclose(res.ym, ref.ym, atol=1e-3) and np.allclose(res.ys2, ref.ys2, atol=1e-3))
+        # the default validation inputs (a subset of at most 1000 training inputs) are seeded
+        x = np.linspace(-2, 2, 1200)[:,None]
+        model.getPosterior(x, np.sin(3*x))
+        self.assertTrue(model.compress(10)[1] == model.compress(10)[1])
+        model = pyGPs.GPC()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.getPosterior(self.xc, self.yc)
+        small, report = model.compress(self.xc.shape[0])
+        self.assertTrue(isinstance(small, pyGPs.GPC_FITC))
+        self.assertTrue(np.allclose(small.predict_result(self.zc).ym, model.predict_result(self.zc).ym, atol=1e-2))
+
+
+    def test_predict_parallel(self):
+        print("testing parallel prediction...")
+        model = pyGPs.GPR()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.getPosterior(self.xr, self.yr)
+        ys = np.sin(self.zr)
+        res = model.predict(self.zr, ys)
+        for a, b in zip(model.predict(self.zr, ys, n_jobs=2), res):
+            self.assertTrue(np.allclose(a, b))
+        self.assertTrue(np.allclose(model.predict_mean(self.zr, n_jobs=2), res[0]))
+        model.getPosterior(self.xr[:10], self.yr[:10])     # new posterior is shared anew
+        self.assertTrue(np.allclose(model.predict(self.zr, n_jobs=2)[3], model.predict(self.zr)[3]))
+        shared = pyGPs.Core.parallel._shared[model][1]
+        model.predict(self.zr, n_jobs=2)                     # unchanged posterior and functions: block reused
+        self.assertTrue(pyGPs.Core.parallel._shared[model][1] is shared)
+        model.covfunc.hyp = [0.5, 0.]                        # changed hyperparameters: shared anew
+        model.predict(self.zr, n_jobs=2)
+        self.assertFalse(pyGPs.Core.parallel._shared[model][1] is shared)
+        self.assertRaises(Exception, model.predict, self.zr, n_jobs=0)
+
+
+    def test_sample_posterior(self):
+        print("testing joint predictive covariance and posterior sampling...")
+        models = [pyGPs.GPR(), pyGPs.GPR_FITC(), pyGPs.GPC()]
+        models[0].setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        models[1].setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF(), inducing_points=self.ur)
+        models[2].setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        data = [(self.xr, self.yr, self.zr), (self.xr, self.yr, self.zr), (self.xc, self.yc, self.zc)]
+        for model, (x, y, z) in zip(models, data):
+            model.getPosterior(x, y)
+            z = z[:20]
+            ym, ys2, fm, fs2, lp = model.predict(z)
+            fm_c, C = model.predict_cov(z)
+            self.assertTrue(np.allclose(fm_c, fm) and np.allclose(np.diag(C)[:,None], fs2))
+            for method in ['exact', 'pathwise']:
+                S = model.sample_posterior(z, 2000, method=method, num_features=2000)
+                self.assertTrue(S.shape == (20, 2000))
+                self.assertTrue(np.abs(S.mean(axis=1)[:,None] - fm).max() < 0.15)
+                self.assertTrue(np.abs(np.cov(S) - C).max() < 0.15)
+
+
+    def test_save_load(self):
+        print("testing saving and loading of models...")
+        import os, tempfile
+        path = os.path.join(tempfile.mkdtemp(), 'model.gp')
+        gpr = pyGPs.GPR()
+        gpr.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        gpr.getPosterior(self.xr, self.yr)
+        fitc = pyGPs.GPR_FITC()
+        fitc.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF(), inducing_points=self.ur)
+        fitc.getPosterior(self.xr, self.yr)
+        gpc = pyGPs.GPC()
+        gpc.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        gpc.getPosterior(self.xc, self.yc)
+        for model, z in [(gpr, self.zr), (fitc, self.zr), (gpc, self.zc)]:
+            model.save(path)
+            for mmap in [True, False]:
+                loaded = pyGPs.load(path, mmap=mmap)
+                self.assertTrue(type(loaded) is type(model))
+                self.assertTrue(loaded.covfunc.hyp == model.covfunc.hyp)
+                for a, b in zip(loaded.predict(z)[:4], model.predict(z)[:4]):
+                    self.assertTrue(np.allclose(a, b))
+                if mmap:
+                    self.assertFalse(loaded.x.flags.writeable)
+        # the statistics of a FITC stream are saved and copied with the model
+        fitc.addData(self.xr[:4], self.yr[:4])
+        fitc.save(path)
+        others = [pyGPs.load(path), copy.deepcopy(fitc)]
+        fitc.addData(self.xr[4:8], self.yr[4:8])
+        for other in others:
+            other.addData(self.xr[4:8], self.yr[4:8])
+            self.assertTrue(np.allclose(other.posterior.alpha, fitc.posterior.alpha))
+        os.remove(path)
+        # models pickled by earlier versions kept the posterior in their __dict__
+        for model, z in [(gpr, self.zr), (gpc, self.zc)]:
+            state = dict(model.__dict__)
+            state['posterior'] = state.pop('_posterior')
+            del state['_predictOp'], state['_localTreeCache']
+            legacy = type(model).__new__(type(model))
+            legacy.__setstate__(state)
+            self.assertTrue(legacy.posterior is model.posterior)
+            for a, b in zip(legacy.predict(z)[:4], model.predict(z)[:4]):
+                self.assertTrue(np.allclose(a, b))
+
+
+    def test_serve(self):
+        print("testing the micro-batching prediction server...")
+        import asyncio
+        model = pyGPs.GPR()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.getPosterior(self.xr, self.yr)
+        server = pyGPs.serve.PredictionServer({'reg': model}, maxBatch=16, maxDelay=0.01)
+        host, port = server.startBackground()
+        try:
+            res = asyncio.run(pyGPs.serve.loadgen(host, port, 'reg', self.zr, concurrency=8, outputs=('ym','ys2')))
+        finally:
+            server.stopBackground()
+        ym, ys2, fm, fs2, lp = model.predict(self.zr)
+        self.assertTrue(np.allclose(np.array([r['ym'][0] for r in res['results']]), ym[:,0]))
+        self.assertTrue(np.allclose(np.array([r['ys2'][0] for r in res['results']]), ys2[:,0]))
+        stats = server.stats()
+        self.assertTrue(stats['requests'] == self.zr.shape[0] and stats['errors'] == 0)
+        self.assertTrue(stats['batches'] < stats['requests'])      # requests were coalesced
+        # wrong input dimensions are rejected, and a failing micro-batch fails all its requests
+        async def wrongDims():
+            server = pyGPs.serve.PredictionServer({'reg': model}, maxDelay=0.05)
+            try:
+                status, res = await server._handle('POST', '/predict/reg', b'{"x": [[0.0, 1.0]]}')
+                good = await server.predict('reg', self.zr[:2])
+                loop = asyncio.get_event_loop()
+                futures = [loop.create_future(), loop.create_future()]
+                await server.batchers['reg'].queue.put((self.zr[:1], ('ym',), futures[0]))
+                await server.batchers['reg'].queue.put((np.zeros((1,2)), ('ym',), futures[1]))
+                failed = await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), 5)
+                statusLp, res = await server._handle('POST', '/predict/reg', b'{"x": [[0.0]], "outputs": ["lp"]}')
+                futures = [loop.create_future(), loop.create_future()]      # fails when the results are split
+                await server.batchers['reg'].queue.put((self.zr[:1], ('ym',), futures[0]))
+                await server.batchers['reg'].queue.put((self.zr[:1], ('bogus',), futures[1]))
+                failed += await asyncio.wait_for(asyncio.gather(*futures, return_exceptions=True), 5)
+            finally:
+                await server.stop()
+            return status, statusLp, good, failed
+        status, statusLp, good, failed = asyncio.run(wrongDims())
+        self.assertEqual(status, 400)
+        self.assertEqual(statusLp, 400)
+        self.assertTrue(len(good['ym']) == 2)
+        self.assertTrue(all(isinstance(e, Exception) for e in failed))
+
+
+    def test_GPR_window(self):
+        print("testing sliding window GP regression...")
+        model = pyGPs.GPR()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        model.setWindow(size=12, refresh=4)
+        t = np.arange(self.xr.shape[0])
+        for i in range(0, self.xr.shape[0], 3):
+            model.addData(self.xr[i:i+3], self.yr[i:i+3], t=t[i:i+3])
+        self.assertTrue(model.x.shape[0] == 12)
+        refit = pyGPs.GPR()
+        refit.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF())
+        nlZ, dnlZ, post = refit.getPosterior(self.xr[-12:], self.yr[-12:])
+        self.assertTrue(np.abs(model.nlZ - nlZ) < 1e-8)
+        self.assertTrue(np.allclose(model.posterior.alpha, post.alpha))
+        self.assertTrue(np.allclose(model.posterior.L, post.L))
+        model.setWindow(horizon=5.)
+        model.addData(self.xr[:2], self.yr[:2], t=[t[-1]+1, t[-1]+2])
+        self.assertTrue(model.x.shape[0] == 6)
+
+
     def test_GPC(self):
         print("testing GP classification...")
         model = pyGPs.GPC()
@@ -101,6 +427,58 @@ class ModelTests(unittest.TestCase):
         self.checkRegressionOutput(model)
 
 
+    def test_GPR_FITC_inducing(self):
+        print("testing inducing point selection for GP sparse regression...")
+        x = np.random.normal(size=(200,10))
+        y = np.random.normal(size=(200,1))
+        for method in ['random', 'kmeans', 'variance', 'grid']:
+            model = pyGPs.GPR_FITC(num_inducing=20, inducing_method=method)
+            model.setData(x, y)
+            self.assertTrue(model.u.shape[1] == 10 and 0 < model.u.shape[0] <= 20)
+            model.getPosterior()
+            self.assertTrue(np.isfinite(model.nlZ))
+            # the random methods are seeded by the model: refitting gives the same model
+            other = pyGPs.GPR_FITC(num_inducing=20, inducing_method=method)
+            other.setData(x, y)
+            other.getPosterior()
+            self.assertTrue(np.array_equal(other.u, model.u) and other.nlZ == model.nlZ)
+        model = pyGPs.GPR_FITC()
+        model.setData(x, y)                       # a 5^10 grid would be far too large
+        self.assertTrue(model.u.shape[0] <= 200)
+
+
+    def test_GPR_FITC_addData(self):
+        print("testing streaming updates for GP sparse regression...")
+        model = pyGPs.GPR_FITC()
+        model.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF(), inducing_points=self.ur)
+        for i in range(0, self.xr.shape[0], 4):
+            model.addData(self.xr[i:i+4], self.yr[i:i+4])
+        refit = pyGPs.GPR_FITC()
+        refit.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF(), inducing_points=self.ur)
+        nlZ, dnlZ, post = refit.getPosterior(self.xr, self.yr)
+        self.assertTrue(np.abs(model.nlZ - nlZ) < 1e-8)
+        self.assertTrue(np.allclose(model.posterior.alpha, post.alpha))
+        self.assertTrue(np.allclose(model.posterior.L, post.L))
+        model.partial_fit(self.xr[:4], self.yr[:4], forget=0.5, inducing_points=self.ur+0.1)
+        self.assertTrue(model.nlZ is None)
+        model.predict(self.zr)
+        self.checkRegressionOutput(model)
+        # model.x, model.y hold the last batch only: refitting needs the full data
+        self.assertRaises(Exception, model.getPosterior)
+        self.assertRaises(Exception, model.optimize)
+        model.getPosterior(self.xr, self.yr)
+        self.assertTrue(np.isfinite(model.nlZ))
+        # inducing points given with the first batch of an empty model
+        model = pyGPs.GPR_FITC()
+        model.setPrior(mean=pyGPs.mean.Zero())
+        model.addData(self.xr[:4], self.yr[:4], inducing_points=self.ur)
+        model.addData(self.xr[4:], self.yr[4:])
+        refit.setPrior(mean=pyGPs.mean.Zero(), kernel=pyGPs.cov.RBF(), inducing_points=self.ur)
+        nlZ, dnlZ, post = refit.getPosterior(self.xr, self.yr)
+        self.assertTrue(isinstance(model.covfunc, pyGPs.cov.FITCOfKernel))
+        self.assertTrue(np.abs(model.nlZ - nlZ) < 1e-8)
+
+
     def test_GPC_FITC(self):
         print("testing GP sparse classification...")
         model = pyGPs.GPC_FITC()
@@ -70,6 +70,99 @@ class OptTests(unittest.TestCase):
 
 
 
+    def test_LBFGSB(self):
+        print("testing L-BFGS-B with bounds ...")
+        optimizer = pyGPs.Core.opt.LBFGSB(self.model)
+        self.checkOptimizer(optimizer)
+        optimizer = pyGPs.Core.opt.LBFGSB(self.model, bounds=[(-1,1), (-1,-0.5), (-1,1)])
+        optimalHyp, funcValue = optimizer.findMin(self.x, self.y)
+        self.assertTrue(np.all(optimalHyp >= -1) and optimalHyp[1] <= -0.5)
+
+
+
+    def test_TrustConstr(self):
+        print("testing trust-region method with bounds ...")
+        optimizer = pyGPs.Core.opt.TrustConstr(self.model)
+        self.checkOptimizer(optimizer)
+
+
+
+    def test_Coordinate(self):
+        print("testing coordinate-wise minimize ...")
+        model = pyGPs.GPR()
+        model.useInference("ExactEig")
+        model.getPosterior(self.x, self.y)
+        optimalHyp, funcValue = pyGPs.Core.opt.Coordinate(model).findMin(self.x, self.y)
+        reference = pyGPs.GPR()
+        reference.getPosterior(self.x, self.y)
+        optimalHyp_m, funcValue_m = pyGPs.Core.opt.Minimize(reference).findMin(self.x, self.y)
+        self.assertTrue(funcValue < self.nlZ_beforeOpt)
+        self.assertTrue(np.abs(funcValue - funcValue_m) < 1e-6)
+        self.assertTrue(np.allclose(optimalHyp, optimalHyp_m, atol=1e-4))
+        # the configuration error is not hidden by the failed runs
+        with self.assertRaises(Exception) as error:
+            pyGPs.Core.opt.Coordinate(self.model).findMin(self.x, self.y)
+        self.assertTrue('cheapHypIndex' in str(error.exception))
+
+
+
+    def test_objectiveCache(self):
+        print("testing cached objective ...")
+        optimizer = pyGPs.Core.opt.CG(self.model)
+        hyp = optimizer._convert_to_array()
+        calls = [0]
+        getPosterior = self.model.getPosterior
+        def counted(*args, **kwargs):
+            calls[0] += 1
+            return getPosterior(*args, **kwargs)
+        self.model.getPosterior = counted
+        nlZ, dnlZ = optimizer._nlzAnddnlz(hyp)
+        self.assertEqual(optimizer._nlml(hyp.copy()), nlZ)
+        self.assertTrue(np.array_equal(optimizer._dnlml(hyp.copy()), dnlZ))
+        self.assertEqual(calls[0], 1)
+        optimizer._nlml(hyp+0.1)
+        self.assertEqual(calls[0], 2)
+        self.assertTrue(np.allclose(nlZ, self.nlZ_beforeOpt))
+
+
+
+    def test_restarts(self):
+        print("testing random restarts ...")
+        result = []
+        for n_jobs in [1, 2]:
+            model = pyGPs.GPR()
+            model.setData(self.x, self.y)
+            model.setOptimizer("BFGS", num_restarts=4, n_jobs=n_jobs, seed=0)
+            optimalHyp, funcValue = model.optimizer.findMin(self.x, self.y)
+            self.assertEqual(model.optimizer.trailsCounter, 4)
+            result.append((optimalHyp, funcValue))
+        self.assertTrue(result[0][1] < self.nlZ_beforeOpt)
+        self.assertEqual(result[0][1], result[1][1])
+        self.assertTrue(np.array_equal(result[0][0], result[1][0]))
+        model.setOptimizer("BFGS", min_threshold=result[0][1]+1., n_jobs=2, seed=0)
+        model.optimizer.findMin(self.x, self.y)
+        self.assertTrue(model.optimizer.trailsCounter < 4)
+        model.setOptimizer("BFGS", num_restarts=4, n_jobs=0)
+        self.assertRaises(Exception, model.optimizer.findMin, self.x, self.y)
+
+
+
+    def test_halving(self):
+        print("testing space-filling designs and successive halving ...")
+        for design in ["sobol", "lhs"]:
+            model = pyGPs.GPR()
+            model.setData(self.x, self.y)
+            model.setOptimizer("BFGS", num_restarts=9, seed=0, design=design, halving=3)
+            optimalHyp, funcValue = model.optimizer.findMin(self.x, self.y)
+            self.assertTrue(funcValue < self.nlZ_beforeOpt)
+            model.optimizer._apply_in_objects(optimalHyp)
+            self.assertTrue(np.allclose(model.getPosterior(der=False)[0], funcValue))
+        guesses = model.optimizer.searchConfig.initialGuesses(0)
+        hyp = np.array([next(guesses) for i in range(8)])
+        self.assertTrue(np.all(hyp >= -5) and np.all(hyp <= 5))
+
+
+
     # Test your customized mean function
     '''
     def test_MyOptimizer(self):